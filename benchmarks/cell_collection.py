@@ -0,0 +1,139 @@
+"""
+Compares rendering a collection of cells item by item, the way `Cell.render_cell`
+did it before, with the batched `Cell.render_collection`.
+
+The per-item baseline repeats what the old loop did for each item: it looks up the
+cell class with `app.get_cell_class`, constructs the cell, computes its template path
+from the class name and renders the template. "cells" only measures the part before
+rendering.
+
+Run with:
+
+    python benchmarks/cell_collection.py [number of items]
+"""
+import sys
+import timeit
+from types import SimpleNamespace as N
+
+import case_conversion
+import jinja2
+from markupsafe import Markup
+
+from ekklesia_common.cell import Cell, JinjaCellEnvironment
+from ekklesia_common.cell_app import CellApp
+
+TEMPLATES = {
+    "item.j2.jade": "li.item\n  a(href=self_link)= title\n",
+    "list.j2.jade": "ul\n  = render_cell(collection=items)\n",
+}
+
+
+class Item:
+    def __init__(self, id, title):
+        self.id = id
+        self.title = title
+
+
+class BenchmarkApp(CellApp):
+    pass
+
+
+@BenchmarkApp.cell()
+class ItemCell(Cell):
+    _model: Item
+    model_properties = ["id", "title"]
+    template_prefix = None
+
+    def self_link(self):
+        return f"/items/{self._model.id}"
+
+
+class ListCell(Cell):
+    model_properties = ["items"]
+    template_prefix = None
+
+
+def make_request():
+    from ekklesia_common.templating import PugExtension
+
+    BenchmarkApp.commit()
+    app = BenchmarkApp()
+    env = JinjaCellEnvironment(
+        loader=jinja2.DictLoader(TEMPLATES), extensions=[PugExtension], autoescape=True
+    )
+
+    def render_template(name, **context):
+        return env.get_template(name).render(**context)
+
+    return N(
+        app=app,
+        current_user=None,
+        i18n=N(gettext=lambda s: s),
+        render_template=render_template,
+    )
+
+
+def old_template_path(cell):
+    """Cell.template_path as it was before, computed for each cell."""
+    name = case_conversion.snakecase(type(cell).__name__[: -len("Cell")])
+    if cell.template_prefix is not None:
+        return f"{cell.template_prefix}/{name}.j2.jade"
+    return f"{name}.j2.jade"
+
+
+def render_per_item(parent, collection, separator="\n"):
+    app = parent._app
+    request = parent._request
+    parts = []
+    for item in collection:
+        # No cached lookups, like the old Cell.cell() and Cell.show().
+        cell_class = app.get_cell_class(item, "")
+        cell = cell_class(model=item, request=request, layout=None, parent=parent)
+        parts.append(cell.render_template(old_template_path(cell)))
+    return Markup(separator.join(parts))
+
+
+def create_cells_per_item(parent, collection):
+    """Only the lookup and construction part of `render_per_item`."""
+    app = parent._app
+    request = parent._request
+    cells = []
+    for item in collection:
+        cell_class = app.get_cell_class(item, "")
+        cell = cell_class(model=item, request=request, layout=None, parent=parent)
+        old_template_path(cell)
+        cells.append(cell)
+    return cells
+
+
+def main():
+    num_items = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    request = make_request()
+    items = [Item(i, f"Item {i}") for i in range(num_items)]
+    parent = ListCell(N(items=items), request)
+
+    per_item = render_per_item(parent, items)
+    batched = parent.render_collection(items)
+    assert per_item == batched, "outputs differ!"
+    chunked = "".join(parent.render_collection(items, chunk_size=100))
+    assert chunked == batched, "chunked output differs!"
+
+    repeat = 10
+    timings = {}
+    for name, func in [
+        ("per item", lambda: render_per_item(parent, items)),
+        ("render_collection", lambda: parent.render_collection(items)),
+        ("per item cells", lambda: create_cells_per_item(parent, items)),
+        ("cell() cells", lambda: [parent.cell(item).template_path for item in items]),
+    ]:
+        best = timings[name] = min(timeit.repeat(func, number=1, repeat=repeat))
+        print(f"{name:>20}: {best * 1000:8.2f}ms for {num_items} items")
+
+    for baseline, new in [
+        ("per item", "render_collection"),
+        ("per item cells", "cell() cells"),
+    ]:
+        print(f"{new:>20}: {timings[baseline] / timings[new]:8.2f}x vs {baseline}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Compares rendering a large collection of cells to HTML with `Cell.render_collection`
+with serializing the same collection to JSON with `Cell.json_data_for_collection`,
+which is what the JSON views of cells registered with `json_view=True` do.
+
+Run with:
+
+    python benchmarks/cell_json.py [number of items]
+"""
+import sys
+import timeit
+from types import SimpleNamespace as N
+
+import jinja2
+
+from ekklesia_common.cell import Cell, JinjaCellEnvironment
+from ekklesia_common.cell_app import CellApp
+from ekklesia_common.utils import json_bytes
+
+TEMPLATES = {
+    "item.j2.jade": (
+        "li.item\n"
+        "  a(href=self_link)= title\n"
+        "  p.abstract= abstract\n"
+        "  span.supporters= supporter_count\n"
+    ),
+}
+
+
+class Item:
+    def __init__(self, id, title):
+        self.id = id
+        self.title = title
+        self.abstract = f"Abstract of {title}"
+        self.supporter_count = id % 100
+
+
+class BenchmarkApp(CellApp):
+    pass
+
+
+@BenchmarkApp.cell(json_view=True)
+class ItemCell(Cell):
+    _model: Item
+    model_properties = ["id", "title", "abstract", "supporter_count"]
+    json_properties = ["self_link"]
+    template_prefix = None
+
+    def self_link(self):
+        return f"/items/{self._model.id}"
+
+
+class ListCell(Cell):
+    template_prefix = None
+
+
+def make_request():
+    from ekklesia_common.templating import PugExtension
+
+    BenchmarkApp.commit()
+    app = BenchmarkApp()
+    env = JinjaCellEnvironment(
+        loader=jinja2.DictLoader(TEMPLATES), extensions=[PugExtension], autoescape=True
+    )
+
+    def render_template(name, **context):
+        return env.get_template(name).render(**context)
+
+    return N(
+        app=app,
+        current_user=None,
+        i18n=N(gettext=lambda s: s),
+        render_template=render_template,
+    )
+
+
+def main():
+    num_items = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    request = make_request()
+    items = [Item(i, f"Item {i}") for i in range(num_items)]
+    parent = ListCell(N(), request)
+
+    html = parent.render_collection(items)
+    json = json_bytes(parent.json_data_for_collection(items))
+    print(f"{'HTML size':>20}: {len(html.encode()):8} bytes")
+    print(f"{'JSON size':>20}: {len(json):8} bytes")
+
+    repeat = 5
+    for name, func in [
+        ("HTML", lambda: parent.render_collection(items)),
+        ("JSON", lambda: json_bytes(parent.json_data_for_collection(items))),
+    ]:
+        best = min(timeit.repeat(func, number=1, repeat=repeat))
+        print(f"{name:>20}: {best * 1000:8.2f}ms for {num_items} items")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Compares rendering an edit form with the previous `contract.Form`, which created new
+translation domains and a new `deform.ZPTRendererFactory` for each form, with the
+current one using a shared renderer factory and cached translations.
+
+Run with:
+
+    python benchmarks/form_render.py [number of forms]
+"""
+import sys
+import timeit
+from types import SimpleNamespace as N
+
+import deform
+from babel import Locale
+from more.babel_i18n.domain import Domain
+
+from ekklesia_common.contract import (
+    COLANDER_TRANSLATION_DIR,
+    DEFORM_TRANSLATION_DIR,
+    Form,
+    Schema,
+    bool_property,
+    date_property,
+    int_property,
+    string_property,
+)
+
+
+class EditSchema(Schema):
+    title = string_property()
+    abstract = string_property(missing="")
+    content = string_property(missing="")
+    votes = int_property(missing=0)
+    public = bool_property(missing=False)
+    published = date_property(missing=None)
+
+
+class PreviousForm(deform.Form):
+    def __init__(self, schema, request, *args, **kwargs) -> None:
+        domains = {
+            "colander": Domain(
+                request=request, dirname=COLANDER_TRANSLATION_DIR, domain="colander"
+            ),
+            "deform": Domain(
+                request=request, dirname=DEFORM_TRANSLATION_DIR, domain="deform"
+            ),
+            "messages": Domain(
+                request=request, dirname=request.app.translation_dir, domain="messages"
+            ),
+        }
+
+        def translator(term):
+            domain = domains.get(term.domain)
+            if domain is None:
+                return term.interpolate()
+            else:
+                translated = domain.gettext(term)
+                return term.interpolate(translated)
+
+        renderer = deform.ZPTRendererFactory(
+            Form.deform_template_dirs, translator=translator
+        )
+        super().__init__(schema, *args, renderer=renderer, **kwargs)
+
+
+def make_request():
+    return N(
+        i18n=N(get_locale=lambda: Locale("de")),
+        app=N(translation_dir=DEFORM_TRANSLATION_DIR),
+    )
+
+
+def render_invalid(form_class):
+    # Each form is rendered in a new request, like an edit page with errors.
+    form = form_class(EditSchema(), make_request(), buttons=("submit",))
+    try:
+        form.validate([("title", ""), ("votes", "x")])
+    except deform.ValidationFailure as e:
+        return e.render()
+
+
+def main():
+    num = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+
+    for name, form_class in [("previous", PreviousForm), ("current", Form)]:
+        duration = min(
+            timeit.repeat(lambda: render_invalid(form_class), number=num, repeat=3)
+        )
+        print(f"{name:>10}: {duration / num * 1000:7.2f}ms per form")
+
+
+if __name__ == "__main__":
+    main()
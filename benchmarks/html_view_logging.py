@@ -0,0 +1,91 @@
+"""
+Measures the overhead of the eliot context that `ConceptApp.html` adds to every view
+call. The previous implementation serialized the whole model with `to_dict()` for
+each call, the current one logs only the model identity.
+
+Run with:
+
+    python benchmarks/html_view_logging.py [number of calls]
+"""
+import os
+import sys
+import timeit
+from datetime import datetime
+from types import SimpleNamespace as N
+
+import eliot
+from eliot import start_action
+from sqlalchemy import DateTime, Integer, Text
+
+from ekklesia_common.concept import ConceptApp
+from ekklesia_common.database import Base, C, LIDType
+from ekklesia_common.lid import LID
+from ekklesia_common.logging import EkklesiaLogEncoder
+
+
+class BenchmarkModel(Base):
+    __tablename__ = "benchmark_html_view_model"
+    id = C(LIDType, primary_key=True)
+    title = C(Text)
+    abstract = C(Text)
+    content = C(Text)
+    motivation = C(Text)
+    votes = C(Integer)
+    created_at = C(DateTime)
+
+
+class BenchmarkApp(ConceptApp):
+    pass
+
+
+def view(self, request):
+    return ""
+
+
+# The decorator builds the log context from the module path of the view.
+view.__module__ = "benchmarks.html_view_logging"
+# Dectate directives return the decorated function, which is the log wrapper here.
+current_view = BenchmarkApp.html(model=BenchmarkModel)(view)
+
+
+def make_previous_view(ctx):
+    def log_wrapper(*args, **kwargs):
+        model = args[0]
+        model_data = model.to_dict() if hasattr(model, "to_dict") else model
+        ctx["model"] = model_data
+        args[1].view_name = ctx["view"]
+        with start_action(action_type="html_view", **ctx):
+            return view(*args, **kwargs)
+
+    return log_wrapper
+
+
+previous_view = make_previous_view(
+    {"module": "benchmarks.html_view_logging", "view": "view"}
+)
+
+
+def main():
+    num = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+    model = BenchmarkModel(
+        id=LID(),
+        title="title",
+        abstract="abstract " * 20,
+        content="content " * 500,
+        motivation="motivation " * 100,
+        votes=42,
+        created_at=datetime.now(),
+    )
+    request = N(view_name=None)
+    # Messages are serialized and written like in an app using init_logging().
+    eliot.to_file(open(os.devnull, "w"), encoder=EkklesiaLogEncoder)
+
+    for name, wrapped_view in [("previous", previous_view), ("current", current_view)]:
+        duration = min(
+            timeit.repeat(lambda: wrapped_view(model, request), number=num, repeat=3)
+        )
+        print(f"{name:>10}: {duration / num * 1_000_000:6.2f}µs per view call")
+
+
+if __name__ == "__main__":
+    main()
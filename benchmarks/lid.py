@@ -0,0 +1,89 @@
+"""
+Micro-benchmarks for LID compared with the previous implementation, which encoded
+the string representation eagerly in __init__ using base32_crockford.
+
+Run with:
+
+    python benchmarks/lid.py
+"""
+import timeit
+from array import array
+from datetime import datetime, timezone
+from functools import cached_property
+
+import base32_crockford
+
+from ekklesia_common.lid import LID
+
+
+class PreviousLID:
+    def __init__(self, lid: int) -> None:
+        milliseconds = lid >> 22
+        rand = lid & (2**22 - 1)
+        ts_repr = f"{base32_crockford.encode(milliseconds):0>9s}"
+        rand_repr = f"{base32_crockford.encode(rand):0>5s}"
+        self.repr = ts_repr + "-" + rand_repr
+        self.lid = lid
+        self.milliseconds = milliseconds
+
+    def __str__(self):
+        return self.repr
+
+    @classmethod
+    def from_str(cls, lid_str):
+        ts_repr, rand_repr = lid_str.split("-")
+        milliseconds = base32_crockford.decode(ts_repr)
+        rand = base32_crockford.decode(rand_repr)
+        return cls((milliseconds << 22) | rand)
+
+    @cached_property
+    def datetime(self):
+        return datetime.fromtimestamp(self.milliseconds / 1000, tz=timezone.utc)
+
+
+NUM = 100_000
+LID_INTS = array("q", [LID().lid for _ in range(NUM)])
+LID_STRS = [str(LID(lid_int)) for lid_int in LID_INTS]
+
+BENCHMARKS = [
+    (
+        "from int (like loading rows)",
+        lambda: [PreviousLID(i) for i in LID_INTS],
+        lambda: [LID(i) for i in LID_INTS],
+    ),
+    (
+        "from int + str()",
+        lambda: [str(PreviousLID(i)) for i in LID_INTS],
+        lambda: [str(LID(i)) for i in LID_INTS],
+    ),
+    (
+        "from_str",
+        lambda: [PreviousLID.from_str(s) for s in LID_STRS],
+        lambda: [LID.from_str(s) for s in LID_STRS],
+    ),
+    (
+        "encode_many",
+        lambda: [str(PreviousLID(i)) for i in LID_INTS],
+        lambda: LID.encode_many(LID_INTS),
+    ),
+    (
+        "decode_many",
+        lambda: array("q", [PreviousLID.from_str(s).lid for s in LID_STRS]),
+        lambda: LID.decode_many(LID_STRS),
+    ),
+]
+
+
+def main():
+    for name, previous, current in BENCHMARKS:
+        previous_time = min(timeit.repeat(previous, number=1, repeat=3))
+        current_time = min(timeit.repeat(current, number=1, repeat=3))
+        print(
+            f"{name:>30}: previous {previous_time * 1000:8.2f}ms, "
+            f"current {current_time * 1000:8.2f}ms "
+            f"({previous_time / current_time:.1f}x) for {NUM} LIDs"
+        )
+
+
+if __name__ == "__main__":
+    main()
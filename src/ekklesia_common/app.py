@@ -1,28 +1,44 @@
 import secrets
+import threading
+from contextlib import ExitStack
 from datetime import datetime
 from functools import cached_property
 
 import morepath
-from eliot import start_task
+import morepath.publish
+from eliot import Message, start_task
 import more.babel_i18n
 import more.browser_session
 import more.forwarded
 import more.transaction
+import transaction
 from pkg_resources import resource_filename
 from webob.exc import HTTPError
 
 import ekklesia_common
+from ekklesia_common import metrics
 from ekklesia_common.cell import JinjaCellEnvironment
 from ekklesia_common.cell_app import CellApp
 from ekklesia_common.concept import ConceptApp
 from ekklesia_common.contract import FormApp
 from ekklesia_common.ekklesia_auth import EkklesiaAuthApp
 from ekklesia_common.errors import exception_uid
-from ekklesia_common.identity_policy import NoIdentity
+from ekklesia_common.identity_policy import NoIdentity, identity_cache
 from ekklesia_common.lid import LID
 from ekklesia_common.permission import WritePermission
-from ekklesia_common.request import EkklesiaRequest
-from ekklesia_common.templating import make_jinja_env, make_template_loader
+from ekklesia_common.render_cache import make_render_cache
+from ekklesia_common.request import EkklesiaRequest, StreamingBody
+from ekklesia_common.request_log import RequestLogProfile
+from ekklesia_common.sql_instrumentation import (
+    StatementBudget,
+    StatementBudgetExceeded,
+    track_statements,
+)
+from ekklesia_common.templating import (
+    make_bytecode_cache,
+    make_jinja_env,
+    make_template_loader,
+)
 
 
 SQL_PRINT_PREFIX = "sql>"
@@ -46,17 +62,44 @@ class EkklesiaBrowserApp(
     def translation_dir(self):
         return resource_filename(self.package_name, "translations/")
 
+    @cached_property
+    def render_cache(self):
+        return make_render_cache(self.settings.render_cache)
+
     def __init__(self):
         super().__init__()
         ekklesia_common.morepath_scan_deps()
         template_loader = make_template_loader(
             self.__class__.config, self.__class__.package_name
         )
+        bytecode_cache = make_bytecode_cache(self.settings.common.template_cache_dir)
         self.jinja_env = make_jinja_env(
             jinja_environment_class=JinjaCellEnvironment,
-            jinja_options=dict(loader=template_loader),
+            jinja_options=dict(loader=template_loader, bytecode_cache=bytecode_cache),
             app=self,
         )
+        identity_cache.ttl = self.settings.identity_cache.ttl
+        identity_cache.max_entries = self.settings.identity_cache.max_entries
+        metrics_settings = self.settings.metrics
+        if metrics_settings.multiprocess_dir:
+            metrics.registry.enable_multiprocess(
+                metrics_settings.multiprocess_dir, metrics_settings.write_interval
+            )
+
+    @morepath.reify
+    def publish(self):
+        """Like `morepath.App.publish`, but without the tween of more.transaction
+        because `make_transaction_tween` replaces it.
+        """
+        if not self.is_committed():
+            self.commit()
+        result = morepath.publish.publish
+        tween_factories = self.config.tween_registry.sorted_tween_factories()
+        for tween_factory in reversed(tween_factories):
+            if tween_factory is more.transaction.main.transaction_tween_factory:
+                continue
+            result = tween_factory(self, result)
+        return result
 
 
 @EkklesiaBrowserApp.permission_rule(
@@ -84,6 +127,17 @@ def common_setting_section():
         "fail_on_form_validation_error": False,
         "force_ssl": False,
         "instance_name": "ekklesia_app",
+        # characters collected before a chunk of a streaming response is sent
+        "template_stream_buffer_size": 8192,
+        # compiled templates are stored here, see `ekklesia-compile-templates`
+        "template_cache_dir": None,
+        # request logging verbosity: full, sampled or errors_only,
+        # see `ekklesia_common.request_log`
+        "log_profile": "full",
+        "log_sample_percent": 10,
+        # buffered requests taking longer than this are logged, None disables it
+        "log_latency_threshold_ms": 1000,
+        "log_max_buffered_messages": 1000,
     }
 
 
@@ -93,6 +147,65 @@ def database_setting_section():
     return {
         "enable_statement_history": False,
         "print_sql_statements": False,
+        # statement timing, see `database.sql_instrumentation`
+        "enable_sql_instrumentation": True,
+        # statements that take longer are logged, no logging if None
+        "slow_query_ms": 300,
+        # Per-request limits for SQL statements, a message is logged for requests
+        # exceeding them. Needs enable_sql_instrumentation, None disables a limit.
+        "statement_budget": 100,
+        "statement_time_budget_ms": 1000,
+        # same statement executed more often in a request, hints at N+1 queries
+        "repeated_statement_threshold": 10,
+        # raise an exception instead of logging, useful for tests
+        "fail_on_statement_budget_exceeded": False,
+        # `queue` uses a connection pool per process,
+        # `null` opens a new connection each time, for external poolers like pgbouncer
+        "pool_mode": "queue",
+        # options for the connection pool, SQLAlchemy defaults are used if None.
+        # Ignored for databases that don't use a queue pool, like SQLite.
+        "pool_size": None,
+        "max_overflow": None,
+        "pool_timeout": None,
+        "pool_recycle": None,
+        "pool_pre_ping": False,
+    }
+
+
+@EkklesiaBrowserApp.setting_section(section="identity_cache")
+def identity_cache_setting_section():
+    """Cache for users loaded by `EkklesiaIdentityPolicy`, see
+    `ekklesia_common.identity_policy.IdentityCache`.
+    """
+    return {
+        # seconds, 0 disables caching
+        "ttl": 0,
+        "max_entries": 1000,
+    }
+
+
+@EkklesiaBrowserApp.setting_section(section="metrics")
+def metrics_setting_section():
+    """Request timing metrics, see `ekklesia_common.metrics`.
+    Set `multiprocess_dir` to a directory shared by all worker processes to
+    combine their values.
+    """
+    return {
+        "multiprocess_dir": None,
+        "write_interval": 10,  # seconds
+    }
+
+
+@EkklesiaBrowserApp.setting_section(section="render_cache")
+def render_cache_setting_section():
+    """Cache for rendered HTML of cells that set `cache_rendering`.
+    Backend can be `memory` or `sqlite` (needs `path`), no caching if empty.
+    """
+    return {
+        "backend": None,
+        "max_entries": 10000,
+        "ttl": 300,  # seconds
+        "path": None,
     }
 
 
@@ -101,6 +214,66 @@ def static_files_setting_section():
     return {"base_url": "/static"}
 
 
+class StreamingTransaction(threading.local):
+    """Given to the tween of more.transaction in place of the `transaction`
+    module. It forwards everything to `transaction.manager`, but commit and abort
+    are postponed until the body is complete for responses with a
+    `StreamingBody`, so the body can still use the database session.
+    """
+
+    streamed_body = None
+
+    @property
+    def manager(self):
+        return self
+
+    def __getattr__(self, name):
+        return getattr(transaction.manager.manager, name)
+
+    def begin(self):
+        self.streamed_body = None
+        return transaction.manager.begin()
+
+    def commit(self):
+        if self.streamed_body is None:
+            return transaction.manager.commit()
+        self.streamed_body.exit_stack.push(_finish_transaction_after_body(False))
+
+    def abort(self):
+        if self.streamed_body is None:
+            return transaction.manager.abort()
+        self.streamed_body.exit_stack.push(_finish_transaction_after_body(True))
+
+
+def _finish_transaction_after_body(abort):
+    def finish_transaction(exc_type, exc, tb):
+        manager = transaction.manager
+        if abort or exc_type is not None or manager.isDoomed():
+            manager.abort()
+        else:
+            manager.commit()
+
+    return finish_transaction
+
+
+@EkklesiaBrowserApp.tween_factory(over=morepath.EXCVIEW)
+def make_transaction_tween(app, handler):
+    """Overrides the tween of more.transaction (see `EkklesiaBrowserApp.publish`)
+    with the same tween that uses a `StreamingTransaction`.
+    """
+    streaming_transaction = StreamingTransaction()
+
+    def streaming_body_tween(request):
+        response = handler(request)
+        if isinstance(response.app_iter, StreamingBody):
+            streaming_transaction.streamed_body = response.app_iter
+        return response
+
+    return more.transaction.main.transaction_tween_factory(
+        app, streaming_body_tween, transaction=streaming_transaction
+    )
+
+
 class UnhandledRequestException(RuntimeError):
     def __init__(self, task_uuid, xid):
         self.task_uuid = task_uuid
@@ -114,39 +287,96 @@ class UnhandledRequestException(RuntimeError):
 @EkklesiaBrowserApp.tween_factory()
 def make_ekklesia_log_tween(app: EkklesiaBrowserApp, handler):
     db_settings = app.settings.database
+    log_profile = RequestLogProfile.from_settings(app.settings.common)
 
     print_sql_statements = (
         db_settings.enable_statement_history and db_settings.print_sql_statements
     )
 
+    def check_statement_budget(request, budget):
+        violations = budget.violations()
+        if not violations:
+            return
+
+        Message.log(
+            message_type="sql-budget-exceeded",
+            log_level="WARNING",
+            view=getattr(request, "view_name", None),
+            statements=budget.count,
+            duration_ms=budget.duration_ms,
+            violations=violations,
+        )
+
+        if db_settings.fail_on_statement_budget_exceeded:
+            raise StatementBudgetExceeded(violations)
+
+    def finish_request(request, response, budget, log_buffer, history):
+        check_statement_budget(request, budget)
+
+        if print_sql_statements:
+            print()
+            print(f"{SQL_PRINT_PREFIX}SQL statements for this request")
+            history.print_statements(prefix=SQL_PRINT_PREFIX)
+            print(
+                f"{SQL_PRINT_PREFIX}{len(history)} SQL statements, duration "
+                f"{history.overall_duration_ms():.2f}ms"
+            )
+            print()
+
+        if log_buffer is not None:
+            log_buffer.set_status(response.status_code)
+
     def ekklesia_log_tween(request):
         request_data = {"url": request.url, "headers": dict(request.headers)}
+        budget = StatementBudget(
+            db_settings.statement_budget,
+            db_settings.statement_time_budget_ms,
+            db_settings.repeated_statement_threshold,
+        )
 
-        user = request.current_user
+        with ExitStack() as stack:
+            # Statements for loading the current user are counted, too.
+            stack.enter_context(track_statements(budget))
+            user = request.current_user
 
-        if user is not None:
-            request_data["user"] = user.id
+            if user is not None:
+                request_data["user"] = user.id
 
-        with start_task(action_type="request", request=request_data) as task:
+            log_buffer = stack.enter_context(log_profile.request_log())
+            task = stack.enter_context(
+                start_task(action_type="request", request=request_data)
+            )
             try:
+                history = None
                 if print_sql_statements:
                     history = (
                         request.db_session.connection().connection.connection.history
                     )
                     history.clear()
+
+                # Runs after the duration has been observed, also on errors.
+                stack.callback(metrics.registry.maybe_write_snapshot)
+                stack.enter_context(metrics.REQUEST_DURATION.time())
                 response = handler(request)
 
-                if print_sql_statements:
-                    print()
-                    print(f"{SQL_PRINT_PREFIX}SQL statements for this request")
-                    history.print_statements(prefix=SQL_PRINT_PREFIX)
-                    print(
-                        f"{SQL_PRINT_PREFIX}{len(history)} SQL statements, duration "
-                        f"{history.overall_duration_ms():.2f}ms"
-                    )
-                    print()
+                body = response.app_iter
+                if isinstance(body, StreamingBody):
+                    # The request is finished when the body has been generated.
+                    @stack.push
+                    def finish_streamed_request(exc_type, exc, tb):
+                        if exc_type is None:
+                            finish_request(
+                                request, response, budget, log_buffer, history
+                            )
+
+                    body.exit_stack.push(stack.pop_all())
+                    return response
+
+                finish_request(request, response, budget, log_buffer, history)
                 return response
-            except HTTPError:
+            except HTTPError as e:
+                if log_buffer is not None:
+                    log_buffer.set_status(e.code)
                 # Let Morepath handle this (exception views).
                 raise
             except Exception as e:
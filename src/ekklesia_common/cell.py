@@ -1,7 +1,17 @@
 import inspect
 import os.path
-from functools import cached_property
-from typing import Any, ClassVar, Dict, Iterable, Type
+from functools import cached_property, wraps
+from types import MappingProxyType
+from typing import (
+    Any,
+    Callable,
+    ClassVar,
+    Dict,
+    Iterable,
+    Iterator,
+    Mapping,
+    Type,
+)
 
 import case_conversion
 import jinja2
@@ -9,6 +19,55 @@ import jinja2.utils
 from markupsafe import Markup
 from webob import Request
 
+
+def _resolve_cell_attribute(cell, name):
+    """Resolves attributes, cached properties and fragments defined by the cell class."""
+    try:
+        return object.__getattribute__(cell, name)
+    except Exception as e:
+        raise CellAttributeAccessError(cell, name, e) from e
+
+
+def _resolve_model_property(cell, name):
+    """Passes through to the model unless the cell instance overrides the attribute."""
+    instance_dict = object.__getattribute__(cell, "__dict__")
+    if name in instance_dict:
+        return instance_dict[name]
+
+    try:
+        return getattr(object.__getattribute__(cell, "_model"), name)
+    except AttributeError as e:
+        raise KeyError(str(e))
+
+
+def _resolve_instance_attribute(cell, name):
+    """Fallback for names that are unknown to the cell class."""
+    return object.__getattribute__(cell, "__dict__").get(name, jinja2.utils.missing)
+
+
+def _all_subclasses(cls):
+    for subclass in cls.__subclasses__():
+        yield subclass
+        yield from _all_subclasses(subclass)
+
+
+def resolve_cell_attribute(cell, name):
+    """Looks up `name` in the cell like the template context does.
+    Returns `jinja2.utils.missing` if the cell doesn't know the name.
+    """
+    resolver = type(cell)._resolution_plan.get(name, _resolve_instance_attribute)
+    return resolver(cell, name)
+
+
+def _callable_without_arguments(method) -> bool:
+    """Checks if all parameters of `method`, except `self`, are optional."""
+    parameters = list(inspect.signature(method).parameters.values())[1:]
+    return all(
+        p.default is not p.empty or p.kind in (p.VAR_POSITIONAL, p.VAR_KEYWORD)
+        for p in parameters
+    )
+
+
 class CellMeta(type):
     """
     Registers Cell types that are bound to a Model class.
@@ -23,6 +82,42 @@ class CellMeta(type):
                 cls.template_prefix = None
 
         super().__init__(name, bases, attrs)
+        cls._build_resolution_plan()
+        cls._collect_target_fragments()
+
+    def _build_resolution_plan(cls):
+        """Precomputes how template variables are looked up for instances of this class.
+        Members of the class (attributes, cached properties, fragments) take precedence
+        over `model_properties` which are passed through to the model.
+        """
+        plan: Dict[str, Callable] = {
+            name: _resolve_cell_attribute for name in dir(cls)
+        }
+
+        for name in cls.model_properties:
+            plan.setdefault(name, _resolve_model_property)
+
+        type.__setattr__(cls, "_resolution_plan", MappingProxyType(plan))
+
+    def _collect_target_fragments(cls):
+        """Fragments that can be called without arguments. Only these can be
+        selected by htmx targets, which are controlled by the client.
+        """
+        fragments = frozenset(
+            name
+            for name in dir(cls)
+            if getattr(getattr(cls, name, None), "_fragment", False)
+            and _callable_without_arguments(getattr(cls, name))
+        )
+        type.__setattr__(cls, "_target_fragments", fragments)
+
+    def __setattr__(cls, name, value):
+        super().__setattr__(name, value)
+        # Keep the resolution plans in sync if the class is changed after creation.
+        if "_resolution_plan" in cls.__dict__:
+            for klass in [cls, *_all_subclasses(cls)]:
+                klass._build_resolution_plan()
+                klass._collect_target_fragments()
 
     def __new__(mcs, name, bases, dct):
         # only for subclasses, not for Cell class
@@ -40,6 +135,12 @@ class CellMeta(type):
         return super().__new__(mcs, name, bases, dct)
 
 
+#: option values of these types can be part of `Cell.cache_key`
+_SIMPLE_OPTION_TYPES = (str, int, float, bool, type(None))
+
+_default_template_paths: Dict[tuple, str] = {}
+
+
 class CellAttributeAccessError(Exception):
     def __init__(self, cell, attribute_name, exception) -> None:
         cell_type = type(cell).__name__
@@ -73,8 +174,22 @@ class Cell(metaclass=CellMeta):
     model_properties: Iterable[str] = []
     layout = True
     template_prefix: ClassVar[str]
+    _resolution_plan: ClassVar[Mapping[str, Callable]]
     #: class that should be used to mark safe HTML output. Must be a subclass of str.
     markup_class: Type[str] = Markup
+    #: cache output of `show()` and fragments in the app's render cache, see `cache_key`
+    cache_rendering = False
+    #: permissions checked for the current user that are part of the cache key.
+    #: If empty, the id of the current user is used instead.
+    cache_permissions: Iterable[Type] = ()
+    #: send the output of the cell view as streaming response, see `stream()`
+    stream_response = False
+    #: cell attributes and cached properties that are included in `json_data()`
+    #: in addition to `model_properties`
+    json_properties: Iterable[str] = ()
+    #: maps ids of htmx target elements to fragment method names,
+    #: see `fragment_for_target()`
+    htmx_fragments: Mapping[str, str] = {}
 
     def __init__(
         self,
@@ -97,6 +212,7 @@ class Cell(metaclass=CellMeta):
         self.collection = collection
         self._template_path = template_path
         self.options = options
+        self._cell_classes = {}
         # if no parent is set, the layout is enabled by default.
         # This can be overridden by the `layout` arg.
         if layout is not None:
@@ -115,12 +231,21 @@ class Cell(metaclass=CellMeta):
                     "Cell name does not end with Cell, you must override template_path!"
                 )
 
-            name = case_conversion.snakecase(cell_name[: -len("Cell")])
+            # Converting the name is slow, it's done once per class and prefix.
+            key = (type(self), self.template_prefix)
+            template_path = _default_template_paths.get(key)
 
-            if self.template_prefix is not None:
-                self._template_path = f"{self.template_prefix}/{name}.j2.jade"
-            else:
-                self._template_path = f"{name}.j2.jade"
+            if template_path is None:
+                name = case_conversion.snakecase(cell_name[: -len("Cell")])
+
+                if self.template_prefix is not None:
+                    template_path = f"{self.template_prefix}/{name}.j2.jade"
+                else:
+                    template_path = f"{name}.j2.jade"
+
+                _default_template_paths[key] = template_path
+
+            self._template_path = template_path
 
         return self._template_path
 
@@ -130,7 +255,92 @@ class Cell(metaclass=CellMeta):
         )
 
     def show(self):
-        return self.render_template(self.template_path)
+        return self._render_cached(
+            "show", lambda: self.render_template(self.template_path)
+        )
+
+    def stream(self, buffer_size: int = None) -> Iterator[str]:
+        """Renders the cell template incrementally, yielding chunks of HTML."""
+        return self._request.stream_template(
+            self.template_path, buffer_size=buffer_size, _cell=self
+        )
+
+    def json_data(self) -> Dict[str, Any]:
+        """Returns `model_properties` and `json_properties` as dict.
+        Used by the JSON view of the cell which doesn't render any templates.
+        """
+        model = self._model
+        data = {name: getattr(model, name) for name in self.model_properties}
+        for name in self.json_properties:
+            data[name] = getattr(self, name)
+        return data
+
+    def json_data_for_collection(self, collection: Iterable, **options) -> list:
+        """Returns `json_data()` of a cell for each item of `collection`.
+        Like `render_collection`, cells are created with `cell()`.
+        """
+        return [
+            self.cell(item, layout=False, **options).json_data() for item in collection
+        ]
+
+    @cached_property
+    def cache_key(self):
+        """Key for the render cache that must cover everything the output depends on.
+        The model is identified by its id and version (`updated_at` or `created_at`),
+        model properties are not evaluated.
+        Cells can override this. If None is returned, output is not cached.
+        """
+        model = self._model
+        model_id = getattr(model, "id", None)
+        if model_id is None:
+            return None
+
+        options = tuple(sorted(self.options.items()))
+        if not all(isinstance(v, _SIMPLE_OPTION_TYPES) for _, v in options):
+            return None
+
+        if self.cache_permissions:
+            user_key = tuple(
+                self._request.permitted_for_current_user(model, permission)
+                for permission in self.cache_permissions
+            )
+        else:
+            user_key = getattr(self.current_user, "id", None)
+
+        return (
+            type(self).__module__,
+            type(self).__qualname__,
+            type(model).__name__,
+            model_id,
+            getattr(model, "updated_at", getattr(model, "created_at", None)),
+            str(self._request.i18n.get_locale()),
+            user_key,
+            options,
+        )
+
+    def _render_cached(self, view_name, render):
+        # Layouts contain per-request content like flash messages and CSRF tokens.
+        if not self.cache_rendering or self.layout:
+            return render()
+
+        render_cache = getattr(self._app, "render_cache", None)
+        if render_cache is None:
+            return render()
+
+        cell_key = self.cache_key
+        if cell_key is None:
+            return render()
+
+        key = render_cache.make_key((cell_key, view_name), self._model)
+        cached = render_cache.get(key)
+        if cached is not None:
+            return self.markup_class(cached)
+
+        rendered = render()
+        # Fragments may render nothing, only cache actual output.
+        if rendered is not None:
+            render_cache.set(key, str(rendered))
+        return rendered
 
     # template helpers
 
@@ -150,11 +360,22 @@ class Cell(metaclass=CellMeta):
         The parent cell is set to self which also means that it will be rendered without
         layout by default.
         """
-        cell_class = self._app.get_cell_class(model, view_name)
+        cell_class = self._cell_class(model, view_name)
         return cell_class(
             model=model, request=self._request, layout=layout, parent=self, **options
         )
 
+    def _cell_class(self, model, view_name):
+        """Cell classes are registered per model class, so lookups are kept for
+        rendering further models of the same type, in collections for example.
+        """
+        key = (type(model), view_name)
+        cell_class = self._cell_classes.get(key)
+        if cell_class is None:
+            cell_class = self._app.get_cell_class(model, view_name)
+            self._cell_classes[key] = cell_class
+        return cell_class
+
     def render_cell(
         self,
         model=None,
@@ -168,34 +389,18 @@ class Cell(metaclass=CellMeta):
         The parent cell is set to self which also means that it will be rendered without
         layout by default.
         """
-        view_method_name = view_name if view_name is not None else "show"
         if collection is not None:
             if model is not None:
                 raise ValueError(
                     "model and collection arguments cannot be used together!"
                 )
 
-            parts = []
-
-            for item in collection:
-                view_method = getattr(
-                    self.cell(item, layout=layout, **options), view_method_name
-                )
-
-                if not callable(view_method):
-                    raise ValueError(
-                        f"view method '{view_method_name}' of {item} is not callable, "
-                        f"it is: {view_method}"
-                    )
-
-                parts.append(view_method())
-
-            if separator is None:
-                separator = "\n"
-
-            return self.markup_class(separator.join(parts))
+            return self.render_collection(
+                collection, view_name, separator, layout, **options
+            )
 
         else:
+            view_method_name = view_name if view_name is not None else "show"
             view_method = getattr(
                 self.cell(model, layout=layout, **options), view_method_name
             )
@@ -206,6 +411,67 @@ class Cell(metaclass=CellMeta):
                 )
             return view_method()
 
+    def render_collection(
+        self,
+        collection: Iterable,
+        view_name: str = None,
+        separator: str = None,
+        layout: bool = None,
+        chunk_size: int = None,
+        **options,
+    ):
+        """Render a cell for each item of `collection` and join the results.
+        Cell classes are looked up once per model type instead of once per item.
+
+        If `chunk_size` is given, a generator is returned that yields the output
+        for `chunk_size` items at a time, which can be used for streaming responses.
+        Joining the chunks gives the same result as rendering without `chunk_size`.
+        """
+        if separator is None:
+            separator = "\n"
+
+        parts = self._render_collection_parts(collection, view_name, layout, options)
+
+        if chunk_size is None:
+            return self.markup_class(separator.join(parts))
+
+        return self._render_collection_chunks(parts, separator, chunk_size)
+
+    def _render_collection_parts(self, collection, view_name, layout, options):
+        view_method_name = view_name if view_name is not None else "show"
+
+        for item in collection:
+            cell = self.cell(item, layout=layout, **options)
+            view_method = getattr(cell, view_method_name)
+
+            if not callable(view_method):
+                raise ValueError(
+                    f"view method '{view_method_name}' of {item} is not callable, "
+                    f"it is: {view_method}"
+                )
+
+            yield view_method()
+
+    def _render_collection_chunks(self, parts, separator, chunk_size):
+        chunk = []
+        first = True
+
+        for part in parts:
+            chunk.append(part)
+            if len(chunk) == chunk_size:
+                yield self._join_chunk(chunk, separator, first)
+                chunk = []
+                first = False
+
+        if chunk:
+            yield self._join_chunk(chunk, separator, first)
+
+    def _join_chunk(self, chunk, separator, first):
+        joined = separator.join(chunk)
+        if not first:
+            joined = separator + joined
+        return self.markup_class(joined)
+
     @classmethod
     def fragment(cls, func_or_name):
         """Decorator for cell methods that provide additional HTML.
@@ -219,8 +485,16 @@ class Cell(metaclass=CellMeta):
         """
         if callable(func_or_name):
             func = func_or_name
-            func._fragment = True
-            return func
+
+            @wraps(func)
+            def fragment_method(self, *args, **kwargs):
+                # Only fragments without arguments can be cached.
+                if args or kwargs:
+                    return func(self, *args, **kwargs)
+                return self._render_cached(func.__name__, lambda: func(self))
+
+            fragment_method._fragment = True
+            return fragment_method
         else:
             name = func_or_name
 
@@ -229,12 +503,33 @@ class Cell(metaclass=CellMeta):
                     template = f"{self.template_prefix}/{name}.j2.jade"
                 else:
                     template = f"{name}.j2.jade"
-                return self.render_template(template)
+                return self._render_cached(
+                    name, lambda: self.render_template(template)
+                )
 
             fragment_method._fragment = True
             fragment_method.__name__ = name
             return fragment_method
 
+    @classmethod
+    def fragment_for_target(cls, target: str):
+        """Returns the name of the fragment method that renders the content of the
+        htmx target element with the id `target`, None if there is no such fragment.
+        Targets are looked up in `htmx_fragments`, other target ids are used as
+        method name with dashes replaced by underscores.
+        Only methods created by `fragment()` or `template_fragment()` that can be
+        called without arguments are used.
+        """
+        name = cls.htmx_fragments.get(target, target.replace("-", "_"))
+        if name in cls._target_fragments:
+            return name
+        return None
+
+    @classmethod
+    def has_fragments(cls) -> bool:
+        """Returns True if the cell has fragments that htmx targets can map to."""
+        return bool(cls._target_fragments)
+
     @classmethod
     def template_fragment(cls, template_name: str):
         """This can be used for template fragmentation or alternative presentation
@@ -251,7 +546,9 @@ class Cell(metaclass=CellMeta):
                 template = f"{self.template_prefix}/{template_name}.j2.jade"
             else:
                 template = f"{template_name}.j2.jade"
-            return self.render_template(template)
+            return self._render_cached(
+                template_name, lambda: self.render_template(template)
+            )
 
         fragment_method._fragment = True
         fragment_method.__name__ = template_name
@@ -309,7 +606,10 @@ class Cell(metaclass=CellMeta):
             raise KeyError(str(e))
 
     def __contains__(self, name):
-        return name in self.model_properties or hasattr(self, name)
+        return (
+            name in type(self)._resolution_plan
+            or name in object.__getattribute__(self, "__dict__")
+        )
 
 class EditCellMixin(Cell):
     pass
@@ -329,18 +629,17 @@ class JinjaCellContext(jinja2.runtime.Context):
         self._cell = parent.get("_cell")
 
     def resolve_or_missing(self, key):
-        resolved = super().resolve_or_missing(key)
+        cell = self._cell
 
-        if self._cell is not None:
-            cell = self._cell
-            if key == "_request":
-                return cell._request
+        if cell is not None:
+            resolved = resolve_cell_attribute(cell, key)
+            if resolved is not jinja2.utils.missing:
+                return resolved
 
-            if key in cell:
-                return cell[key]
+        resolved = super().resolve_or_missing(key)
 
-            if resolved == jinja2.utils.missing:
-                raise CellAttributeNotFound(cell, key)
+        if cell is not None and resolved is jinja2.utils.missing:
+            raise CellAttributeNotFound(cell, key)
 
         return resolved
 
@@ -17,6 +17,61 @@ from morepath.directive import (
 )
 
 from ekklesia_common.cell import EditCellMixin, NewCellMixin
+from ekklesia_common.utils import json_bytes
+from ekklesia_common.request import streaming_html_response
+
+
+def json_view_name(cell_name: str) -> str:
+    """Name of the JSON view that is registered for a cell with `json_view=True`."""
+    return f"{cell_name}.json" if cell_name else "json"
+
+
+def make_cell_view(cell_class):
+    """Creates a view that renders `cell_class`.
+    For htmx requests with a target that maps to a fragment of the cell (see
+    `Cell.fragment_for_target`), only that fragment is rendered, without layout.
+    """
+    # Without fragments, the response doesn't depend on the htmx headers.
+    has_fragments = cell_class.has_fragments()
+
+    def cell_view(self, request):
+        if not has_fragments:
+            fragment_name = None
+        else:
+            target = request.htmx_target
+            fragment_name = cell_class.fragment_for_target(target) if target else None
+
+            @request.after
+            def vary_on_htmx(response):
+                # Responses for htmx requests differ from full pages for the same URL.
+                response.vary = (*(response.vary or ()), "HX-Request", "HX-Target")
+
+        if fragment_name is not None:
+            cell = cell_class(self, request, layout=False)
+            return getattr(cell, fragment_name)()
+
+        cell = cell_class(self, request)
+
+        if cell_class.stream_response:
+            return streaming_html_response(cell.stream())
+
+        return cell.show()
+
+    return cell_view
+
+
+def cell_json_view(cell_class):
+    """Creates a view that responds with `cell_class.json_data()`.
+    No templates are rendered.
+    """
+
+    def json_view(self, request):
+        cell = cell_class(self, request, layout=False)
+        return morepath.Response(
+            body=json_bytes(cell.json_data()), content_type="application/json"
+        )
+
+    return json_view
 
 
 class CellAction(dectate.Action):
@@ -56,13 +111,8 @@ class CellAction(dectate.Action):
         def get_cell_class(self, model, name):
             return obj
 
-        def cell_view(self, request):
-            cell = obj(self, request)
-            return cell.show()
-
         obj.model = self.model
         app_class.get_cell_class.register(get_cell_class, **self.key_dict())
-        app_class.html(cell_view)
 
 
 class CellApp(morepath.App):
@@ -70,7 +120,23 @@ class CellApp(morepath.App):
     _cell = dectate.directive(CellAction)
 
     @classmethod
-    def cell(cls, name="", permission=None, model=None, **predicates):
+    def cell(
+        cls,
+        name="",
+        permission=None,
+        model=None,
+        html_view=False,
+        json_view=False,
+        **predicates,
+    ):
+        """Registers a cell class for a model.
+        With `html_view=True`, a HTML view with the same name is registered that
+        renders the cell, see `make_cell_view`. Without it, the view must be
+        registered separately, for example with
+        `App.html(model=Model)(make_cell_view(ModelCell))`.
+        With `json_view=True`, a view named `json` (or `{name}.json`) is registered
+        in addition which returns `Cell.json_data()` as JSON.
+        """
 
         def _decorator(cell_class):
             nonlocal name
@@ -90,6 +156,19 @@ class CellApp(morepath.App):
             code_info = dectate.config.CodeInfo(path, lineno, sourceline)
             directive.code_info = code_info
             directive(cell_class)
+
+            if html_view:
+                view_directive = cls.html(model=model, name=name, permission=permission)
+                view_directive.code_info = code_info
+                view_directive(make_cell_view(cell_class))
+
+            if json_view:
+                view_directive = cls.view(
+                    model=model, name=json_view_name(name), permission=permission
+                )
+                view_directive.code_info = code_info
+                view_directive(cell_json_view(cell_class))
+
             return cell_class
 
         return _decorator
@@ -0,0 +1,64 @@
+"""
+Compile all Pug templates of an app ahead of time and store them in the template
+cache directory. Workers that use the same `common.template_cache_dir` setting load
+the compiled templates from there instead of compiling them on first use.
+
+Usage:
+
+    ekklesia-compile-templates ekklesia_portal.app:EkklesiaPortalApp /var/cache/templates
+"""
+import argparse
+import importlib
+import sys
+
+import morepath
+
+import ekklesia_common
+from ekklesia_common.cell import JinjaCellEnvironment
+from ekklesia_common.templating import (
+    compile_templates,
+    make_bytecode_cache,
+    make_jinja_env,
+    make_template_loader,
+    versioned_template_cache_dir,
+)
+
+parser = argparse.ArgumentParser("Ekklesia Common compile_templates.py")
+parser.add_argument(
+    "app_class", help="app class to compile templates for, like `package.module:App`"
+)
+parser.add_argument("cache_dir", help="base directory for compiled templates")
+
+
+def load_app_class(app_class_path: str):
+    module_name, class_name = app_class_path.split(":")
+    module = importlib.import_module(module_name)
+    return getattr(module, class_name)
+
+
+def main():
+    args = parser.parse_args()
+    app_class = load_app_class(args.app_class)
+    # Concepts are registered in modules that the app module doesn't import.
+    ekklesia_common.morepath_scan_deps()
+    morepath.scan(importlib.import_module(app_class.package_name))
+    app_class.commit()
+    template_loader = make_template_loader(app_class.config, app_class.package_name)
+    jinja_env = make_jinja_env(
+        jinja_environment_class=JinjaCellEnvironment,
+        jinja_options=dict(
+            loader=template_loader,
+            bytecode_cache=make_bytecode_cache(args.cache_dir),
+        ),
+        app=None,
+    )
+    names = compile_templates(jinja_env)
+    if not names:
+        sys.exit(f"no templates found for {args.app_class}")
+
+    cache_dir = versioned_template_cache_dir(args.cache_dir)
+    print(f"compiled {len(names)} templates to {cache_dir}")
+
+
+if __name__ == "__main__":
+    main()
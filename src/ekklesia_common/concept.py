@@ -1,3 +1,4 @@
+import logging
 import sys
 from functools import wraps
 from typing import get_type_hints
@@ -8,6 +9,23 @@ from dectate import directive
 from dectate.config import create_code_info
 from eliot import start_action
 
+from ekklesia_common import metrics
+
+logg = logging.getLogger(__name__)
+
+
+def model_identity(model) -> dict:
+    """Class name and id of the model. Cheap enough to log it for every view call."""
+    identity = {"class": type(model).__name__}
+    model_id = getattr(model, "id", None)
+    if model_id is not None:
+        identity["id"] = str(model_id)
+    return identity
+
+
+def model_data(model):
+    return model.to_dict() if hasattr(model, "to_dict") else model
+
 
 class ConceptAction(dectate.Action):
     config = {"concepts": dict}
@@ -72,12 +90,31 @@ class ConceptApp(morepath.App):
             def log_wrapper(*args, **kwargs):
 
                 model = args[0]
-                model_data = model.to_dict() if hasattr(model, "to_dict") else model
-
-                ctx["model"] = model_data
-
-                with start_action(action_type="html_view", **ctx):
-                    return fn(*args, **kwargs)
+                # ctx is shared by all calls of the view, use a copy for this call.
+                view_ctx = {**ctx, "model": model_identity(model)}
+                # Serializing the full model is only done when it's needed.
+                log_model_data = logg.isEnabledFor(logging.DEBUG)
+                if log_model_data:
+                    view_ctx["model_data"] = model_data(model)
+
+                # used by the log tween to report the view in request-level messages
+                args[1].view_name = ctx["view"]
+
+                with start_action(
+                    action_type="html_view", **view_ctx
+                ) as action, metrics.VIEW_DURATION.time(view=ctx["view"]):
+                    try:
+                        return fn(*args, **kwargs)
+                    except Exception:
+                        if not log_model_data:
+                            # Loading the model may fail, too, for example if the
+                            # session is broken. Don't hide the original exception.
+                            try:
+                                data = model_data(model)
+                            except Exception as e:
+                                data = f"<model_data failed: {e!r}>"
+                            action.log(message_type="html_view:model", model_data=data)
+                        raise
 
             return sup_decorator(log_wrapper)
 
@@ -1,21 +1,83 @@
 import json
+import re
 from functools import wraps
+from typing import Optional
 
 import colander
 import dectate
 import deform
 import morepath
-from deform.widget import HiddenWidget, Select2Widget
+import orjson
+from deform.widget import (
+    HiddenWidget,
+    RadioChoiceWidget,
+    Select2Widget,
+    SelectWidget,
+    TextAreaWidget,
+    TextInputWidget,
+)
 from eliot import Message, log_call, start_action
 from more.babel_i18n.domain import Domain
 from morepath.directive import HtmlAction, ViewAction
 from morepath.view import render_html
 from pkg_resources import resource_filename
+from translationstring import ChameleonTranslate
+
+from ekklesia_common import metrics
+
+
+#: default limits for JSON object fields
+JSON_OBJECT_MAX_BYTES = 1024 * 1024
+JSON_OBJECT_MAX_DEPTH = 64
+
+_JSON_NESTING_RE = re.compile(rb'"(?:[^"\\]|\\.)*"|[\[{]|[\]}]')
+
+
+def json_nesting_depth(data: bytes) -> int:
+    """Returns the maximum nesting depth of arrays and objects in the JSON
+    document without parsing it. Brackets in strings are ignored.
+    """
+    depth = max_depth = 0
+    for match in _JSON_NESTING_RE.finditer(data):
+        token = match.group()
+        if token in (b"{", b"["):
+            depth += 1
+            max_depth = max(depth, max_depth)
+        elif token in (b"}", b"]"):
+            depth -= 1
+
+    return max_depth
+
+
+def _load_json(data: bytes):
+    try:
+        return orjson.loads(data)
+    except orjson.JSONDecodeError:
+        # orjson rejects some input the json module accepts, like NaN or integers
+        # with more than 64 bits. The json module decides if it's valid.
+        return json.loads(data)
 
 
 class JSONObject(colander.SchemaType):
-    def __init__(self, allow_empty=False):
+    """JSON object in a text field. It's parsed with orjson if possible and
+    serialized with the json module, which formats it for humans.
+
+    Input larger than `max_bytes` (UTF-8 encoded) or nested deeper than `max_depth`
+    is rejected before parsing, None disables a limit. If `schema` is given, the
+    parsed object is deserialized with it, so its fields are validated, too.
+    """
+
+    def __init__(
+        self,
+        allow_empty=False,
+        max_bytes: Optional[int] = JSON_OBJECT_MAX_BYTES,
+        max_depth: Optional[int] = JSON_OBJECT_MAX_DEPTH,
+        schema: Optional[colander.SchemaNode] = None,
+    ):
         self.allow_empty = allow_empty
+        self.max_bytes = max_bytes
+        self.max_depth = max_depth
+        self.schema = schema
 
     def serialize(self, node, appstruct):
         if appstruct is colander.null:
@@ -57,8 +119,34 @@ class JSONObject(colander.SchemaType):
                     "${val} does not represent a JSON object", mapping={"val": cstruct}
                 ),
             )
+
+        data = cstruct.encode("utf8")
+
+        if self.max_bytes is not None and len(data) > self.max_bytes:
+            raise colander.Invalid(
+                node,
+                colander._(
+                    "JSON object is larger than ${max} bytes",
+                    mapping={"max": self.max_bytes},
+                ),
+            )
+
+        # Counting brackets is cheap, scanning is only needed if there are many.
+        if (
+            self.max_depth is not None
+            and data.count(b"{") + data.count(b"[") > self.max_depth
+            and json_nesting_depth(data) > self.max_depth
+        ):
+            raise colander.Invalid(
+                node,
+                colander._(
+                    "JSON object is nested deeper than ${max} levels",
+                    mapping={"max": self.max_depth},
+                ),
+            )
+
         try:
-            result = json.loads(cstruct)
+            result = _load_json(data)
         except json.JSONDecodeError as e:
             raise colander.Invalid(
                 node,
@@ -68,6 +156,19 @@ class JSONObject(colander.SchemaType):
                 ),
             )
 
+        if self.schema is not None:
+            try:
+                result = self.schema.deserialize(result)
+            except colander.Invalid as e:
+                errors = "; ".join(f"{k}: {v}" for k, v in e.asdict().items())
+                raise colander.Invalid(
+                    node,
+                    colander._(
+                        "JSON object has invalid content: ${errors}",
+                        mapping={"errors": errors},
+                    ),
+                )
+
         return result
 
 
@@ -107,8 +208,15 @@ def enum_property(enum_cls, **kwargs):
     return colander.SchemaNode(colander.Enum(enum_cls), **kwargs)
 
 
-def json_property(**kwargs):
-    return colander.SchemaNode(JSONObject(), **kwargs)
+def json_property(
+    max_bytes=JSON_OBJECT_MAX_BYTES,
+    max_depth=JSON_OBJECT_MAX_DEPTH,
+    schema=None,
+    **kwargs,
+):
+    return colander.SchemaNode(
+        JSONObject(max_bytes=max_bytes, max_depth=max_depth, schema=schema), **kwargs
+    )
 
 
 class Schema(colander.MappingSchema):
@@ -119,39 +227,99 @@ COLANDER_TRANSLATION_DIR = resource_filename("colander", "locale/")
 DEFORM_TRANSLATION_DIR = resource_filename("deform", "locale/")
 
 
+class CachedDomain(Domain):
+    """Domain that shares loaded translations with all other instances for the same
+    directory and domain, so translation files are loaded once per locale.
+    """
+
+    _caches: dict[tuple[str, str], dict] = {}
+
+    def __init__(self, request=None, dirname=None, domain="messages"):
+        super().__init__(request, dirname, domain)
+        self.cache = CachedDomain._caches.setdefault((dirname, domain), {})
+
+
+def request_translator(request):
+    """Returns a function that translates colander, deform and app messages for the
+    locale of `request`. It's created once per request.
+    """
+    translator = getattr(request, "_form_translator", None)
+    if translator is not None:
+        return translator
+
+    domains = {
+        "colander": CachedDomain(
+            request=request, dirname=COLANDER_TRANSLATION_DIR, domain="colander"
+        ),
+        "deform": CachedDomain(
+            request=request, dirname=DEFORM_TRANSLATION_DIR, domain="deform"
+        ),
+        "messages": CachedDomain(
+            request=request, dirname=request.app.translation_dir, domain="messages"
+        ),
+    }
+
+    def translator(term):
+        domain = domains.get(term.domain)
+        if domain is None:
+            return term.interpolate()
+        else:
+            translated = domain.gettext(term)
+            return term.interpolate(translated)
+
+    request._form_translator = translator
+    return translator
+
+
+_renderer_factories: dict[tuple[str, ...], deform.ZPTRendererFactory] = {}
+
+
+def shared_renderer_factory(template_dirs) -> deform.ZPTRendererFactory:
+    """Returns a renderer factory without translator for the template directories.
+    Compiled templates are kept by the factory, so they are shared by all forms
+    using the same directories.
+    """
+    key = tuple(template_dirs)
+    factory = _renderer_factories.get(key)
+    if factory is None:
+        factory = _renderer_factories[key] = deform.ZPTRendererFactory(key)
+    return factory
+
+
+class TranslatingRenderer:
+    """Deform renderer that uses a shared renderer factory and passes the translator
+    of the current request to each template.
+    """
+
+    def __init__(self, factory: deform.ZPTRendererFactory, translator) -> None:
+        self.factory = factory
+        # used by `deform.Field.translate`
+        self.translate = translator
+        self._chameleon_translate = ChameleonTranslate(translator)
+
+    def __call__(self, template_name, **kw):
+        return self.load(template_name)(translate=self._chameleon_translate, **kw)
+
+    def load(self, template_name):
+        return self.factory.load(template_name)
+
+
 class Form(deform.Form):
     """
     Deform Form with more.babel_i18n integration.
     """
 
     deform_template_dirs = [resource_filename("deform", "templates/")]
+    #: If set, `get_form_data` validates submitted data with a `CompiledValidator`
+    #: first, see there.
+    use_compiled_validator = False
 
     def __init__(
         self, schema: Schema, request: morepath.Request, *args, **kwargs
     ) -> None:
-        # Domain depends on request, so it must be created here
-        domains = {
-            "colander": Domain(
-                request=request, dirname=COLANDER_TRANSLATION_DIR, domain="colander"
-            ),
-            "deform": Domain(
-                request=request, dirname=DEFORM_TRANSLATION_DIR, domain="deform"
-            ),
-            "messages": Domain(
-                request=request, dirname=request.app.translation_dir, domain="messages"
-            ),
-        }
-
-        def translator(term):
-            domain = domains.get(term.domain)
-            if domain is None:
-                return term.interpolate()
-            else:
-                translated = domain.gettext(term)
-                return term.interpolate(translated)
-
-        renderer = deform.ZPTRendererFactory(
-            self.__class__.deform_template_dirs, translator=translator
+        renderer = TranslatingRenderer(
+            shared_renderer_factory(self.__class__.deform_template_dirs),
+            request_translator(request),
         )
         super().__init__(schema, *args, renderer=renderer, **kwargs)
 
@@ -164,16 +332,94 @@ class Form(deform.Form):
         pass
 
 
+#: schema types and widgets that can be handled by `CompiledValidator`
+COMPILED_VALIDATOR_TYPES = (colander.String, colander.Int, colander.Enum, JSONObject)
+COMPILED_VALIDATOR_WIDGETS = (
+    TextInputWidget,
+    TextAreaWidget,
+    HiddenWidget,
+    SelectWidget,
+    Select2Widget,
+    RadioChoiceWidget,
+)
+
+
+def _has_deferred(node) -> bool:
+    return any(isinstance(value, colander.deferred) for value in vars(node).values())
+
+
+class CompiledValidator:
+    """Validates flat form data like `deform.Form.validate` does, but without
+    peppercorn parsing and without walking deform's field tree.
+
+    It uses the schema and the widgets of a form, so everything the form set up
+    in `__init__`, like bound values, validators and widgets, applies. Each field
+    value is taken from the submitted data and deserialized by the field's widget.
+    The result is deserialized by the schema, so colander validators, preparers
+    and `missing` values work as usual.
+    """
+
+    def __init__(self, form: deform.Form) -> None:
+        self.schema = form.schema
+        self.fields = [(field.name, field.widget, field) for field in form.children]
+
+    @classmethod
+    def for_form(cls, form: deform.Form) -> Optional["CompiledValidator"]:
+        """Returns None if the form contains unsupported nodes or widgets."""
+        if _has_deferred(form.schema):
+            return None
+
+        for field in form.children:
+            node = field.schema
+            if not isinstance(node.typ, COMPILED_VALIDATOR_TYPES):
+                return None
+            if _has_deferred(node) or node.children:
+                return None
+            if type(field.widget) not in COMPILED_VALIDATOR_WIDGETS:
+                return None
+            if getattr(field.widget, "multiple", False):
+                return None
+
+        return cls(form)
+
+    def validate(self, post) -> Optional[dict]:
+        """Returns the appstruct for the submitted data in the MultiDict `post` or
+        None if it's invalid or can't be handled here.
+        """
+        if "__start__" in post or "__end__" in post:
+            # Nested data, only deform can interpret it.
+            return None
+
+        cstruct = {}
+
+        try:
+            for name, widget, field in self.fields:
+                # Like peppercorn, this uses the last value if a name is repeated.
+                cstruct[name] = widget.deserialize(field, post.get(name, colander.null))
+
+            return self.schema.deserialize(cstruct)
+        except colander.Invalid:
+            return None
+
+
 def get_form_data(model, form_class, cell_class, view_name, request):
     form = form_class(request, request.link(model, name="+" + view_name))
-    controls = list(request.POST.items())
+    post = request.POST
     with start_action(
         action_type="validate_form",
-        controls=dict(c for c in controls if not c[0].startswith("_")),
+        controls={k: v for k, v in post.items() if not k.startswith("_")},
         form=form,
-    ):
+    ), metrics.FORM_VALIDATION_DURATION.time():
+        if getattr(form, "use_compiled_validator", False):
+            validator = CompiledValidator.for_form(form)
+            if validator is not None:
+                appstruct = validator.validate(post)
+                if appstruct is not None:
+                    return appstruct, None
+
+        # Invalid data is handled by deform, which also renders the errors.
         try:
-            return form.validate(controls), None
+            return form.validate(list(post.items())), None
         except deform.ValidationFailure:
             Message.log(validation_errors=form.error.asdict())
             if request.app.settings.common.fail_on_form_validation_error:
@@ -239,7 +485,9 @@ class HtmlFormAction(HtmlAction):
             if failure_response:
                 return failure_response
 
-            with start_action(action_type="call_view"):
+            with start_action(action_type="call_view"), metrics.VIEW_DURATION.time(
+                view=obj.__qualname__
+            ):
                 response = obj(self, request, appstruct)
             return response
 
@@ -1,31 +1,50 @@
+import enum
+import io
 import json
-import logging
+import operator
+import os
+import threading
 import time
+from datetime import date, datetime
+from typing import ClassVar, Iterable, List, Sequence
 
 import sqlalchemy_utils
 import yaml
 import zope.sqlalchemy
 from eliot import start_action
 from sqlalchemy import (
+    DDL,
     Column,
     DateTime,
     ForeignKey,
     Integer,
     MetaData,
     Table,
+    Text,
     create_engine,
     event,
+    inspect,
+    text,
 )
+from sqlalchemy import exc
 from sqlalchemy import func as sqlfunc
 from sqlalchemy import types
-from sqlalchemy.engine import Engine
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.compiler import compiles
 from sqlalchemy.ext.declarative import declarative_base, declared_attr
 from sqlalchemy.orm import backref, relationship, scoped_session, sessionmaker
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.pool import NullPool, QueuePool
 from sqlalchemy.schema import CreateColumn
 
+from ekklesia_common import md, metrics
 from ekklesia_common.lid import LID
 from ekklesia_common.psycopg2_debug import make_debug_connection_factory
+from ekklesia_common.sql_instrumentation import SQLInstrumentation, sqllog
+from ekklesia_common.utils import json_bytes
+
+#: Deprecated, the threshold is set by the `database.slow_query_ms` setting now.
+SLOW_QUERY_SECONDS = 0.3
 
 rel = relationship
 FK = ForeignKey
@@ -33,10 +52,6 @@ C = Column
 Table = Table
 bref = backref
 
-SLOW_QUERY_SECONDS = 0.3
-
-sqllog = logging.getLogger("sqllog")
-
 Session = scoped_session(sessionmaker())
 
 sqlalchemy_utils.force_auto_coercion()
@@ -94,6 +109,53 @@ class LIDType(
         return LID(value)
 
 
+class LIDIntType(LIDType):
+    """Like LIDType, but query results are plain ints instead of LID objects.
+    Can be used to load many LIDs without creating objects for them, for example:
+    `select(type_coerce(Proposition.id, LIDIntType))`.
+    """
+
+    cache_ok = True
+    python_type = int
+    # Using the method of the base class tells SQLAlchemy that no result
+    # processing is needed, so values are passed through as they come from the driver.
+    process_result_value = types.TypeDecorator.process_result_value
+
+
+#: Postgres function that creates LIDs with the same bit layout as `LID()`:
+#: 42 bits milliseconds since the epoch, followed by 22 bits from a cycling sequence.
+#: Like the LIDGenerator, it increments instead of using random numbers, so LIDs
+#: created in the same millisecond are distinct and ascending.
+LID_FUNCTION_DDL = DDL(
+    """
+CREATE SEQUENCE IF NOT EXISTS generate_lid_sequence
+    MINVALUE 0 MAXVALUE 4194303 START 0 CYCLE;
+CREATE OR REPLACE FUNCTION generate_lid() RETURNS bigint AS $$
+    SELECT (floor(extract(epoch FROM clock_timestamp()) * 1000)::bigint << 22)
+        | nextval('generate_lid_sequence')
+$$ LANGUAGE sql VOLATILE
+"""
+)
+
+event.listen(
+    Base.metadata, "before_create", LID_FUNCTION_DDL.execute_if(dialect="postgresql")
+)
+
+
+def lid_pk(**kwargs):
+    """LID primary key. SQLAlchemy inserts get a value from the shared LID generator,
+    so they are monotonic within the process. Inserts that bypass SQLAlchemy,
+    like `copy_insert` without an id column, get a value from `generate_lid()`.
+    """
+    return C(
+        LIDType,
+        primary_key=True,
+        default=LID,
+        server_default=text("generate_lid()"),
+        **kwargs,
+    )
+
+
 class LowerCaseText(types.TypeDecorator):
     """Converts strings to lower case on the way in."""
 
@@ -111,6 +173,101 @@ class TimeStamp(object):
         return C(DateTime, default=sqlfunc.now())
 
 
+class MarkdownHTMLMixin:
+    """Stores rendered HTML for Markdown text columns.
+    For each attribute in `markdown_columns`, the columns `{name}_html` and
+    `{name}_source_hash` are added to the model. HTML is rendered on flush if the
+    source text changed. Loaded source texts are `RenderedMarkdown` strings which
+    are passed through by the `markdown` template filter without converting them.
+    """
+
+    markdown_columns: ClassVar[Iterable[str]] = ()
+
+    def __init_subclass__(cls, **kwargs):
+        for name in cls.__dict__.get("markdown_columns", ()):
+            for suffix in ("_html", "_source_hash"):
+                if name + suffix not in cls.__dict__:
+                    setattr(cls, name + suffix, C(Text))
+
+        super().__init_subclass__(**kwargs)
+
+
+def _rendered_markdown_values(target, force=False):
+    values = {}
+
+    for name in target.markdown_columns:
+        source = getattr(target, name)
+        if source is None:
+            values[name + "_html"] = None
+            values[name + "_source_hash"] = None
+            continue
+
+        source_hash = md.source_hash(source)
+        if force or source_hash != getattr(target, name + "_source_hash"):
+            values[name + "_html"] = md.convert(source)
+            values[name + "_source_hash"] = source_hash
+
+    return values
+
+
+@event.listens_for(MarkdownHTMLMixin, "before_insert", propagate=True)
+@event.listens_for(MarkdownHTMLMixin, "before_update", propagate=True)
+def render_markdown_columns(_mapper, _connection, target):
+    for name, value in _rendered_markdown_values(target).items():
+        setattr(target, name, value)
+
+
+@event.listens_for(MarkdownHTMLMixin, "load", propagate=True)
+@event.listens_for(MarkdownHTMLMixin, "refresh", propagate=True)
+def attach_rendered_markdown(target, *_args):
+    loaded = target.__dict__
+    for name in target.markdown_columns:
+        source = loaded.get(name)
+        html = loaded.get(name + "_html")
+        if source is None or html is None or isinstance(source, md.RenderedMarkdown):
+            continue
+
+        # Ignore outdated HTML if the source was changed without using the ORM.
+        if md.source_hash(source) == loaded.get(name + "_source_hash"):
+            set_committed_value(target, name, md.RenderedMarkdown(source, html))
+
+
+def rerender_markdown(session, model_classes=None, batch_size=500) -> int:
+    """Renders the HTML for all Markdown columns again, for example after
+    `md.MARKDOWN_EXTENSIONS` changed. By default, all models using
+    `MarkdownHTMLMixin` are processed. Returns the number of updated rows.
+    """
+    if model_classes is None:
+        model_classes = [
+            mapper.class_
+            for mapper in Base.registry.mappers
+            if issubclass(mapper.class_, MarkdownHTMLMixin)
+        ]
+
+    num_rows = 0
+
+    for model_class in model_classes:
+        mapper = inspect(model_class)
+        pk_names = [mapper.get_property_by_column(c).key for c in mapper.primary_key]
+        mappings = []
+
+        for obj in session.query(model_class).yield_per(batch_size):
+            mapping = {name: getattr(obj, name) for name in pk_names}
+            mapping.update(_rendered_markdown_values(obj, force=True))
+            mappings.append(mapping)
+
+            if len(mappings) == batch_size:
+                session.bulk_update_mappings(model_class, mappings)
+                num_rows += len(mappings)
+                mappings = []
+
+        if mappings:
+            session.bulk_update_mappings(model_class, mappings)
+            num_rows += len(mappings)
+
+    return num_rows
+
+
 def integer_pk(**kwargs):
     return C(Integer, primary_key=True, **kwargs)
 
@@ -124,20 +281,139 @@ def integer_fk(*args, **kwargs):
         raise ValueError("at least one argument must be specified (type)!")
 
 
+def _copy_value(value) -> str:
+    if value is None:
+        return "\\N"
+    elif isinstance(value, bool):
+        return "t" if value else "f"
+    elif isinstance(value, (bytes, bytearray, memoryview)):
+        # bytea hex format, the backslash must be escaped in COPY text format.
+        return "\\\\x" + bytes(value).hex()
+    elif isinstance(value, (LID, enum.Enum)):
+        value = value.lid if isinstance(value, LID) else value.name
+    elif isinstance(value, (datetime, date)):
+        value = value.isoformat()
+    elif isinstance(value, (dict, list)):
+        value = json.dumps(value)
+
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+
+def copy_buffer(rows: Iterable[Sequence], num_columns: int) -> io.StringIO:
+    """Writes rows in the text format of Postgres COPY to an in-memory buffer."""
+    buf = io.StringIO()
+
+    for row in rows:
+        if len(row) != num_columns:
+            raise ValueError(f"expected {num_columns} values, got {len(row)}: {row}")
+        buf.write("\t".join(_copy_value(value) for value in row))
+        buf.write("\n")
+
+    buf.seek(0)
+    return buf
+
+
+def copy_insert(session, table, columns: Sequence[str], rows: Iterable[Sequence]):
+    """Inserts many rows with Postgres COPY, which is much faster than INSERT.
+    `table` is a SQLAlchemy Table, `rows` are value tuples matching `columns`.
+    LIDs are written as integers, so LID columns can be filled with `LID.generate(n)`.
+    No ORM events are run.
+    """
+    connection = session.connection()
+    preparer = connection.dialect.identifier_preparer
+    column_list = ", ".join(preparer.quote(column) for column in columns)
+    statement = f"COPY {preparer.format_table(table)} ({column_list}) FROM STDIN"
+    buf = copy_buffer(rows, len(columns))
+
+    with connection.connection.cursor() as cursor:
+        cursor.copy_expert(statement, buf)
+
+
+_after_model_update_hooks = []
+
+
+def after_model_update(func):
+    """Registers a function that is called with the model after `Base.update`.
+    Can be used as decorator.
+    """
+    _after_model_update_hooks.append(func)
+    return func
+
+
 def update_model(self, **kwargs):
     for name, value in kwargs.items():
         setattr(self, name, value)
 
+    for hook in _after_model_update_hooks:
+        hook(self)
+
 
 Base.update = update_model
 
 # some pretty printing for SQLAlchemy objects ;)
 
 
+class _SerializationPlan:
+    """Column names and a single getter for all column attributes of a mapped class."""
+
+    __slots__ = ("names", "getter")
+
+    def __init__(self, mapper):
+        columns = list(mapper.local_table.columns)
+        self.names = tuple(str(col.name) for col in columns)
+        keys = [mapper.get_property_by_column(col).key for col in columns]
+        getter = operator.attrgetter(*keys)
+        # attrgetter returns a single value instead of a tuple for one attribute.
+        self.getter = getter if len(keys) > 1 else lambda obj: (getter(obj),)
+
+    def to_dict(self, obj) -> dict:
+        return dict(zip(self.names, self.getter(obj)))
+
+
+_serialization_plans: dict[type, _SerializationPlan] = {}
+
+
+@event.listens_for(Base, "mapper_configured", propagate=True)
+def _build_serialization_plan(mapper, cls):
+    _serialization_plans[cls] = _SerializationPlan(mapper)
+
+
+def _serialization_plan(cls) -> _SerializationPlan:
+    plan = _serialization_plans.get(cls)
+    if plan is None:
+        # Mappers are configured on first use, which may not have happened yet.
+        plan = _serialization_plans[cls] = _SerializationPlan(inspect(cls))
+    return plan
+
+
 def to_dict(self):
-    return dict(
-        (str(col.name), getattr(self, col.name)) for col in self.__table__.columns
-    )
+    return _serialization_plan(type(self)).to_dict(self)
+
+
+def to_dicts(rows: Iterable) -> List[dict]:
+    """Converts many model objects to dicts, looking up the plan once per class."""
+    dicts = []
+    last_cls = plan = None
+
+    for row in rows:
+        cls = type(row)
+        if cls is not last_cls:
+            plan = _serialization_plan(cls)
+            last_cls = cls
+        dicts.append(plan.to_dict(row))
+
+    return dicts
+
+
+def json_dumps(value) -> str:
+    """Serializes to JSON with orjson. Supports LID, datetime, Decimal and enums."""
+    return json_bytes(value).decode("utf8")
 
 
 def to_yaml(self):
@@ -145,7 +421,7 @@ def to_yaml(self):
 
 
 def to_json(self):
-    return json.dumps(self.to_dict())
+    return json_dumps(self.to_dict())
 
 
 Base.to_dict = to_dict
@@ -153,22 +429,146 @@ Base.to_yaml = to_yaml
 Base.to_json = to_json
 
 
-@event.listens_for(Engine, "before_cursor_execute")
-def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
-    conn.info.setdefault("query_start_time", []).append(time.time())
-    conn.info.setdefault("current_query", []).append(statement)
+class PoolMetrics:
+    """Collects connection pool usage of the current process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.connects = 0
+            self.checkouts = 0
+            self.waits = 0
+            self.timeouts = 0
+            self.in_use = 0
+            self.max_in_use = 0
+            self.checkout_seconds = 0.0
+            self.max_checkout_seconds = 0.0
+
+    def record_checkout_latency(self, seconds, waited, timed_out=False):
+        with self._lock:
+            self.checkout_seconds += seconds
+            self.max_checkout_seconds = max(self.max_checkout_seconds, seconds)
+            if waited:
+                self.waits += 1
+            if timed_out:
+                self.timeouts += 1
+
+    def on_connect(self, *_args):
+        with self._lock:
+            self.connects += 1
+
+    def on_checkout(self, *_args):
+        with self._lock:
+            self.checkouts += 1
+            self.in_use += 1
+            self.max_in_use = max(self.max_in_use, self.in_use)
+
+    def on_checkin(self, *_args):
+        with self._lock:
+            self.in_use -= 1
+
+    def register_metrics(self, registry):
+        """Exports the values through the given `metrics.MetricsRegistry`."""
+        for name, attr, metric_type, documentation in (
+            ("connects_total", "connects", "counter", "New database connections."),
+            ("checkouts_total", "checkouts", "counter", "Connection checkouts."),
+            ("waits_total", "waits", "counter", "Checkouts that waited."),
+            ("timeouts_total", "timeouts", "counter", "Checkouts that timed out."),
+            (
+                "checkout_seconds_total",
+                "checkout_seconds",
+                "counter",
+                "Time needed to get connections from the pool.",
+            ),
+            ("connections_in_use", "in_use", "gauge", "Checked out connections."),
+        ):
+            registry.callback_metric(
+                f"ekklesia_db_pool_{name}",
+                documentation,
+                metric_type,
+                lambda attr=attr: getattr(self, attr),
+            )
+
+    def install(self, engine):
+        event.listen(engine, "connect", self.on_connect)
+        event.listen(engine, "checkout", self.on_checkout)
+        event.listen(engine, "checkin", self.on_checkin)
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            return {
+                "pid": os.getpid(),
+                "connects": self.connects,
+                "checkouts": self.checkouts,
+                "waits": self.waits,
+                "timeouts": self.timeouts,
+                "in_use": self.in_use,
+                "max_in_use": self.max_in_use,
+                "checkout_ms_total": self.checkout_seconds * 1000,
+                "checkout_ms_max": self.max_checkout_seconds * 1000,
+            }
+
+
+#: pool metrics for the engine set up by `configure_sqlalchemy`
+pool_metrics = PoolMetrics()
+pool_metrics.register_metrics(metrics.registry)
+# A forked worker has its own pool, the values of the parent are not its own.
+os.register_at_fork(after_in_child=pool_metrics.reset)
+#: statement timing for the engine set up by `configure_sqlalchemy`
+sql_instrumentation = SQLInstrumentation()
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool that records how long getting a connection from the pool takes
+    and how often requests had to wait for a connection.
+    """
+
+    metrics = pool_metrics
 
+    def __init__(self, creator, pool_size=5, max_overflow=10, **kw):
+        super().__init__(creator, pool_size=pool_size, max_overflow=max_overflow, **kw)
+        # A negative max_overflow means that the pool has no limit.
+        self.max_connections = pool_size + max_overflow if max_overflow > -1 else None
 
-@event.listens_for(Engine, "after_cursor_execute")
-def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
-    total = time.time() - conn.info["query_start_time"].pop(-1)
-    # total in seconds
-    if total > SLOW_QUERY_SECONDS:
-        if hasattr(conn.connection.connection, "history"):
-            statement = conn.connection.connection.history.last_statement
-        else:
-            statement = conn.info["current_query"].pop(-1)
-        sqllog.warn("slow query %.1fms:\n%s", total * 1000, statement)
+    def _do_get(self):
+        waited = (
+            self.max_connections is not None
+            and self.checkedout() >= self.max_connections
+        )
+        start = time.perf_counter()
+        try:
+            conn = super()._do_get()
+        except exc.TimeoutError:
+            self.metrics.record_checkout_latency(
+                time.perf_counter() - start, waited, timed_out=True
+            )
+            raise
+
+        self.metrics.record_checkout_latency(time.perf_counter() - start, waited)
+        return conn
+
+
+def _pool_args(db_settings) -> dict:
+    if getattr(db_settings, "pool_mode", "queue") == "null":
+        # Connections are pooled externally, for example by pgbouncer.
+        return {"poolclass": NullPool}
+
+    url = make_url(db_settings.uri)
+    if not issubclass(url.get_dialect().get_pool_class(url), QueuePool):
+        # The dialect needs another pool, like SQLite in memory or in a file.
+        return {}
+
+    pool_args = {"poolclass": InstrumentedQueuePool}
+    for name in ("pool_size", "max_overflow", "pool_timeout", "pool_recycle"):
+        value = getattr(db_settings, name, None)
+        if value is not None:
+            pool_args[name] = value
+
+    pool_args["pool_pre_ping"] = getattr(db_settings, "pool_pre_ping", False)
+    return pool_args
 
 
 def configure_sqlalchemy(db_settings, testing=False):
@@ -181,7 +581,17 @@ def configure_sqlalchemy(db_settings, testing=False):
         else:
             connect_args = {}
 
-        engine = create_engine(db_settings.uri, connect_args=connect_args)
+        pool_args = _pool_args(db_settings)
+        engine = create_engine(db_settings.uri, connect_args=connect_args, **pool_args)
+        ctx.add_success_fields(pool=type(engine.pool).__name__)
+        pool_metrics.install(engine)
+
+        sql_instrumentation.uninstall()
+        if getattr(db_settings, "enable_sql_instrumentation", True):
+            sql_instrumentation.slow_query_ms = getattr(
+                db_settings, "slow_query_ms", 300
+            )
+            sql_instrumentation.install(engine)
         Session.configure(bind=engine)
         zope.sqlalchemy.register(Session, keep_session=True if testing else False)
         db_metadata.bind = engine
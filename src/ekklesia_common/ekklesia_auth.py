@@ -1,5 +1,12 @@
+import base64
+import copy
 import dataclasses
+import hashlib
+import json
 import logging
+import threading
+import time
+from collections import OrderedDict
 from dataclasses import dataclass
 from functools import cached_property, partial
 from json import JSONDecodeError
@@ -7,7 +14,8 @@ from typing import List, Optional
 from urllib.parse import quote, unquote
 
 import dectate
-from morepath import App, redirect
+from morepath import App, Request, redirect
+from requests.adapters import HTTPAdapter
 from requests_oauthlib import OAuth2Session
 from sqlalchemy import JSON, DateTime, Integer, Text, func
 from webob.exc import HTTPForbidden
@@ -41,10 +49,95 @@ class EkklesiaAuthData:
         return EkklesiaAuthData(**{k: v for k, v in dict_.items() if k in class_fields})
 
 
+#: Connection pool shared by all OAuth2 sessions talking to the ID server.
+http_adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16)
+
+
+class UserinfoCache:
+    """Keeps userinfo responses until their expiry time, which is derived from the
+    lifetime of the access token they were fetched with.
+    """
+
+    def __init__(self, max_entries: int = 10000) -> None:
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            expires_at, userinfo = entry
+            if expires_at < time.time():
+                del self._entries[key]
+                return None
+
+            return userinfo
+
+    def set(self, key: str, userinfo: dict, expires_at: float):
+        with self._lock:
+            self._entries[key] = (expires_at, userinfo)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+userinfo_cache = UserinfoCache()
+
+
+def token_sub(token: dict) -> Optional[str]:
+    """Reads the subject from the ID token. The signature isn't checked because the
+    token was received directly from the ID server.
+    """
+    id_token = token.get("id_token")
+    if not id_token:
+        return None
+
+    try:
+        payload = id_token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        return json.loads(base64.urlsafe_b64decode(payload))["sub"]
+    except (IndexError, KeyError, TypeError, ValueError):
+        return None
+
+
+def userinfo_cache_key(token: dict) -> str:
+    """Userinfo is cached per `sub` if the token has an ID token. Otherwise, a hash
+    of the access token is used.
+    """
+    sub = token_sub(token)
+    if sub is not None:
+        return "sub:" + sub
+
+    access_token = token.get("access_token", "")
+    return "token:" + hashlib.sha256(access_token.encode("utf8")).hexdigest()
+
+
 class EkklesiaAuth:
-    """Wraps the OAuth2 session and provides helpers for Ekklesia ID server API access."""
+    """Wraps the OAuth2 session and provides helpers for Ekklesia ID server API access.
 
-    def __init__(self, settings, token=None, get_token=None, set_token=None):
+    With `refresh_userinfo`, userinfo is fetched from the ID server even if it is
+    cached, which is needed right after login.
+    """
+
+    def __init__(
+        self,
+        settings,
+        token=None,
+        get_token=None,
+        set_token=None,
+        refresh_userinfo=False,
+    ):
         self.settings = settings
         if token is not None and get_token is not None:
             raise RuntimeError(
@@ -57,6 +150,7 @@ class EkklesiaAuth:
         self._get_token = get_token
         self._set_token = set_token
         self._token = token
+        self.refresh_userinfo = refresh_userinfo
 
     @cached_property
     def token(self):
@@ -72,7 +166,7 @@ class EkklesiaAuth:
             raise EkklesiaNotAuthorized()
 
         extra = {"client_secret": self.settings.client_secret}
-        return OAuth2Session(
+        session = OAuth2Session(
             token=self.token,
             client_id=self.settings.client_id,
             auto_refresh_url=self.settings.token_url,
@@ -80,6 +174,9 @@ class EkklesiaAuth:
             token_updater=self._set_token,
             scope=self.settings.scopes,
         )
+        session.mount("https://", http_adapter)
+        session.mount("http://", http_adapter)
+        return session
 
     @property
     def authorized(self):
@@ -87,6 +184,15 @@ class EkklesiaAuth:
 
     @property
     def userinfo(self) -> dict:
+        if not self.authorized:
+            raise EkklesiaNotAuthorized()
+
+        if not self.refresh_userinfo:
+            cached = userinfo_cache.get(userinfo_cache_key(self.token))
+            if cached is not None:
+                # Callers must not be able to change the cached data.
+                return copy.deepcopy(cached)
+
         res = self.session.get(self.settings.userinfo_url)
         res.raise_for_status()
         try:
@@ -95,6 +201,16 @@ class EkklesiaAuth:
             logg.error("error decoding userinfo response:\n" + res.text)
             raise
 
+        ttl = self.settings.userinfo_cache_ttl
+        if ttl:
+            # The token may have been refreshed by the request.
+            token = self.session.token
+            expires_at = time.time() + ttl
+            if token.get("expires_at") is not None:
+                expires_at = min(expires_at, token["expires_at"])
+            cache_key = userinfo_cache_key(token)
+            userinfo_cache.set(cache_key, copy.deepcopy(jso), expires_at)
+
         return jso
 
     @property
@@ -143,13 +259,28 @@ class AfterAuthAction(dectate.Action):
         after_oauth_callbacks[obj.__name__] = obj
 
 
+class EkklesiaAuthRequest(Request):
+    @cached_property
+    def ekklesia_auth(self) -> EkklesiaAuth:
+        """Created when it's accessed for the first time in a request."""
+        root = self.app.root
+        return EkklesiaAuth(
+            root.settings.ekklesia_auth,
+            get_token=partial(root._get_oauth_token, self),
+            set_token=partial(root._set_oauth_token, self),
+        )
+
+
 class EkklesiaAuthApp(App):
     """Provides Ekklesia authentication features to Morepath apps.
     Requests done via subclasses of this get an `ekklesia_auth` attribute which
     can be used for checking if authorization is granted and to retrieve data
-    from the Ekklesia ID server API.
+    from the Ekklesia ID server API. A custom `request_class` must be a subclass
+    of `EkklesiaAuthRequest`.
     """
 
+    request_class = EkklesiaAuthRequest
+
     def _get_oauth_token(*_args, **_kw):
         raise Exception("not set")
 
@@ -177,24 +308,11 @@ def ekklesia_auth_setting_section():
         "display_name": "Ekklesia Login",
         "required_role_for_login": None,
         "scopes": ["openid"],
+        # userinfo is cached at most this long (seconds), 0 disables caching
+        "userinfo_cache_ttl": 60,
     }
 
 
-@EkklesiaAuthApp.tween_factory()
-def make_ekklesia_auth_tween(app, handler):
-    def ekklesia_auth_tween(request):
-        get_oauth_token = partial(app.root._get_oauth_token, request)
-        set_oauth_token = partial(app.root._set_oauth_token, request)
-        request.ekklesia_auth = EkklesiaAuth(
-            app.root.settings.ekklesia_auth,
-            get_token=get_oauth_token,
-            set_token=set_oauth_token,
-        )
-        return handler(request)
-
-    return ekklesia_auth_tween
-
-
 class EkklesiaAuthPathApp(App):
     """Provides paths for getting OAuth2 authorization ("login") and info.
     Should be mounted under a App subclassing `EkklesiaBrowserApp`.
@@ -274,7 +392,9 @@ class OAuthCallback:
     def after_auth(self):
         root_app = self.request.app.root
         if root_app.config.after_oauth_callbacks:
-            ekklesia_auth = EkklesiaAuth(root_app.settings.ekklesia_auth, self.token)
+            ekklesia_auth = EkklesiaAuth(
+                root_app.settings.ekklesia_auth, self.token, refresh_userinfo=True
+            )
             for callback in root_app.config.after_oauth_callbacks.values():
                 callback(self.request, ekklesia_auth)
 
@@ -1,9 +1,132 @@
 import logging
+import threading
+import time
+import weakref
+from collections import OrderedDict
 
 import morepath
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, make_transient_to_detached, object_session
+from sqlalchemy.orm.attributes import set_committed_value
+
+from ekklesia_common import database
 
 logg = logging.getLogger(__name__)
 
+_identity_caches = weakref.WeakSet()
+
+
+def detached_snapshot(obj):
+    """Creates a detached copy of a loaded ORM object with its column values.
+    The copy can be attached to a session with `session.merge(copy, load=False)`
+    without querying the database.
+    """
+    mapper = inspect(obj).mapper
+    loaded = inspect(obj).dict
+    snapshot = mapper.class_manager.new_instance()
+
+    for prop in mapper.column_attrs:
+        if prop.key in loaded:
+            set_committed_value(snapshot, prop.key, loaded[prop.key])
+
+    make_transient_to_detached(snapshot)
+    return snapshot
+
+
+class IdentityCache:
+    """Keeps detached snapshots of users for `ttl` seconds, keyed by user class and
+    id. At most `max_entries` users are kept, the least recently used are removed
+    first. Entries of a user are removed when the transaction that called
+    `Base.update` on the user is committed or by calling `invalidate`.
+
+    Changes made in other processes or without `Base.update` are only seen after
+    the entry expired, so keep `ttl` short. The default `ttl` of 0 disables caching.
+    `EkklesiaBrowserApp` configures the default `identity_cache` with the
+    `identity_cache` settings.
+    """
+
+    def __init__(self, ttl: float = 0, max_entries: int = 1000) -> None:
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        _identity_caches.add(self)
+
+    def get(self, user_class, user_id):
+        key = (user_class, user_id)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            expires_at, snapshot = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+
+            self._entries.move_to_end(key)
+            return snapshot
+
+    def set(self, user_class, user):
+        """Stores a snapshot of `user`, `get` finds it with the same `user_class`."""
+        if not self.ttl:
+            return
+
+        entry = (time.monotonic() + self.ttl, detached_snapshot(user))
+        with self._lock:
+            self._entries[(user_class, user.id)] = entry
+            self._entries.move_to_end((user_class, user.id))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_class, user_id):
+        with self._lock:
+            self._entries.pop((user_class, user_id), None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+identity_cache = IdentityCache()
+
+
+def invalidate_user_in_identity_caches(user_class, user_id):
+    for cache in list(_identity_caches):
+        # The user may be cached under a base class of the model.
+        for cls in user_class.__mro__:
+            cache.invalidate(cls, user_id)
+
+
+_PENDING_INVALIDATIONS = "identity_cache_pending_invalidations"
+
+
+@database.after_model_update
+def invalidate_user_after_commit(model):
+    """Removes `model` from the identity caches when the transaction is committed.
+    Removing it earlier would allow concurrent requests to cache the old state
+    again. Models that don't belong to a session are removed immediately.
+    """
+    key = (type(model), getattr(model, "id", None))
+    session = object_session(model) if hasattr(model, "_sa_instance_state") else None
+    if session is None:
+        invalidate_user_in_identity_caches(*key)
+    else:
+        session.info.setdefault(_PENDING_INVALIDATIONS, set()).add(key)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_committed_users(session):
+    for user_class, user_id in session.info.pop(_PENDING_INVALIDATIONS, ()):
+        invalidate_user_in_identity_caches(user_class, user_id)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _discard_pending_invalidations(session, previous_transaction):
+    if not session.in_transaction():
+        session.info.pop(_PENDING_INVALIDATIONS, None)
+
 
 class UserIdentity(morepath.Identity):
     def __init__(self, user):
@@ -23,6 +146,7 @@ class EkklesiaIdentityPolicy(morepath.IdentityPolicy):
 
     identity_class = UserIdentity
     user_class = None
+    identity_cache = identity_cache
 
     def remember(self, response, request, identity):
         request.browser_session["user_id"] = identity.user.id
@@ -33,12 +157,21 @@ class EkklesiaIdentityPolicy(morepath.IdentityPolicy):
         if user_id is None:
             return NoIdentity
 
-        user = request.db_session.query(self.__class__.user_class).get(user_id)
+        user_class = self.__class__.user_class
+        snapshot = self.identity_cache.get(user_class, user_id)
+
+        if snapshot is not None:
+            # Attaches the user to the session without loading it again.
+            user = request.db_session.merge(snapshot, load=False)
+            return self.identity_class(user)
+
+        user = request.db_session.query(user_class).get(user_id)
 
         if user is None:
             logg.info("user_id %s in session, but not found in the database!", user_id)
             return NoIdentity
 
+        self.identity_cache.set(user_class, user)
         return self.identity_class(user)
 
     def forget(self, response, request):
@@ -6,41 +6,183 @@ The first part is a timestamp in milliseconds since the epoch (42 bits).
 The second part is a random number (22 bits).
 """
 
+import os
 import random
+import threading
 import time
+import weakref
+from array import array
 from datetime import datetime, tzinfo, timezone
-from functools import cached_property, total_ordering
+from functools import total_ordering
+from typing import Iterable, List, Union
 
-import base32_crockford
+RANDOM_BITS = 22
+RANDOM_MASK = 2**RANDOM_BITS - 1
+
+_SYMBOLS = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+_SYMBOL_PAIRS = [first + second for first in _SYMBOLS for second in _SYMBOLS]
+# Decoding accepts lower case and the aliases defined by Crockford's base32.
+_DECODE_TABLE = {
+    **{c: i for i, c in enumerate(_SYMBOLS)},
+    **{c.lower(): i for i, c in enumerate(_SYMBOLS)},
+    **{"O": 0, "o": 0, "I": 1, "i": 1, "L": 1, "l": 1},
+}
+
+
+def _encode(val: int, length: int) -> str:
+    chars = [_SYMBOLS[(val >> shift) & 31] for shift in range(5 * (length - 1), -1, -5)]
+    return "".join(chars)
+
+
+def _decode(encoded: str) -> int:
+    val = 0
+    try:
+        for char in encoded:
+            val = (val << 5) | _DECODE_TABLE[char]
+    except KeyError:
+        raise ValueError(f"invalid character in LID part: {encoded!r}")
+
+    return val
 
 
 def encode_random(val):
-    b32 = base32_crockford.encode(val)
-    return f"{b32:0>5s}"
+    return _encode(val, 5)
 
 
 def encode_timestamp(val):
-    b32 = base32_crockford.encode(val)
-    return f"{b32:0>9s}"
+    return _encode(val, 9)
+
+
+def encode_lid(lid: int) -> str:
+    # Unrolled version of _encode, using two characters per lookup.
+    ts = lid >> RANDOM_BITS
+    rand = lid & RANDOM_MASK
+    pairs = _SYMBOL_PAIRS
+    return (
+        _SYMBOLS[(ts >> 40) & 31]
+        + pairs[(ts >> 30) & 1023]
+        + pairs[(ts >> 20) & 1023]
+        + pairs[(ts >> 10) & 1023]
+        + pairs[ts & 1023]
+        + "-"
+        + _SYMBOLS[(rand >> 20) & 31]
+        + pairs[(rand >> 10) & 1023]
+        + pairs[rand & 1023]
+    )
+
+
+def decode_lid(lid_str: str) -> int:
+    ts_repr, rand_repr = lid_str.split("-")
+    return (_decode(ts_repr) << RANDOM_BITS) | _decode(rand_repr)
+
+
+class LIDGenerator:
+    """Creates LIDs that are strictly increasing within the process.
+
+    The random part is initialized randomly for each new millisecond and incremented
+    for further LIDs in the same millisecond. If it overflows, the timestamp is
+    advanced by one millisecond. If the clock goes backwards, LIDs are issued from
+    the last timestamp until the clock catches up again, so they never decrease.
+
+    If multiple processes create LIDs for the same table, they can be given distinct
+    `node_id`s which are stored in the upper `node_bits` of the random part, so
+    they can never create the same LID.
+    """
+
+    def __init__(self, node_id: int = 0, node_bits: int = 0) -> None:
+        if not 0 <= node_bits < RANDOM_BITS:
+            raise ValueError(f"node_bits must be between 0 and {RANDOM_BITS - 1}")
+        if not 0 <= node_id < 2**node_bits:
+            raise ValueError(f"node_id {node_id} doesn't fit in {node_bits} bits")
+
+        self._sequence_bits = RANDOM_BITS - node_bits
+        self._sequence_max = 2**self._sequence_bits - 1
+        self._node_prefix = node_id << self._sequence_bits
+        self._lock = threading.Lock()
+        self.reset()
+        _generators.add(self)
+
+    def reset(self):
+        self._last_milliseconds = -1
+        self._sequence = 0
+
+    def _reinit_after_fork(self):
+        # The lock may have been held by another thread of the parent.
+        self._lock = threading.Lock()
+        self.reset()
+
+    def _next_int(self) -> int:
+        milliseconds = int(time.time() * 1000)
+        last_milliseconds = self._last_milliseconds
+
+        if milliseconds > last_milliseconds:
+            self._last_milliseconds = milliseconds
+            # Start in the lower half to leave room for incrementing.
+            self._sequence = random.randrange(0, (self._sequence_max >> 1) + 1)
+        else:
+            self._sequence += 1
+            if self._sequence > self._sequence_max:
+                self._last_milliseconds += 1
+                self._sequence = 0
+
+        timestamp_part = self._last_milliseconds << RANDOM_BITS
+        return timestamp_part | self._node_prefix | self._sequence
+
+    def generate_int(self) -> int:
+        with self._lock:
+            return self._next_int()
+
+    def generate_ints(self, n: int) -> array:
+        with self._lock:
+            return array("q", [self._next_int() for _ in range(n)])
+
+    def __call__(self) -> "LID":
+        return LID(self.generate_int())
+
+    def generate(self, n: int) -> List["LID"]:
+        return [LID(lid) for lid in self.generate_ints(n)]
+
+
+_generators: "weakref.WeakSet[LIDGenerator]" = weakref.WeakSet()
+
+
+def _reinit_generators_after_fork():
+    for generator in list(_generators):
+        generator._reinit_after_fork()
+
+
+# A forked child must not continue the sequence of its parent.
+os.register_at_fork(after_in_child=_reinit_generators_after_fork)
+
+#: used by LID() and LID.generate()
+default_generator = LIDGenerator()
 
 
 @total_ordering
 class LID:
+    """The integer value is stored as `lid`, the string representation is only
+    computed when it's needed.
+    """
+
+    __slots__ = ("lid", "_repr")
+
     def __init__(self, lid: int = None) -> None:
 
         if lid is None:
-            milliseconds = int(time.time() * 1000)
-            rand = random.randrange(0, 2 ** 22)
-            lid = (milliseconds << 22) | rand
-        else:
-            milliseconds = lid >> 22
-            rand = lid & (2 ** 22 - 1)
+            lid = default_generator.generate_int()
 
-        ts_repr = encode_timestamp(milliseconds)
-        rand_repr = encode_random(rand)
-        self.repr = ts_repr + "-" + rand_repr
         self.lid = lid
-        self.milliseconds = milliseconds
+        self._repr = None
+
+    @property
+    def repr(self) -> str:
+        if self._repr is None:
+            self._repr = encode_lid(self.lid)
+        return self._repr
+
+    @property
+    def milliseconds(self) -> int:
+        return self.lid >> RANDOM_BITS
 
     def __lt__(self, other):
         if isinstance(other, LID):
@@ -74,13 +216,34 @@ class LID:
     def __hash__(self):
         return hash(self.lid)
 
+    def __getstate__(self):
+        return self.lid
+
+    def __setstate__(self, lid):
+        self.lid = lid
+        self._repr = None
+
     @classmethod
     def from_str(cls, lid_str) -> "LID":
-        ts_repr, rand_repr = lid_str.split("-")
-        milliseconds = base32_crockford.decode(ts_repr)
-        rand = base32_crockford.decode(rand_repr)
-        return cls((milliseconds << 22) | rand)
+        return cls(decode_lid(lid_str))
 
-    @cached_property
+    @property
     def datetime(self) -> datetime:
         return datetime.fromtimestamp(self.milliseconds / 1000, tz=timezone.utc)
+
+    @staticmethod
+    def generate(n: int) -> List["LID"]:
+        """Creates `n` new LIDs in ascending order."""
+        return default_generator.generate(n)
+
+    @staticmethod
+    def encode_many(lids: Iterable[Union[int, "LID"]]) -> List[str]:
+        """Converts LIDs or their integer values (a list or an `array('q')`, for
+        example) to their string representations.
+        """
+        return [encode_lid(int(lid)) for lid in lids]
+
+    @staticmethod
+    def decode_many(lid_strs: Iterable[str]) -> array:
+        """Converts string representations to integer values in an `array('q')`."""
+        return array("q", [decode_lid(lid_str) for lid_str in lid_strs])
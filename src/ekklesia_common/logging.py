@@ -1,15 +1,21 @@
+import atexit
 import inspect
 import logging
 import os
+import queue
 import sys
+import threading
 import traceback
-from io import StringIO
+import weakref
+from io import StringIO, TextIOBase
 
 import eliot
+import orjson
 from eliot.json import EliotJSONEncoder
 from eliot.stdlib import EliotHandler
 
 from ekklesia_common.app import UnhandledRequestException
+from ekklesia_common.request_log import RequestLogGate
 
 
 class EkklesiaLogEncoder(EliotJSONEncoder):
@@ -21,6 +27,159 @@ class EkklesiaLogEncoder(EliotJSONEncoder):
             return repr(obj)
 
 
+_log_encoder = EkklesiaLogEncoder()
+
+
+def _orjson_default(obj):
+    return _log_encoder.default(obj)
+
+
+def serialize_message(message: dict) -> bytes:
+    try:
+        return orjson.dumps(
+            message,
+            default=_orjson_default,
+            option=orjson.OPT_APPEND_NEWLINE | orjson.OPT_NON_STR_KEYS,
+        )
+    except orjson.JSONEncodeError:
+        # orjson is stricter than the json module, for example with big integers.
+        return (_log_encoder.encode(message) + "\n").encode("utf8")
+
+
+class AsyncLogDestination:
+    """eliot destination that serializes and writes messages in a background thread.
+
+    Messages are put on a queue with at most `max_queue_size` entries. If the queue
+    is full, the message is dropped and counted in `dropped`, or, if `block` is set,
+    the logging thread waits until there's room again. Messages that cannot be
+    serialized or written are counted in `dropped`, too. The writer thread writes up
+    to `batch_size` messages at once. Call `shutdown` to write out all queued
+    messages, which `init_logging` does at exit.
+    """
+
+    _STOP = object()
+
+    def __init__(
+        self, output_stream, max_queue_size=10000, batch_size=100, block=False
+    ) -> None:
+        # Write bytes directly if the stream is a text wrapper like sys.stdout.
+        self._output = getattr(output_stream, "buffer", output_stream)
+        self._write_text = isinstance(self._output, TextIOBase)
+        self.max_queue_size = max_queue_size
+        self.batch_size = batch_size
+        self.block = block
+        self.dropped = 0
+        self._reported_dropped = 0
+        self._start()
+        _destinations.add(self)
+
+    def _start(self):
+        self._dropped_lock = threading.Lock()
+        self._queue = queue.Queue(self.max_queue_size)
+        self._thread = threading.Thread(
+            target=self._run, name="eliot-log-writer", daemon=True
+        )
+        self._thread.start()
+
+    def _count_dropped(self, n=1):
+        with self._dropped_lock:
+            self.dropped += n
+
+    def __call__(self, message: dict):
+        try:
+            self._queue.put(message, block=self.block)
+        except queue.Full:
+            self._count_dropped()
+
+    def _run(self):
+        q = self._queue
+        stop = False
+
+        while not stop:
+            batch = [q.get()]
+            try:
+                while len(batch) < self.batch_size:
+                    try:
+                        batch.append(q.get_nowait())
+                    except queue.Empty:
+                        break
+
+                messages = [message for message in batch if message is not self._STOP]
+                stop = len(messages) < len(batch)
+                self._write(messages)
+            except Exception:
+                # Keep the writer alive, the batch is lost.
+                self._count_dropped(len(batch))
+            finally:
+                for _ in batch:
+                    q.task_done()
+
+    def _serialize(self, messages):
+        chunks = []
+        for message in messages:
+            try:
+                chunks.append(serialize_message(message))
+            except Exception:
+                self._count_dropped()
+
+        return chunks
+
+    def _write(self, messages):
+        chunks = self._serialize(messages)
+        written = len(chunks)
+
+        with self._dropped_lock:
+            dropped = self.dropped
+        if dropped > self._reported_dropped:
+            chunks.append(
+                serialize_message(
+                    {
+                        "message_type": "eliot:dropped_messages",
+                        "dropped": dropped - self._reported_dropped,
+                    }
+                )
+            )
+            self._reported_dropped = dropped
+
+        if not chunks:
+            return
+
+        data = b"".join(chunks)
+        try:
+            self._output.write(data.decode("utf8") if self._write_text else data)
+            self._output.flush()
+        except Exception:
+            # There is no place left to report logging errors to, only count them.
+            self._count_dropped(written)
+
+    def flush(self):
+        """Blocks until all queued messages are written."""
+        self._queue.join()
+
+    def shutdown(self, timeout=5):
+        """Writes all queued messages and stops the writer thread."""
+        if not self._thread.is_alive():
+            return
+        try:
+            self._queue.put(self._STOP, timeout=timeout)
+        except queue.Full:
+            # The writer is stuck, don't block the exit of the process.
+            return
+        self._thread.join(timeout)
+
+
+_destinations: "weakref.WeakSet[AsyncLogDestination]" = weakref.WeakSet()
+
+
+def _restart_destinations_after_fork():
+    for destination in list(_destinations):
+        destination._start()
+
+
+# Threads don't survive a fork, the child needs its own writers.
+os.register_at_fork(after_in_child=_restart_destinations_after_fork)
+
+
 if os.environ.get("BETTER_EXCEPTIONS"):
     import better_exceptions.color
     import better_exceptions.formatter
@@ -107,7 +266,14 @@ def _add_exception_data_and_traceback(exc: BaseException):
         }
 
 
-def init_logging(output_stream=sys.stdout):
+def init_logging(
+    output_stream=sys.stdout, async_output=True, max_queue_size=10000, block=False
+):
+    """Sends eliot messages and stdlib log records to `output_stream` as JSON lines.
+
+    With `async_output`, messages are written by a background thread using an
+    `AsyncLogDestination`, see there for `max_queue_size` and `block`.
+    """
     root_logger = logging.getLogger()
 
     if root_logger.handlers:
@@ -119,10 +285,21 @@ def init_logging(output_stream=sys.stdout):
     root_logger.addHandler(EliotHandler())
     root_logger.setLevel(logging.DEBUG)
     logging.getLogger("morepath.directive").setLevel(logging.INFO)
+    # Set to DEBUG to log full model data for every view call, not only on errors.
+    logging.getLogger("ekklesia_common.concept").setLevel(logging.INFO)
     logging.getLogger("passlib.registry").setLevel(logging.INFO)
     logging.getLogger("passlib.utils.compat").setLevel(logging.INFO)
     logging.getLogger("parso").setLevel(logging.WARN)
 
-    eliot.to_file(output_stream, encoder=EkklesiaLogEncoder)
+    if async_output:
+        destination = AsyncLogDestination(
+            output_stream, max_queue_size=max_queue_size, block=block
+        )
+        atexit.register(destination.shutdown)
+    else:
+        destination = eliot.FileDestination(output_stream, encoder=EkklesiaLogEncoder)
+
+    # Holds back messages of requests if the log profile isn't `full`.
+    eliot.add_destinations(RequestLogGate(destination))
 
     logging.captureWarnings(True)
@@ -1,13 +1,119 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Iterable, List
+
 from markdown import Markdown
 from mdx_gfm import GithubFlavoredMarkdownExtension
 
 MARKDOWN_EXTENSIONS = [GithubFlavoredMarkdownExtension()]
+#: converters kept for reuse, more are created if needed
+CONVERTER_POOL_SIZE = 8
+#: number of rendered HTML texts kept in the cache
+HTML_CACHE_SIZE = 1024
+
+_lock = threading.Lock()
+_converters: List[Markdown] = []
+_html_cache: OrderedDict[bytes, str] = OrderedDict()
+
+
+class RenderedMarkdown(str):
+    """Markdown source text that carries a previously rendered HTML version."""
+
+    def __new__(cls, source: str, html: str):
+        obj = super().__new__(cls, source)
+        obj.html = html
+        return obj
+
+    def __getnewargs__(self):
+        # used by pickle and copy, str only passes the source text
+        return (str(self), self.html)
+
+
+def source_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf8")).hexdigest()
 
 
 def markdown():
     return Markdown(extensions=MARKDOWN_EXTENSIONS)
 
 
+@contextmanager
+def _converter():
+    """Takes a converter from the pool or creates a new one if the pool is empty."""
+    with _lock:
+        md = _converters.pop() if _converters else None
+
+    if md is None:
+        md = markdown()
+
+    try:
+        yield md
+    finally:
+        md.reset()
+        with _lock:
+            if len(_converters) < CONVERTER_POOL_SIZE:
+                _converters.append(md)
+
+
+def _cache_key(text: str) -> bytes:
+    return hashlib.blake2b(text.encode("utf8"), digest_size=16).digest()
+
+
+def _cached_html(key):
+    with _lock:
+        html = _html_cache.get(key)
+        if html is not None:
+            _html_cache.move_to_end(key)
+        return html
+
+
+def _cache_html(key, html):
+    with _lock:
+        _html_cache[key] = html
+        if len(_html_cache) > HTML_CACHE_SIZE:
+            _html_cache.popitem(last=False)
+
+
+def _convert_with(md, text, key):
+    html = md.convert(text)
+    md.reset()
+    _cache_html(key, html)
+    return html
+
+
 def convert(text):
-    md = markdown()
-    return md.convert(text)
+    key = _cache_key(text)
+    html = _cached_html(key)
+    if html is not None:
+        return html
+
+    with _converter() as md:
+        return _convert_with(md, text, key)
+
+
+def convert_many(texts: Iterable[str]) -> List[str]:
+    """Converts multiple texts, using a single converter for all uncached texts."""
+    texts = list(texts)
+    keys = [_cache_key(text) for text in texts]
+    results = [_cached_html(key) for key in keys]
+
+    if all(html is not None for html in results):
+        return results
+
+    with _converter() as md:
+        for index, (text, key) in enumerate(zip(texts, keys)):
+            if results[index] is None:
+                results[index] = _convert_with(md, text, key)
+
+    return results
+
+
+def reset():
+    """Drops pooled converters and cached HTML.
+    Must be called after changing `MARKDOWN_EXTENSIONS`.
+    """
+    with _lock:
+        _converters.clear()
+        _html_cache.clear()
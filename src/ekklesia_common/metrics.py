@@ -0,0 +1,459 @@
+"""
+Timing metrics for requests and the hot paths inside them.
+
+Durations are recorded in fixed-bucket histograms in the process-wide `registry`:
+
+* `ekklesia_request_duration_seconds`: the whole request, measured by the log tween
+* `ekklesia_view_duration_seconds`: view functions, by view name
+* `ekklesia_template_get_duration_seconds`: loading templates, by template name
+* `ekklesia_template_render_duration_seconds`: rendering templates, by template name
+* `ekklesia_form_validation_duration_seconds`: validation of submitted forms
+* `ekklesia_sql_duration_seconds`: SQL statements, needs `enable_sql_instrumentation`
+
+Counters and gauges of the database connection pool (`ekklesia_db_pool_*`) are
+read from `ekklesia_common.database.pool_metrics` when the metrics are collected.
+
+`MetricsApp` renders them in the Prometheus text format. It has no access control,
+so mount it only where the metrics endpoint isn't publicly reachable::
+
+    @App.mount(app=MetricsApp, path="metrics")
+    def mount_metrics():
+        return MetricsApp()
+
+With multiple worker processes, set `multiprocess_dir` in the `metrics` settings to
+a directory shared by all workers. Each process then writes its values to a file
+there, and `MetricsApp` adds up the values of all files. The values of processes
+that don't exist anymore are added to `aggregate.json` before their files are
+removed, so the totals don't drop when a worker is replaced. Their gauges are
+dropped.
+"""
+import atexit
+import fcntl
+import os
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Iterable, Optional
+
+import morepath
+import orjson
+
+#: upper bounds of the histogram buckets in seconds, the last bucket is unbounded
+DEFAULT_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+)
+
+
+class Histogram:
+    """Counts observed values in buckets, separately for each combination of label
+    values. Label values are given as keyword arguments to `observe` and `time`.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        buckets: Iterable[float] = DEFAULT_BUCKETS,
+        label_names: Iterable[str] = (),
+    ) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+        self.label_names = tuple(label_names)
+        # label values => bucket counts followed by the sum of all values
+        self._series: dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        label_values = tuple(str(labels[name]) for name in self.label_names)
+        bucket = bisect_left(self.buckets, value)
+
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+            series[bucket] += 1
+            series[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Observes the duration of the block in seconds."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            series = [
+                [list(values), counts[:]] for values, counts in self._series.items()
+            ]
+
+        return {
+            "documentation": self.documentation,
+            "buckets": self.buckets,
+            "label_names": self.label_names,
+            "series": series,
+        }
+
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+
+
+class CallbackMetric:
+    """Counter or gauge without labels. Its value is returned by `func` when a
+    snapshot is taken.
+    """
+
+    def __init__(
+        self, name: str, documentation: str, metric_type: str, func: Callable
+    ) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.metric_type = metric_type
+        self.func = func
+
+    def snapshot(self) -> dict:
+        return {
+            "documentation": self.documentation,
+            "type": self.metric_type,
+            "value": self.func(),
+        }
+
+    def reset(self):
+        pass
+
+
+def _merge_snapshots(snapshots: Iterable[dict]) -> dict:
+    merged = {}
+
+    for snapshot in snapshots:
+        for name, histogram in snapshot.items():
+            if "value" in histogram:
+                target = merged.setdefault(name, {**histogram, "value": 0})
+                target["value"] += histogram["value"]
+                continue
+
+            target = merged.setdefault(name, {**histogram, "series": {}})
+            if tuple(target["buckets"]) != tuple(histogram["buckets"]):
+                # Written by a process with a different configuration, can't be merged.
+                continue
+
+            for label_values, counts in histogram["series"]:
+                key = tuple(label_values)
+                existing = target["series"].get(key)
+                if existing is None:
+                    target["series"][key] = list(counts)
+                else:
+                    target["series"][key] = [a + b for a, b in zip(existing, counts)]
+
+    return merged
+
+
+def _snapshot_from_merged(merged: dict) -> dict:
+    snapshot = {}
+
+    for name, metric in merged.items():
+        if "value" in metric:
+            snapshot[name] = metric
+        else:
+            series = [[list(key), counts] for key, counts in metric["series"].items()]
+            snapshot[name] = {**metric, "series": series}
+
+    return snapshot
+
+
+def _escape_label_value(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(label_names, label_values, extra="") -> str:
+    parts = [
+        f'{name}="{_escape_label_value(value)}"'
+        for name, value in zip(label_names, label_values)
+    ]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_number(value) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render_prometheus(merged: dict) -> str:
+    lines = []
+
+    for name, histogram in sorted(merged.items()):
+        lines.append(f"# HELP {name} {histogram['documentation']}")
+        if "value" in histogram:
+            lines.append(f"# TYPE {name} {histogram['type']}")
+            lines.append(f"{name} {_format_number(histogram['value'])}")
+            continue
+
+        label_names = histogram["label_names"]
+        lines.append(f"# TYPE {name} histogram")
+
+        for label_values, counts in sorted(histogram["series"].items()):
+            cumulative = 0
+            bucket_bounds = [_format_number(b) for b in histogram["buckets"]]
+
+            for bound, count in zip([*bucket_bounds, "+Inf"], counts[:-1]):
+                cumulative += count
+                labels = _format_labels(label_names, label_values, f'le="{bound}"')
+                lines.append(f"{name}_bucket{labels} {cumulative}")
+
+            labels = _format_labels(label_names, label_values)
+            lines.append(f"{name}_sum{labels} {_format_number(counts[-1])}")
+            lines.append(f"{name}_count{labels} {cumulative}")
+
+    return "\n".join(lines) + "\n"
+
+
+def _process_exists(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Running, but owned by another user.
+        return True
+    return True
+
+
+class MetricsRegistry:
+    def __init__(self) -> None:
+        self._metrics: dict[str, Histogram | CallbackMetric] = {}
+        self.multiprocess_dir: Optional[Path] = None
+        self.write_interval = 10
+        self._last_write = 0.0
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        buckets: Iterable[float] = DEFAULT_BUCKETS,
+        label_names: Iterable[str] = (),
+    ) -> Histogram:
+        """Returns the histogram called `name`, creating it if it doesn't exist."""
+        histogram = self._metrics.get(name)
+        if histogram is None:
+            histogram = Histogram(name, documentation, buckets, label_names)
+            self._metrics[name] = histogram
+        return histogram
+
+    def callback_metric(
+        self, name: str, documentation: str, metric_type: str, func: Callable
+    ) -> CallbackMetric:
+        """Adds a counter or gauge (`metric_type`) whose value is returned by
+        `func`. The values of all processes are added up.
+        """
+        metric = CallbackMetric(name, documentation, metric_type, func)
+        self._metrics[name] = metric
+        return metric
+
+    def snapshot(self) -> dict:
+        return {name: m.snapshot() for name, m in self._metrics.items()}
+
+    def reset(self):
+        for metric in self._metrics.values():
+            metric.reset()
+
+    def enable_multiprocess(self, directory, write_interval: float = 10):
+        """Makes this process write its values to a file in `directory` at most
+        every `write_interval` seconds and at exit.
+        """
+        if self.multiprocess_dir is None:
+            atexit.register(self.write_snapshot)
+
+        self.multiprocess_dir = Path(directory)
+        self.multiprocess_dir.mkdir(parents=True, exist_ok=True)
+        self.write_interval = write_interval
+        self._snapshot_paths()
+
+    @property
+    def _snapshot_path(self) -> Path:
+        return self.multiprocess_dir / f"metrics-{os.getpid()}.json"
+
+    @property
+    def _aggregate_path(self) -> Path:
+        return self.multiprocess_dir / "aggregate.json"
+
+    def write_snapshot(self):
+        if self.multiprocess_dir is None:
+            return
+
+        self._last_write = time.monotonic()
+        self._write_file(self._snapshot_path, self.snapshot())
+
+    def _write_file(self, path: Path, snapshot: dict):
+        # Write to a temporary file first, readers must not see partial files.
+        fd, tmp_path = tempfile.mkstemp(dir=self.multiprocess_dir, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(orjson.dumps(snapshot))
+        os.replace(tmp_path, path)
+
+    def maybe_write_snapshot(self):
+        """Writes the values if multiprocess mode is enabled and the last write is
+        longer ago than `write_interval`. Cheap enough to be called for each request.
+        """
+        if self.multiprocess_dir is None:
+            return
+
+        if time.monotonic() - self._last_write >= self.write_interval:
+            self.write_snapshot()
+
+    def collect(self) -> dict:
+        """Returns the values of this process, added up with the values written by
+        other processes in multiprocess mode.
+        """
+        snapshots = [self.snapshot()]
+
+        if self.multiprocess_dir is not None:
+            own_path = self._snapshot_path
+            for path in self._snapshot_paths():
+                if path == own_path:
+                    continue
+                try:
+                    snapshots.append(orjson.loads(path.read_bytes()))
+                except (OSError, orjson.JSONDecodeError):
+                    continue
+
+        return _merge_snapshots(snapshots)
+
+    def _snapshot_paths(self) -> list[Path]:
+        """Returns the snapshot files of running processes and the aggregate file.
+        Files of processes that don't exist anymore are added to the aggregate.
+        """
+        paths = []
+        dead_paths = []
+
+        for path in self.multiprocess_dir.glob("metrics-*.json"):
+            try:
+                pid = int(path.stem.removeprefix("metrics-"))
+            except ValueError:
+                continue
+
+            if _process_exists(pid):
+                paths.append(path)
+            else:
+                dead_paths.append(path)
+
+        if dead_paths:
+            self._aggregate_dead(dead_paths)
+
+        if self._aggregate_path.exists():
+            paths.append(self._aggregate_path)
+
+        return paths
+
+    def _aggregate_dead(self, dead_paths: list[Path]):
+        """Adds the values of dead processes to the aggregate file and removes
+        their files. Gauges of dead processes are dropped.
+        """
+        aggregate_path = self._aggregate_path
+
+        with open(self.multiprocess_dir / "aggregate.lock", "wb") as lock_file:
+            # Other processes may aggregate the same files at the same time.
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            snapshots = []
+            merged_paths = []
+
+            for path in [aggregate_path, *dead_paths]:
+                try:
+                    snapshot = orjson.loads(path.read_bytes())
+                except FileNotFoundError:
+                    # Already aggregated by another process.
+                    continue
+                except (OSError, orjson.JSONDecodeError):
+                    snapshot = {}
+
+                if path != aggregate_path:
+                    merged_paths.append(path)
+                    snapshot = {
+                        name: metric
+                        for name, metric in snapshot.items()
+                        if metric.get("type") != "gauge"
+                    }
+                snapshots.append(snapshot)
+
+            if not merged_paths:
+                return
+
+            aggregate = _snapshot_from_merged(_merge_snapshots(snapshots))
+            self._write_file(aggregate_path, aggregate)
+
+            for path in merged_paths:
+                path.unlink(missing_ok=True)
+
+    def render_prometheus(self) -> str:
+        return render_prometheus(self.collect())
+
+
+registry = MetricsRegistry()
+# A forked worker starts counting from zero, the values of the parent are its own.
+os.register_at_fork(after_in_child=registry.reset)
+
+REQUEST_DURATION = registry.histogram(
+    "ekklesia_request_duration_seconds", "Duration of requests."
+)
+VIEW_DURATION = registry.histogram(
+    "ekklesia_view_duration_seconds",
+    "Duration of view function calls.",
+    label_names=("view",),
+)
+TEMPLATE_GET_DURATION = registry.histogram(
+    "ekklesia_template_get_duration_seconds",
+    "Time needed to load templates.",
+    label_names=("template",),
+)
+TEMPLATE_RENDER_DURATION = registry.histogram(
+    "ekklesia_template_render_duration_seconds",
+    "Time needed to render templates.",
+    label_names=("template",),
+)
+FORM_VALIDATION_DURATION = registry.histogram(
+    "ekklesia_form_validation_duration_seconds", "Duration of form validation."
+)
+SQL_DURATION = registry.histogram(
+    "ekklesia_sql_duration_seconds", "Execution time of SQL statements."
+)
+
+
+class Metrics:
+    pass
+
+
+class MetricsApp(morepath.App):
+    """Serves the metrics of `registry` in the Prometheus text format."""
+
+
+@MetricsApp.path(model=Metrics, path="")
+def metrics():
+    return Metrics()
+
+
+@MetricsApp.view(model=Metrics)
+def metrics_view(self, request):
+    return morepath.Response(
+        text=registry.render_prometheus(),
+        content_type="text/plain; version=0.0.4",
+        charset="utf-8",
+    )
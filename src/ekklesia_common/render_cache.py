@@ -0,0 +1,341 @@
+"""
+Caches rendered HTML of cells.
+
+Cells opt in by setting `cache_rendering = True`. The output of `show()` and fragment
+methods is then looked up in the render cache of the app with a key built from
+`Cell.cache_key` before Jinja is called at all.
+
+Two backends are available:
+
+* `MemoryRenderCache`: in-process LRU cache with an optional TTL.
+* `SqliteRenderCache`: SQLite file that can be shared by all worker processes on
+  a host.
+
+Entries for a model are invalidated by bumping a version number for the model that
+is part of every cache key. This happens automatically after the transaction that
+called `Base.update` on the model is committed and can be done explicitly with
+`invalidate_model`.
+
+Only output of cells without layout is cached. Layouts contain data of the current
+request like flash messages and CSRF tokens.
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import weakref
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Hashable, Optional
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+
+from ekklesia_common import database
+
+_render_caches = weakref.WeakSet()
+
+
+def model_cache_key(model) -> Optional[str]:
+    """Identifies a model object for invalidation.
+    Returns None if the model doesn't have an id.
+    """
+    model_id = getattr(model, "id", None)
+    if model_id is None:
+        return None
+
+    return f"{type(model).__name__}:{model_id}"
+
+
+class RenderCache(ABC):
+    """Base class for render cache backends that keeps hit/miss counters."""
+
+    def __init__(self, ttl: Optional[float] = None) -> None:
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        # Guards the counters and, in subclasses, the stored entries.
+        self._lock = threading.Lock()
+        _render_caches.add(self)
+
+    def make_key(self, cell_key: Hashable, model) -> str:
+        """Builds the storage key from the cell's cache key and the current version
+        of the model.
+        """
+        key = (cell_key, self.model_version(model))
+        return hashlib.sha1(repr(key).encode("utf8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        value = self._get(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key: str, value: str) -> None:
+        expires_at = None if self.ttl is None else time.time() + self.ttl
+        self._set(key, value, expires_at)
+
+    def invalidate_model(self, model) -> None:
+        """Makes all cached entries for `model` unreachable."""
+        model_key = model_cache_key(model)
+        if model_key is not None:
+            self.invalidate_model_key(model_key)
+
+    def invalidate_model_key(self, model_key: str) -> None:
+        """Like `invalidate_model`, with the key returned by `model_cache_key`."""
+        self._bump_model_version(model_key)
+
+    def model_version(self, model) -> int:
+        model_key = model_cache_key(model)
+        if model_key is None:
+            return 0
+        return self._model_version(model_key)
+
+    @property
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self)}
+
+    @abstractmethod
+    def clear(self) -> None:
+        pass
+
+    @abstractmethod
+    def __len__(self) -> int:
+        pass
+
+    @abstractmethod
+    def _get(self, key: str) -> Optional[str]:
+        pass
+
+    @abstractmethod
+    def _set(self, key: str, value: str, expires_at: Optional[float]) -> None:
+        pass
+
+    @abstractmethod
+    def _model_version(self, model_key: str) -> int:
+        pass
+
+    @abstractmethod
+    def _bump_model_version(self, model_key: str) -> None:
+        pass
+
+
+class MemoryRenderCache(RenderCache):
+    """In-process LRU cache. The least recently used entries are evicted when
+    `max_entries` is exceeded, expired entries are dropped when they are accessed.
+    """
+
+    def __init__(self, max_entries: int = 10000, ttl: Optional[float] = None) -> None:
+        super().__init__(ttl)
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, tuple[Optional[float], str]] = OrderedDict()
+        self._model_versions: dict[str, int] = {}
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            expires_at, value = entry
+            if expires_at is not None and expires_at < time.time():
+                del self._entries[key]
+                return None
+
+            self._entries.move_to_end(key)
+            return value
+
+    def _set(self, key, value, expires_at):
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _model_version(self, model_key):
+        return self._model_versions.get(model_key, 0)
+
+    def _bump_model_version(self, model_key):
+        with self._lock:
+            version = self._model_versions.get(model_key, 0)
+            self._model_versions[model_key] = version + 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._model_versions.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SqliteRenderCache(RenderCache):
+    """Render cache stored in a SQLite database file.
+    All worker processes using the same file share cached entries and invalidations.
+
+    Reading entries doesn't write to the database. When `max_entries` is exceeded,
+    expired entries and the oldest entries are evicted. The number of entries is
+    only checked every `evict_interval` writes, so the cache can temporarily grow
+    beyond `max_entries`.
+    """
+
+    def __init__(
+        self, path: str, max_entries: int = 10000, ttl: Optional[float] = None
+    ) -> None:
+        super().__init__(ttl)
+        self.path = path
+        self.max_entries = max_entries
+        self.evict_interval = max(1, max_entries // 100)
+        self._writes_since_evict = 0
+        self._local = threading.local()
+
+    @property
+    def _connection(self) -> sqlite3.Connection:
+        # Connections must not be shared between threads or forked processes.
+        conn_pid = getattr(self._local, "pid", None)
+        if conn_pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            # accessed_at is the time of the last write, entries are not touched
+            # when they are read.
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS render_cache "
+                "(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL, "
+                "accessed_at REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS model_version "
+                "(model_key TEXT PRIMARY KEY, version INTEGER NOT NULL)"
+            )
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+
+        return self._local.conn
+
+    def _get(self, key):
+        row = self._connection.execute(
+            "SELECT value FROM render_cache "
+            "WHERE key = ? AND (expires_at IS NULL OR expires_at >= ?)",
+            (key, time.time()),
+        ).fetchone()
+
+        return None if row is None else row[0]
+
+    def _set(self, key, value, expires_at):
+        conn = self._connection
+        conn.execute(
+            "INSERT OR REPLACE INTO render_cache (key, value, expires_at, accessed_at) "
+            "VALUES (?, ?, ?, ?)",
+            (key, value, expires_at, time.time()),
+        )
+
+        with self._lock:
+            self._writes_since_evict += 1
+            evict = self._writes_since_evict >= self.evict_interval
+            if evict:
+                self._writes_since_evict = 0
+
+        if evict:
+            self._evict(conn)
+
+    def _evict(self, conn):
+        (num_entries,) = conn.execute("SELECT count(*) FROM render_cache").fetchone()
+        if num_entries <= self.max_entries:
+            return
+
+        conn.execute(
+            "DELETE FROM render_cache WHERE expires_at IS NOT NULL AND expires_at < ?",
+            (time.time(),),
+        )
+        conn.execute(
+            "DELETE FROM render_cache WHERE key IN "
+            "(SELECT key FROM render_cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        )
+
+    def _model_version(self, model_key):
+        row = self._connection.execute(
+            "SELECT version FROM model_version WHERE model_key = ?", (model_key,)
+        ).fetchone()
+        return 0 if row is None else row[0]
+
+    def _bump_model_version(self, model_key):
+        self._connection.execute(
+            "INSERT INTO model_version (model_key, version) VALUES (?, 1) "
+            "ON CONFLICT (model_key) DO UPDATE SET version = version + 1",
+            (model_key,),
+        )
+
+    def clear(self):
+        self._connection.execute("DELETE FROM render_cache")
+        self._connection.execute("DELETE FROM model_version")
+
+    def __len__(self):
+        (num_entries,) = self._connection.execute(
+            "SELECT count(*) FROM render_cache"
+        ).fetchone()
+        return num_entries
+
+
+def make_render_cache(render_cache_settings) -> Optional[RenderCache]:
+    """Creates a render cache from the `render_cache` setting section.
+    Returns None if the render cache is disabled.
+    """
+    backend = render_cache_settings.backend
+    max_entries = render_cache_settings.max_entries
+    ttl = render_cache_settings.ttl
+
+    if not backend:
+        return None
+    elif backend == "memory":
+        return MemoryRenderCache(max_entries=max_entries, ttl=ttl)
+    elif backend == "sqlite":
+        return SqliteRenderCache(
+            render_cache_settings.path, max_entries=max_entries, ttl=ttl
+        )
+    else:
+        raise ValueError(f"unknown render cache backend: {backend}")
+
+
+def invalidate_model_in_render_caches(model_key: str):
+    for render_cache in list(_render_caches):
+        render_cache.invalidate_model_key(model_key)
+
+
+_PENDING_INVALIDATIONS = "render_cache_pending_invalidations"
+
+
+@database.after_model_update
+def invalidate_model_after_commit(model):
+    """Invalidates cached output for `model` when the transaction is committed.
+    Invalidating earlier would allow concurrent requests to cache output that was
+    rendered from the old state under the new model version.
+    Models that don't belong to a session are invalidated immediately.
+    """
+    model_key = model_cache_key(model)
+    if model_key is None:
+        return
+
+    session = object_session(model) if hasattr(model, "_sa_instance_state") else None
+    if session is None:
+        invalidate_model_in_render_caches(model_key)
+    else:
+        # Keys are computed now, SQL can't be emitted for expired ids after commit.
+        session.info.setdefault(_PENDING_INVALIDATIONS, set()).add(model_key)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_committed_models(session):
+    for model_key in session.info.pop(_PENDING_INVALIDATIONS, ()):
+        invalidate_model_in_render_caches(model_key)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _discard_pending_invalidations(session, previous_transaction):
+    if not session.in_transaction():
+        session.info.pop(_PENDING_INVALIDATIONS, None)
@@ -1,12 +1,14 @@
+from contextlib import ExitStack
 from functools import cached_property
-from typing import Any
+from typing import Any, Iterable, Iterator
 
 import morepath
 from eliot import start_action
 from jinja2 import Template
 from sqlalchemy.orm import Query, Session
 
-from ekklesia_common import database
+from ekklesia_common import database, metrics
+from ekklesia_common.ekklesia_auth import EkklesiaAuthRequest
 from ekklesia_common.permission import Permission
 
 
@@ -21,7 +23,51 @@ class RenderTemplateError(Exception):
         super().__init__(msg)
 
 
-class EkklesiaRequest(morepath.Request):
+class StreamingBody:
+    """WSGI response body that is generated while it is sent to the client.
+
+    The view returns before the body is generated, so tweens that manage state for
+    the request, like the database transaction or the eliot task, must not finish
+    it when the response is returned. They push their cleanup to `exit_stack`
+    instead, which is exited when the body is complete, generating it failed or
+    the server closed the response.
+    """
+
+    def __init__(self, chunks: Iterable[bytes]) -> None:
+        self._chunks = chunks
+        self._generator = None
+        self.exit_stack = ExitStack()
+
+    def __iter__(self):
+        if self._generator is None:
+            self._generator = self._generate()
+        return self._generator
+
+    def _generate(self):
+        with self.exit_stack:
+            yield from self._chunks
+
+    def close(self):
+        if self._generator is None:
+            # The body was never iterated, the cleanup must run anyway.
+            self.exit_stack.close()
+        else:
+            self._generator.close()
+
+
+def streaming_html_response(chunks: Iterable[str]) -> morepath.Response:
+    """Creates a response that sends the HTML chunks to the client as they are
+    produced. The body is generated after the view returns, but still in the
+    database transaction and eliot task of the request, see `StreamingBody`.
+    """
+    return morepath.Response(
+        app_iter=StreamingBody(chunk.encode("utf8") for chunk in chunks),
+        content_type="text/html",
+        charset="utf8",
+    )
+
+
+class EkklesiaRequest(EkklesiaAuthRequest):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
@@ -34,7 +80,9 @@ class EkklesiaRequest(morepath.Request):
         user = self.identity.user
         if user is None:
             return
-        user = self.db_session.merge(user)
+        # The identity policy usually loads the user in the session of this request.
+        if user not in self.db_session:
+            user = self.db_session.merge(user)
         return user
 
     def permitted_for_current_user(self, obj: Any, permission: Permission) -> bool:
@@ -43,18 +91,80 @@ class EkklesiaRequest(morepath.Request):
     def q(self, *args, **kwargs) -> Query:
         return self.db_session.query(*args, **kwargs)
 
+    @cached_property
+    def _templates(self) -> dict[str, Template]:
+        return {}
+
+    def get_template(self, name: str) -> Template:
+        """Loads a template once per request. Templates are rendered repeatedly
+        when cells for collections are rendered, so this avoids the
+        up-to-date check of the Jinja template cache for each item.
+        """
+        jinja_template = self._templates.get(name)
+        if jinja_template is None:
+            with start_action(
+                action_type="template-get", name=name
+            ), metrics.TEMPLATE_GET_DURATION.time(template=name):
+                jinja_template = self.app.jinja_env.get_template(name)
+            self._templates[name] = jinja_template
+
+        return jinja_template
+
     def render_template(self, name: str, **context) -> str:
-        with start_action(action_type="template-get", name=name):
-            jinja_template: Template = self.app.jinja_env.get_template(name)
+        jinja_template = self.get_template(name)
         try:
             with start_action(
                 action_type="template-render", filename=jinja_template.filename
-            ):
+            ), metrics.TEMPLATE_RENDER_DURATION.time(template=name):
                 return jinja_template.render(**context)
 
         except Exception as e:
             raise RenderTemplateError(name, e) from e
 
+    def stream_template(
+        self, name: str, buffer_size: int = None, **context
+    ) -> Iterator[str]:
+        """Renders a template incrementally. Output is collected until at least
+        `buffer_size` characters are available and then yielded.
+        Exceptions raised while rendering are wrapped in `RenderTemplateError`.
+        """
+        jinja_template = self.get_template(name)
+        if buffer_size is None:
+            buffer_size = self.app.settings.common.template_stream_buffer_size
+
+        return self._stream_template(name, jinja_template, buffer_size, context)
+
+    def _stream_template(self, name, jinja_template, buffer_size, context):
+        action = start_action(
+            action_type="template-stream", filename=jinja_template.filename
+        )
+        buffered = []
+        buffered_size = 0
+
+        # The action context stays active while the consumer processes a chunk.
+        with action.context():
+            try:
+                for part in jinja_template.generate(**context):
+                    buffered.append(part)
+                    buffered_size += len(part)
+
+                    if buffered_size >= buffer_size:
+                        yield "".join(buffered)
+                        buffered = []
+                        buffered_size = 0
+
+                if buffered:
+                    yield "".join(buffered)
+
+            except GeneratorExit:
+                action.finish()
+                raise
+            except Exception as e:
+                action.finish(e)
+                raise RenderTemplateError(name, e) from e
+
+            action.finish()
+
     def flash(self, message, category="primary"):
         flashed_messages = self.browser_session.setdefault("flashed_messages", [])
         flashed_messages.append((category, message))
@@ -62,3 +172,10 @@ class EkklesiaRequest(morepath.Request):
     @property
     def htmx(self):
         return self.headers.get("HX-Request")
+
+    @property
+    def htmx_target(self):
+        """Id of the target element of an htmx request, None for other requests."""
+        if not self.htmx:
+            return None
+        return self.headers.get("HX-Target")
@@ -0,0 +1,164 @@
+"""
+Verbosity profiles for request logging.
+
+The profile is selected by the `log_profile` setting in the `common` section:
+
+* `full`: all messages are written.
+* `sampled`: all messages of `log_sample_percent` percent of the requests are
+  written, the other requests are handled like with `errors_only`.
+* `errors_only`: messages of a request are kept in memory and only written if the
+  request fails (exception or status >= 500), takes longer than
+  `log_latency_threshold_ms` or a warning or error was logged in the request, like
+  a slow query or an exceeded SQL statement budget.
+
+Buffering works by wrapping eliot destinations in a `RequestLogGate`, which
+`logging.init_logging` does. Messages logged outside of requests are always
+passed through.
+"""
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+from eliot import Message
+
+LOG_PROFILES = ("full", "sampled", "errors_only")
+#: messages with these `log_level` values make a buffer write all messages
+WRITE_LOG_LEVELS = frozenset(("WARNING", "ERROR", "CRITICAL"))
+
+
+def _must_be_written(message: dict) -> bool:
+    return (
+        message.get("log_level") in WRITE_LOG_LEVELS
+        or message.get("message_type") == "eliot:traceback"
+    )
+
+
+class RequestLogBuffer:
+    """Collects the messages of a request and the destinations they were meant for."""
+
+    def __init__(self, max_messages: int = 1000) -> None:
+        self.max_messages = max_messages
+        self.entries = []
+        self.dropped = 0
+        # Until the request handler reports a status, the request counts as failed.
+        self.failed = True
+        # Set when a warning or error was logged, the request status doesn't matter.
+        self.has_warnings = False
+
+    def add(self, destination, message: dict):
+        if _must_be_written(message):
+            self.has_warnings = True
+
+        if len(self.entries) < self.max_messages:
+            self.entries.append((destination, message))
+        else:
+            self.dropped += 1
+
+    def set_status(self, status_code: int):
+        self.failed = status_code >= 500
+
+    def flush(self):
+        for destination, message in self.entries:
+            destination(message)
+
+        self.entries = []
+
+        if self.dropped:
+            Message.log(message_type="request-log-buffer-full", dropped=self.dropped)
+
+
+_current_buffer: ContextVar[Optional[RequestLogBuffer]] = ContextVar(
+    "request_log_buffer", default=None
+)
+
+
+class RequestLogGate:
+    """eliot destination wrapper that holds back messages while a request log
+    buffer is active.
+    """
+
+    def __init__(self, destination) -> None:
+        self.destination = destination
+
+    def __call__(self, message: dict):
+        buffer = _current_buffer.get()
+        if buffer is None:
+            self.destination(message)
+        else:
+            buffer.add(self.destination, message)
+
+
+@contextmanager
+def buffered_request_log(
+    max_messages: int = 1000, latency_threshold_ms: Optional[float] = None
+):
+    """Buffers messages logged inside the block. They are written when the block
+    raises an exception, the buffer is marked as failed, a warning or error was
+    logged or the block takes longer than `latency_threshold_ms`. Otherwise, they
+    are discarded.
+    """
+    buffer = RequestLogBuffer(max_messages)
+    token = _current_buffer.set(buffer)
+    start = time.perf_counter()
+
+    try:
+        yield buffer
+    finally:
+        _current_buffer.reset(token)
+        duration_ms = (time.perf_counter() - start) * 1000
+        slow = latency_threshold_ms is not None and duration_ms > latency_threshold_ms
+
+        if buffer.failed or buffer.has_warnings or slow:
+            buffer.flush()
+
+
+class RequestLogProfile:
+    def __init__(
+        self,
+        profile: str = "full",
+        sample_percent: float = 10,
+        latency_threshold_ms: Optional[float] = None,
+        max_buffered_messages: int = 1000,
+    ) -> None:
+        if profile not in LOG_PROFILES:
+            raise ValueError(
+                f"unknown log profile {profile}, must be one of {LOG_PROFILES}"
+            )
+
+        self.profile = profile
+        self.sample_percent = sample_percent
+        self.latency_threshold_ms = latency_threshold_ms
+        self.max_buffered_messages = max_buffered_messages
+
+    @classmethod
+    def from_settings(cls, common_settings):
+        return cls(
+            common_settings.log_profile,
+            common_settings.log_sample_percent,
+            common_settings.log_latency_threshold_ms,
+            common_settings.log_max_buffered_messages,
+        )
+
+    def buffer_request(self) -> bool:
+        if self.profile == "full":
+            return False
+        elif self.profile == "sampled":
+            return random.random() * 100 >= self.sample_percent
+        else:
+            return True
+
+    @contextmanager
+    def request_log(self):
+        """Yields a `RequestLogBuffer` if messages of this request should be
+        buffered, None if they are written immediately.
+        """
+        if not self.buffer_request():
+            yield None
+            return
+
+        with buffered_request_log(
+            self.max_buffered_messages, self.latency_threshold_ms
+        ) as buffer:
+            yield buffer
@@ -0,0 +1,43 @@
+"""
+Render the stored HTML of all Markdown columns again, for example after
+`MARKDOWN_EXTENSIONS` changed.
+
+Usage:
+
+    ekklesia-rerender-markdown postgresql+psycopg2:///ekklesia ekklesia_portal.datamodel
+"""
+import argparse
+import importlib
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from ekklesia_common.database import rerender_markdown
+
+parser = argparse.ArgumentParser("Ekklesia Common rerender_markdown.py")
+parser.add_argument("db_uri", help="SQLAlchemy database URI")
+parser.add_argument(
+    "modules", nargs="+", help="modules that must be imported to define the models"
+)
+parser.add_argument(
+    "-b", "--batch-size", type=int, default=500, help="rows per UPDATE, default 500"
+)
+
+
+def main():
+    args = parser.parse_args()
+
+    for module_name in args.modules:
+        importlib.import_module(module_name)
+
+    engine = create_engine(args.db_uri)
+
+    with Session(engine) as session:
+        num_rows = rerender_markdown(session, batch_size=args.batch_size)
+        session.commit()
+
+    print(f"rendered Markdown for {num_rows} rows")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,240 @@
+"""
+Timing of SQL statements for SQLAlchemy engines.
+
+`SQLInstrumentation` is installed on an engine and removed again with `uninstall`.
+Uninstalled instrumentation doesn't add any overhead because the engine event
+listeners are removed.
+
+Statements executed inside a `track_statements` block are also counted for a
+`StatementBudget`, which is used to find requests that run too many statements
+or the same statement over and over again (N+1 queries).
+"""
+import logging
+import re
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Optional
+
+from sqlalchemy import event
+
+from ekklesia_common import metrics
+
+sqllog = logging.getLogger("sqllog")
+
+#: upper bounds of the histogram buckets in milliseconds, the last bucket is unbounded
+HISTOGRAM_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+
+_WHITESPACE_RE = re.compile(r"\s+")
+_PLACEHOLDER_RE = re.compile(
+    r"%\(\w+\)s"  # psycopg2 named parameters
+    r"|'(?:[^']|'')*'"  # string literals
+    r"|\b\d+(?:\.\d+)?\b"  # number literals
+    r"|\?"
+)
+_PLACEHOLDER_LIST_RE = re.compile(r"\(\?(?:\s*,\s*\?)+\)")
+
+
+@lru_cache(maxsize=2048)
+def fingerprint(statement: str) -> str:
+    """Normalizes a SQL statement so that statements that only differ in parameters
+    or literal values get the same fingerprint.
+    """
+    normalized = _WHITESPACE_RE.sub(" ", statement).strip()
+    normalized = _PLACEHOLDER_RE.sub("?", normalized)
+    return _PLACEHOLDER_LIST_RE.sub("(?...)", normalized)
+
+
+class StatementBudgetExceeded(Exception):
+    def __init__(self, violations: dict) -> None:
+        self.violations = violations
+        super().__init__(f"SQL statement budget exceeded: {violations}")
+
+
+class StatementBudget:
+    """Counts statements and their execution time for a unit of work, usually a
+    request. Limits that are None are not checked. A limit is violated when it is
+    exceeded, for `repeated_statement_threshold` by the number of executions of
+    statements with the same fingerprint.
+    """
+
+    def __init__(
+        self,
+        max_statements: Optional[int] = None,
+        max_duration_ms: Optional[float] = None,
+        repeated_statement_threshold: Optional[int] = None,
+    ) -> None:
+        self.max_statements = max_statements
+        self.max_duration_ms = max_duration_ms
+        self.repeated_statement_threshold = repeated_statement_threshold
+        self.count = 0
+        self.duration_ns = 0
+        self.fingerprints: Counter[str] = Counter()
+
+    def add(self, statement_fingerprint: str, duration_ns: int):
+        self.count += 1
+        self.duration_ns += duration_ns
+        self.fingerprints[statement_fingerprint] += 1
+
+    @property
+    def duration_ms(self) -> float:
+        return self.duration_ns / 1_000_000
+
+    def violations(self) -> dict:
+        """Returns the exceeded limits, an empty dict means everything is fine."""
+        violations = {}
+
+        if self.max_statements is not None and self.count > self.max_statements:
+            violations["statements"] = self.count
+
+        if self.max_duration_ms is not None and self.duration_ms > self.max_duration_ms:
+            violations["duration_ms"] = self.duration_ms
+
+        if self.repeated_statement_threshold is not None:
+            repeated = {
+                fp: count
+                for fp, count in self.fingerprints.items()
+                if count > self.repeated_statement_threshold
+            }
+            if repeated:
+                violations["repeated_statements"] = repeated
+
+        return violations
+
+
+_current_budget: ContextVar[Optional[StatementBudget]] = ContextVar(
+    "current_statement_budget", default=None
+)
+
+
+@contextmanager
+def track_statements(budget: StatementBudget):
+    """Counts all statements recorded by an installed `SQLInstrumentation` inside
+    the block for `budget`.
+    """
+    token = _current_budget.set(budget)
+    try:
+        yield budget
+    finally:
+        _current_budget.reset(token)
+
+
+@dataclass
+class TimedStatement:
+    statement: str
+    duration_ns: int
+    timestamp: float
+
+    @property
+    def duration_ms(self) -> float:
+        return self.duration_ns / 1_000_000
+
+
+class StatementStats:
+    """Histogram of execution times for statements with the same fingerprint."""
+
+    def __init__(self):
+        self.count = 0
+        self.total_ns = 0
+        self.max_ns = 0
+        self.bucket_counts = [0] * (len(HISTOGRAM_BUCKETS_MS) + 1)
+
+    def add(self, duration_ns):
+        self.count += 1
+        self.total_ns += duration_ns
+        self.max_ns = max(self.max_ns, duration_ns)
+        bucket = bisect_left(HISTOGRAM_BUCKETS_MS, duration_ns / 1_000_000)
+        self.bucket_counts[bucket] += 1
+
+    def as_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "total_ms": self.total_ns / 1_000_000,
+            "max_ms": self.max_ns / 1_000_000,
+            "buckets": dict(
+                zip([*HISTOGRAM_BUCKETS_MS, "inf"], self.bucket_counts, strict=True)
+            ),
+        }
+
+
+class SQLInstrumentation:
+    """Measures execution time of SQL statements.
+    Keeps the last `ring_size` statements, aggregates execution times per statement
+    fingerprint and logs statements that are slower than `slow_query_ms`.
+    """
+
+    def __init__(self, slow_query_ms: Optional[float] = 300, ring_size: int = 256):
+        self.slow_query_ms = slow_query_ms
+        self.recent_statements: deque[TimedStatement] = deque(maxlen=ring_size)
+        self.stats: dict[str, StatementStats] = {}
+        self._lock = threading.Lock()
+        self._engines = []
+
+    def install(self, engine):
+        event.listen(engine, "before_cursor_execute", self._before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", self._after_cursor_execute)
+        self._engines.append(engine)
+
+    def uninstall(self, engine=None):
+        """Removes the instrumentation from `engine` or from all engines."""
+        engines = list(self._engines) if engine is None else [engine]
+        for engine in engines:
+            event.remove(engine, "before_cursor_execute", self._before_cursor_execute)
+            event.remove(engine, "after_cursor_execute", self._after_cursor_execute)
+            self._engines.remove(engine)
+
+    def _before_cursor_execute(self, conn, cursor, statement, params, context, many):
+        conn.info["statement_start_ns"] = time.perf_counter_ns()
+
+    def _after_cursor_execute(self, conn, cursor, statement, params, context, many):
+        start_ns = conn.info.pop("statement_start_ns", None)
+        if start_ns is None:
+            return
+
+        self.record(
+            statement, time.perf_counter_ns() - start_ns, conn.connection.connection
+        )
+
+    def record(self, statement: str, duration_ns: int, dbapi_connection=None):
+        """Records the execution time of a statement.
+        If `dbapi_connection` is a psycopg2_debug connection with statement history,
+        slow queries are logged with the statement from the history which
+        includes the parameters.
+        """
+        self.recent_statements.append(
+            TimedStatement(statement, duration_ns, time.time())
+        )
+        statement_fingerprint = fingerprint(statement)
+
+        with self._lock:
+            stats = self.stats.get(statement_fingerprint)
+            if stats is None:
+                stats = self.stats[statement_fingerprint] = StatementStats()
+            stats.add(duration_ns)
+
+        metrics.SQL_DURATION.observe(duration_ns / 1_000_000_000)
+
+        budget = _current_budget.get()
+        if budget is not None:
+            budget.add(statement_fingerprint, duration_ns)
+
+        duration_ms = duration_ns / 1_000_000
+        if self.slow_query_ms is not None and duration_ms > self.slow_query_ms:
+            history = getattr(dbapi_connection, "history", None)
+            if history is not None:
+                statement = history.last_statement
+            sqllog.warning("slow query %.1fms:\n%s", duration_ms, statement)
+
+    def reset(self):
+        with self._lock:
+            self.recent_statements.clear()
+            self.stats.clear()
+
+    def stats_as_dict(self) -> dict:
+        with self._lock:
+            return {fp: stats.as_dict() for fp, stats in self.stats.items()}
@@ -1,11 +1,14 @@
 # -*- coding: utf-8 -*-
 
+import importlib.metadata
 import os
+import sys
 from datetime import datetime
-from typing import Union
+from typing import Optional, Union
 
 import case_conversion
-from jinja2 import PackageLoader, PrefixLoader, Undefined
+import jinja2
+from jinja2 import FileSystemBytecodeCache, PackageLoader, PrefixLoader, Undefined
 from jinja2.filters import pass_context
 from markupsafe import Markup
 import pypugjs.utils
@@ -98,6 +101,11 @@ def enum_value(context, instance):
 
 
 def markdown(text):
+    # Texts loaded from a MarkdownHTMLMixin column already include the HTML.
+    html = getattr(text, "html", None)
+    if html is not None:
+        return Markup(html)
+
     return Markup(md.convert(text))
 
 
@@ -109,6 +117,56 @@ def make_template_loader(app_config, package_name):
     return template_loader
 
 
+def _package_version(name):
+    try:
+        return importlib.metadata.version(name)
+    except importlib.metadata.PackageNotFoundError:
+        return "dev"
+
+
+def versioned_template_cache_dir(base_dir: str) -> str:
+    """Returns a subdirectory of `base_dir` for compiled templates.
+    Templates compiled with other versions of the Pug compiler, Jinja or Python are
+    kept apart.
+    """
+    version = "py{}{}-jinja{}-pypugjs{}-ekklesia_common{}".format(
+        sys.version_info.major,
+        sys.version_info.minor,
+        jinja2.__version__,
+        _package_version("pypugjs"),
+        _package_version("ekklesia-common"),
+    )
+    return os.path.join(base_dir, version)
+
+
+def make_bytecode_cache(base_dir: Optional[str]) -> Optional[FileSystemBytecodeCache]:
+    """Creates a bytecode cache that stores compiled templates in a versioned
+    subdirectory of `base_dir`. Returns None if no directory is given.
+
+    Cached templates are looked up by template name and a checksum of the source,
+    so changed templates are compiled again. Pug preprocessing is skipped on cache
+    hits because the cached code already contains the compiled Pug template.
+    """
+    if base_dir is None:
+        return None
+
+    cache_dir = versioned_template_cache_dir(base_dir)
+    os.makedirs(cache_dir, exist_ok=True)
+    return FileSystemBytecodeCache(cache_dir)
+
+
+def compile_templates(jinja_env, extensions=tuple(PugExtension.file_extensions)):
+    """Loads all templates with the given file extensions from the environment's
+    loader, which fills the bytecode cache if the environment has one.
+    Returns the names of the compiled templates.
+    """
+    names = [name for name in jinja_env.list_templates() if name.endswith(extensions)]
+    for name in names:
+        jinja_env.get_template(name)
+
+    return names
+
+
 def make_jinja_env(jinja_environment_class, jinja_options, app):
     def make_babel_filter(func_name):
         def babel_filter_wrapper(context, value):
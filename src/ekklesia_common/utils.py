@@ -1,3 +1,24 @@
 import functools
+from decimal import Decimal
+
+import orjson
+
+from ekklesia_common.lid import LID
 
 cached_property = functools.cached_property
+
+
+def _json_default(value):
+    if isinstance(value, LID):
+        return str(value)
+    elif isinstance(value, Decimal):
+        return str(value)
+
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def json_bytes(value) -> bytes:
+    """Serializes to UTF-8 encoded JSON with orjson.
+    Supports LID, datetime, Decimal and enums.
+    """
+    return orjson.dumps(value, default=_json_default)
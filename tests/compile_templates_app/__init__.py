@@ -0,0 +1,9 @@
+from ekklesia_common.app import EkklesiaBrowserApp
+
+
+class CompileTemplatesTestApp(EkklesiaBrowserApp):
+    package_name = "tests.compile_templates_app"
+
+
+class NoTemplatesTestApp(EkklesiaBrowserApp):
+    package_name = "tests.compile_templates_app"
@@ -0,0 +1,6 @@
+from tests.compile_templates_app import CompileTemplatesTestApp
+
+
+@CompileTemplatesTestApp.concept("example")
+class Example:
+    pass
@@ -0,0 +1,187 @@
+import more.babel_i18n
+import more.browser_session
+import morepath
+import more.transaction
+import transaction
+from eliot import MemoryLogger, Message, add_destinations, remove_destination
+from eliot.testing import swap_logger
+from pytest import fixture
+from sqlalchemy import create_engine, text
+from webtest import TestApp as Client
+
+from ekklesia_common.app import EkklesiaBrowserApp
+from ekklesia_common.identity_policy import NoIdentity
+from ekklesia_common.request import streaming_html_response
+from ekklesia_common.request_log import RequestLogGate
+from ekklesia_common.sql_instrumentation import SQLInstrumentation
+
+
+class StreamingTestApp(EkklesiaBrowserApp):
+    pass
+
+
+class StreamingTestModel:
+    pass
+
+
+class AnonymousIdentityPolicy(morepath.IdentityPolicy):
+    def identify(self, request):
+        return NoIdentity()
+
+    def remember(self, response, request, identity):
+        pass
+
+    def forget(self, response, request):
+        pass
+
+
+@StreamingTestApp.identity_policy()
+def get_identity_policy():
+    return AnonymousIdentityPolicy()
+
+
+@StreamingTestApp.verify_identity(identity=NoIdentity)
+def verify_identity(identity):
+    return True
+
+
+EVENTS = []
+
+
+@StreamingTestApp.path(model=StreamingTestModel, path="/stream")
+def streaming_test_model():
+    return StreamingTestModel()
+
+
+@StreamingTestApp.html(model=StreamingTestModel)
+def stream(self, request):
+    transaction.get().addAfterCommitHook(lambda ok: EVENTS.append("commit"))
+
+    def chunks():
+        for chunk in ["<p>a</p>", "<p>b</p>"]:
+            EVENTS.append("chunk")
+            Message.log(message_type="stream-chunk")
+            yield chunk
+
+    return streaming_html_response(chunks())
+
+
+@StreamingTestApp.html(model=StreamingTestModel, name="plain")
+def plain(self, request):
+    return "<p>plain</p>"
+
+
+class LogProfileTestApp(StreamingTestApp):
+    pass
+
+
+@LogProfileTestApp.setting(section="common", name="log_profile")
+def log_profile_setting():
+    return "errors_only"
+
+
+@LogProfileTestApp.setting(section="database", name="statement_budget")
+def statement_budget_setting():
+    return 1
+
+
+QUERY_ENGINE = create_engine("sqlite://")
+SQLInstrumentation().install(QUERY_ENGINE)
+
+
+@LogProfileTestApp.html(model=StreamingTestModel, name="queries")
+def queries(self, request):
+    with QUERY_ENGINE.connect() as conn:
+        conn.execute(text("SELECT 1"))
+        conn.execute(text("SELECT 2"))
+    return "<p>queries</p>"
+
+
+class CountingSynch:
+    def __init__(self):
+        self.begun = 0
+
+    def newTransaction(self, txn):
+        self.begun += 1
+
+    def beforeCompletion(self, txn):
+        pass
+
+    def afterCompletion(self, txn):
+        pass
+
+
+@fixture
+def logger():
+    logger = MemoryLogger()
+    previous = swap_logger(logger)
+    yield logger
+    swap_logger(previous)
+
+
+@fixture
+def client():
+    morepath.scan(more.babel_i18n)
+    morepath.scan(more.browser_session)
+    StreamingTestApp.commit()
+    app = StreamingTestApp()
+    app.babel_init()
+    return Client(app)
+
+
+def test_streamed_body_generated_before_commit(client, logger):
+    EVENTS.clear()
+    resp = client.get("/stream")
+    assert resp.text == "<p>a</p><p>b</p>"
+    assert EVENTS == ["chunk", "chunk", "commit"]
+    # The body is generated in the eliot task of the request.
+    [request_start] = [
+        m
+        for m in logger.messages
+        if m.get("action_type") == "request" and m["action_status"] == "started"
+    ]
+    chunk_messages = [
+        m for m in logger.messages if m.get("message_type") == "stream-chunk"
+    ]
+    assert len(chunk_messages) == 2
+    assert all(m["task_uuid"] == request_start["task_uuid"] for m in chunk_messages)
+
+
+def test_transaction_app_tween_is_replaced(client):
+    assert isinstance(client.app, more.transaction.TransactionApp)
+    synch = CountingSynch()
+    transaction.manager.registerSynch(synch)
+    try:
+        resp = client.get("/stream/plain")
+    finally:
+        transaction.manager.unregisterSynch(synch)
+    assert resp.text == "<p>plain</p>"
+    assert synch.begun == 1
+
+
+def test_budget_violation_written_with_errors_only_profile():
+    morepath.scan(more.babel_i18n)
+    morepath.scan(more.browser_session)
+    LogProfileTestApp.commit()
+    app = LogProfileTestApp()
+    app.babel_init()
+    client = Client(app)
+    written = []
+    gate = RequestLogGate(written.append)
+    add_destinations(gate)
+    # eliot passes messages logged before the first destination was added.
+    written.clear()
+    try:
+        client.get("/stream/plain")
+        assert written == []
+        resp = client.get("/stream/queries")
+    finally:
+        remove_destination(gate)
+
+    assert resp.status_code == 200
+    [budget_message] = [
+        m for m in written if m.get("message_type") == "sql-budget-exceeded"
+    ]
+    assert budget_message["violations"] == {"statements": 2}
+    # The other messages of the request are written, too.
+    assert any(m.get("action_type") == "request" for m in written)
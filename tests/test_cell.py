@@ -6,9 +6,11 @@ from pytest import fixture, raises
 from ekklesia_common.app import make_jinja_env
 from ekklesia_common.cell import (
     Cell,
+    CellAttributeAccessError,
     CellAttributeNotFound,
     JinjaCellContext,
     JinjaCellEnvironment,
+    resolve_cell_attribute,
 )
 from tests.fixtures import ATestModel
 
@@ -154,6 +156,14 @@ def test_cell_template_path(cell, model):
     assert cell.template_path == "test.j2.jade"
 
 
+def test_cell_template_path_uses_prefix_of_instance(cell_class, request_for_cell):
+    first = cell_class(ATestModel(), request_for_cell)
+    second = cell_class(ATestModel(), request_for_cell)
+    second.template_prefix = "prefix"
+    assert first.template_path == "test.j2.jade"
+    assert second.template_path == "prefix/test.j2.jade"
+
+
 def test_cell_show(cell, model):
     cell.show()
     cell.render_template.assert_called_with(cell.template_path)
@@ -193,6 +203,51 @@ def test_cell_render_cell_collection(cell, model):
     cell.cell.assert_any_call(model2, layout=None, some_option=42)
 
 
+def test_cell_render_collection_looks_up_cell_class_once(cell, model):
+    model2 = model.copy()
+    model2.title = "test2"
+    models = [model, model2]
+    item_cell_class = Mock()
+    item_cell_class.return_value.show = Mock(return_value="test")
+    cell._app.get_cell_class = Mock(return_value=item_cell_class)
+    result = cell.render_collection(models, separator="&", some_option=42)
+    assert result == "test&test"
+    # cell class is looked up once per model type
+    cell._app.get_cell_class.assert_called_once_with(model, "")
+    item_cell_class.assert_any_call(
+        model=model, request=cell._request, layout=None, parent=cell, some_option=42
+    )
+    item_cell_class.assert_any_call(
+        model=model2, request=cell._request, layout=None, parent=cell, some_option=42
+    )
+
+
+def test_cell_render_collection_uses_overridden_cell(cell, model):
+    calls = []
+    original_cell = cell.cell
+
+    def cell_override(item, **kwargs):
+        calls.append(item)
+        return original_cell(item, **kwargs)
+
+    item_cell_class = Mock()
+    item_cell_class.return_value.show = Mock(return_value="test")
+    cell._app.get_cell_class = Mock(return_value=item_cell_class)
+    cell.cell = cell_override
+    assert cell.render_collection([model, model]) == "test\ntest"
+    assert calls == [model, model]
+
+
+def test_cell_render_collection_chunks(cell, model):
+    models = [model.copy() for _ in range(5)]
+    item_cell_class = Mock()
+    item_cell_class.return_value.show = Mock(return_value="test")
+    cell._app.get_cell_class = Mock(return_value=item_cell_class)
+    chunks = list(cell.render_collection(models, separator="&", chunk_size=2))
+    assert chunks == ["test&test", "&test&test", "&test"]
+    assert "".join(chunks) == cell.render_collection(models, separator="&")
+
+
 def test_cell_render_cell_collection_view_method_not_callable(cell, model):
     model2 = model.copy()
     model2.title = "test2"
@@ -244,3 +299,106 @@ def test_context_resolve_or_missing_raises_exception_for_private(context):
         context.resolve_or_missing("private")
 
     assert str(exc_info.value) == expected_msg
+
+
+def test_context_resolve_or_missing_prefers_cell_instance_attribute(context, cell):
+    cell.title = "overridden"
+    assert context.resolve_or_missing("title") == "overridden"
+
+
+def test_context_resolve_or_missing_falls_back_to_template_context(jinja_env, cell):
+    parent = {"_cell": cell, "from_context": 23}
+    context = JinjaCellContext(jinja_env, parent, None, {}, {})
+    assert context.resolve_or_missing("from_context") == 23
+
+
+def test_context_resolve_or_missing_wraps_attribute_errors(
+    jinja_env, model, request_for_cell
+):
+    class FailingCell(Cell):
+        def broken(self):
+            raise AttributeError("inner")
+
+    cell = FailingCell(model, request_for_cell)
+    context = JinjaCellContext(jinja_env, {"_cell": cell}, None, {}, {})
+
+    with raises(CellAttributeAccessError) as exc_info:
+        context.resolve_or_missing("broken")
+
+    assert exc_info.value.attribute_name == "broken"
+
+
+def test_resolution_plan(cell_class):
+    plan = cell_class._resolution_plan
+    assert "test_url" in plan
+    assert "alternate_fragment" in plan
+    assert "id" in plan
+    assert "private" not in plan
+
+
+def test_resolution_plan_updated_when_class_changes(cell_class, cell):
+    cell_class.added_later = "added"
+    assert "added_later" in cell_class._resolution_plan
+    assert resolve_cell_attribute(cell, "added_later") == "added"
+
+
+def test_cell_show_uses_render_cache(cell_class, model, request_for_cell):
+    from ekklesia_common.render_cache import MemoryRenderCache
+
+    request_for_cell.i18n.get_locale = lambda: "de"
+    cell_class.cache_rendering = True
+    cell_class.render_template = Mock(return_value="rendered")
+    render_cache = MemoryRenderCache()
+
+    def make_cell(layout=False):
+        cell = cell_class(model, request_for_cell, layout=layout)
+        cell._app.render_cache = render_cache
+        return cell
+
+    assert make_cell().show() == "rendered"
+    assert make_cell().show() == "rendered"
+    assert cell_class.render_template.call_count == 1
+    assert render_cache.hits == 1
+
+    render_cache.invalidate_model(model)
+    make_cell().show()
+    assert cell_class.render_template.call_count == 2
+
+    # output with layout is never cached
+    make_cell(layout=True).show()
+    make_cell(layout=True).show()
+    assert cell_class.render_template.call_count == 4
+
+
+def test_cell_render_cache_skips_none(cell_class, model, request_for_cell):
+    from ekklesia_common.render_cache import MemoryRenderCache
+
+    request_for_cell.i18n.get_locale = lambda: "de"
+    cell_class.cache_rendering = True
+    cell_class.render_template = Mock(return_value=None)
+    render_cache = MemoryRenderCache()
+    cell = cell_class(model, request_for_cell, layout=False)
+    cell._app.render_cache = render_cache
+
+    assert cell.show() is None
+    assert cell.show() is None
+    assert len(render_cache) == 0
+
+
+def test_cell_cache_key_does_not_evaluate_model_properties(
+    cell_class, model, request_for_cell
+):
+    request_for_cell.i18n.get_locale = lambda: "de"
+    model.title = Mock(side_effect=AssertionError("model property evaluated"))
+    cell = cell_class(model, request_for_cell, layout=False, some_option=42)
+    assert cell.cache_key[3] == model.id
+    assert cell.cache_key[-1] == (("some_option", 42),)
+
+
+def test_cell_cache_key_none_without_model_id_or_simple_options(
+    cell_class, model, request_for_cell
+):
+    request_for_cell.i18n.get_locale = lambda: "de"
+    assert cell_class(model, request_for_cell, option=object()).cache_key is None
+    model.id = None
+    assert cell_class(model, request_for_cell).cache_key is None
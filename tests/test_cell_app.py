@@ -1,5 +1,13 @@
+from decimal import Decimal
+from types import SimpleNamespace as N
+
+from pytest import fixture
+from webtest import TestApp as Client
+
 from ekklesia_common.cell import Cell
-from ekklesia_common.cell_app import CellApp
+from ekklesia_common.cell_app import CellApp, json_view_name, make_cell_view
+from ekklesia_common.lid import LID
+from ekklesia_common.request import EkklesiaRequest
 from tests.fixtures import ATestModel
 
 
@@ -18,3 +26,188 @@ def test_get_cell(request_for_cell):
     ATestApp.commit()
     app = ATestApp()
     assert app.get_cell(model, request_for_cell, "name")
+
+
+class JSONTestRequest(EkklesiaRequest):
+    current_user = None
+    i18n = N(gettext=lambda s: s)
+
+
+class JSONTestApp(CellApp):
+    request_class = JSONTestRequest
+
+
+class JSONTestModel:
+    def __init__(self, id, title, secret="secret"):
+        self.id = id
+        self.title = title
+        self.secret = secret
+
+
+MODELS = {}
+
+
+@JSONTestApp.path(model=JSONTestModel, path="/{id}")
+def json_test_model(id):
+    return MODELS.get(id)
+
+
+@JSONTestApp.cell(json_view=True)
+class JSONTestModelCell(Cell):
+    _model: JSONTestModel
+    model_properties = ["id", "title"]
+    json_properties = ["display_title", "lid", "amount"]
+    template_prefix = None
+
+    def display_title(self):
+        return self.title.upper()
+
+    def lid(self):
+        return LID(1)
+
+    def amount(self):
+        return Decimal("1.50")
+
+
+@fixture
+def json_client():
+    JSONTestApp.commit()
+    return Client(JSONTestApp())
+
+
+def test_cell_json_view(json_client):
+    MODELS["a"] = JSONTestModel("a", "title a")
+    resp = json_client.get("/a/json")
+    assert resp.content_type == "application/json"
+    assert resp.json == {
+        "id": "a",
+        "title": "title a",
+        "display_title": "TITLE A",
+        "lid": str(LID(1)),
+        "amount": "1.50",
+    }
+
+
+def test_cell_json_view_not_registered_by_default():
+    ATestApp.commit()
+    assert json_view_name("name") == "name.json"
+    lookup = ATestApp.get_view.by_predicates(model=ATestModel, name="name.json")
+    assert lookup.component is None
+
+
+def test_json_data_for_collection(json_client):
+    app = json_client.app
+    request = JSONTestRequest.blank("/", app=app)
+    items = [JSONTestModel(i, f"item {i}") for i in range(3)]
+    parent = JSONTestModelCell(JSONTestModel(0, "parent"), request)
+    data = parent.json_data_for_collection(items)
+    assert [d["title"] for d in data] == ["item 0", "item 1", "item 2"]
+    assert data[2]["display_title"] == "ITEM 2"
+
+
+class PartialTestModel:
+    pass
+
+
+@JSONTestApp.path(model=PartialTestModel, path="/partial")
+def partial_test_model():
+    return PartialTestModel()
+
+
+@JSONTestApp.cell()
+class PartialTestModelCell(Cell):
+    _model: PartialTestModel
+    htmx_fragments = {"item-list": "items"}
+    template_prefix = None
+    items = Cell.template_fragment("items")
+    user_menu = Cell.fragment("user_menu")
+
+    def render_template(self, template_path):
+        return f"{template_path} layout={self.layout}"
+
+    def navigation(self):
+        return "navigation"
+
+    @Cell.fragment
+    def item(self, item_id):
+        return f"item {item_id}"
+
+    @Cell.fragment
+    def item_count(self, limit=10):
+        return f"item count {limit}"
+
+
+JSONTestApp.html(model=PartialTestModel)(make_cell_view(PartialTestModelCell))
+
+
+def test_has_fragments():
+    assert PartialTestModelCell.has_fragments()
+    assert not JSONTestModelCell.has_fragments()
+
+
+def test_fragment_for_target():
+    assert PartialTestModelCell.fragment_for_target("item-list") == "items"
+    assert PartialTestModelCell.fragment_for_target("user-menu") == "user_menu"
+    assert PartialTestModelCell.fragment_for_target("items") == "items"
+    assert PartialTestModelCell.fragment_for_target("navigation") is None
+    assert PartialTestModelCell.fragment_for_target("show") is None
+    assert PartialTestModelCell.fragment_for_target("unknown") is None
+    # Fragments with required arguments can't be rendered for a target.
+    assert PartialTestModelCell.fragment_for_target("item") is None
+    assert PartialTestModelCell.fragment_for_target("item-count") == "item_count"
+
+
+def test_cell_view_full_page(json_client):
+    resp = json_client.get("/partial")
+    assert resp.text == "partial_test_model.j2.jade layout=True"
+    assert "HX-Target" in resp.headers["Vary"]
+
+
+def test_cell_view_htmx_fragment(json_client):
+    headers = {"HX-Request": "true", "HX-Target": "item-list"}
+    resp = json_client.get("/partial", headers=headers)
+    assert resp.text == "items.j2.jade layout=False"
+
+
+def test_cell_view_htmx_unknown_target_renders_page(json_client):
+    headers = {"HX-Request": "true", "HX-Target": "navigation"}
+    resp = json_client.get("/partial", headers=headers)
+    assert resp.text == "partial_test_model.j2.jade layout=True"
+
+
+def test_cell_view_htmx_fragment_with_arguments_renders_page(json_client):
+    headers = {"HX-Request": "true", "HX-Target": "item"}
+    resp = json_client.get("/partial", headers=headers)
+    assert resp.text == "partial_test_model.j2.jade layout=True"
+
+
+def test_cell_view_target_without_htmx_renders_page(json_client):
+    resp = json_client.get("/partial", headers={"HX-Target": "item-list"})
+    assert resp.text == "partial_test_model.j2.jade layout=True"
+
+
+class StreamTestModel:
+    pass
+
+
+@JSONTestApp.path(model=StreamTestModel, path="/stream")
+def stream_test_model():
+    return StreamTestModel()
+
+
+@JSONTestApp.cell(html_view=True)
+class StreamTestModelCell(Cell):
+    _model: StreamTestModel
+    stream_response = True
+    template_prefix = None
+
+    def stream(self, buffer_size=None):
+        return iter(["<p>first</p>", "<p>second</p>"])
+
+
+def test_cell_html_view_streams(json_client):
+    resp = json_client.get("/stream")
+    assert resp.content_type == "text/html"
+    assert resp.text == "<p>first</p><p>second</p>"
+    # No fragments, so the response is the same for htmx requests.
+    assert "Vary" not in resp.headers
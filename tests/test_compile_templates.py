@@ -0,0 +1,39 @@
+import os
+import subprocess
+import sys
+
+from ekklesia_common.templating import versioned_template_cache_dir
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_compile_templates(app_class, cache_dir):
+    return subprocess.run(
+        [
+            sys.executable,
+            "-m",
+            "ekklesia_common.compile_templates",
+            app_class,
+            cache_dir,
+        ],
+        cwd=ROOT_DIR,
+        capture_output=True,
+        text=True,
+    )
+
+
+def test_compile_templates_cli(tmp_path):
+    result = run_compile_templates(
+        "tests.compile_templates_app:CompileTemplatesTestApp", str(tmp_path)
+    )
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.startswith("compiled 1 templates")
+    assert list((tmp_path / versioned_template_cache_dir("")).iterdir())
+
+
+def test_compile_templates_cli_fails_without_templates(tmp_path):
+    result = run_compile_templates(
+        "tests.compile_templates_app:NoTemplatesTestApp", str(tmp_path)
+    )
+    assert result.returncode == 1
+    assert "no templates found" in result.stderr
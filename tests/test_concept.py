@@ -0,0 +1,93 @@
+from eliot import MemoryLogger
+from eliot.testing import swap_logger
+from pytest import fixture, raises
+from webtest import TestApp as Client
+
+from ekklesia_common.concept import ConceptApp, model_identity
+
+
+class ConceptTestApp(ConceptApp):
+    pass
+
+
+class ConceptTestModel:
+    def __init__(self, id, fail=False, fail_to_dict=False):
+        self.id = id
+        self.fail = fail
+        self.fail_to_dict = fail_to_dict
+        self.to_dict_calls = 0
+
+    def to_dict(self):
+        self.to_dict_calls += 1
+        if self.fail_to_dict:
+            raise RuntimeError("to_dict failed")
+        return {"id": self.id}
+
+
+MODELS = {}
+
+
+@ConceptTestApp.path(model=ConceptTestModel, path="/{id}")
+def concept_test_model(id):
+    return MODELS.get(id)
+
+
+@ConceptTestApp.html(model=ConceptTestModel)
+def show(self, request):
+    if self.fail:
+        raise ValueError("view failed")
+    return "ok"
+
+
+@fixture
+def logger():
+    logger = MemoryLogger()
+    previous = swap_logger(logger)
+    yield logger
+    swap_logger(previous)
+
+
+@fixture
+def client():
+    ConceptTestApp.commit()
+    return Client(ConceptTestApp())
+
+
+def test_model_identity():
+    assert model_identity(ConceptTestModel(1)) == {
+        "class": "ConceptTestModel",
+        "id": "1",
+    }
+    assert model_identity(object()) == {"class": "object"}
+
+
+def test_html_view_logs_only_identity(client, logger):
+    model = MODELS["a"] = ConceptTestModel("a")
+    assert client.get("/a").text == "ok"
+    assert model.to_dict_calls == 0
+    [start_message] = [
+        m for m in logger.messages if m.get("action_status") == "started"
+    ]
+    assert start_message["model"] == {"class": "ConceptTestModel", "id": "a"}
+    assert start_message["view"] == "show"
+
+
+def test_html_view_logs_model_data_on_failure(client, logger):
+    model = MODELS["b"] = ConceptTestModel("b", fail=True)
+    with raises(ValueError):
+        client.get("/b")
+    assert model.to_dict_calls == 1
+    [model_message] = [
+        m for m in logger.messages if m.get("message_type") == "html_view:model"
+    ]
+    assert model_message["model_data"] == {"id": "b"}
+
+
+def test_html_view_failing_model_data_keeps_view_exception(client, logger):
+    MODELS["c"] = ConceptTestModel("c", fail=True, fail_to_dict=True)
+    with raises(ValueError):
+        client.get("/c")
+    [model_message] = [
+        m for m in logger.messages if m.get("message_type") == "html_view:model"
+    ]
+    assert "to_dict failed" in model_message["model_data"]
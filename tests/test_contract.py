@@ -1,9 +1,39 @@
+import enum
 import json
+import math
+from types import SimpleNamespace as N
 
 import colander
-from pytest import raises
+import deform
+from babel import Locale
+from deform.widget import HiddenWidget, SelectWidget, TextAreaWidget
+from pytest import fixture, mark, raises
+from webob.multidict import MultiDict
 
-from ekklesia_common.contract import JSONObject
+from ekklesia_common.contract import (
+    CompiledValidator,
+    Form,
+    JSONObject,
+    Schema,
+    bool_property,
+    enum_property,
+    int_property,
+    json_property,
+    request_translator,
+    shared_renderer_factory,
+    string_property,
+)
+
+
+class FormTestSchema(Schema):
+    title = string_property()
+
+
+@fixture
+def form_request(tmp_path):
+    return N(
+        i18n=N(get_locale=lambda: Locale("de")), app=N(translation_dir=str(tmp_path))
+    )
 
 
 def test_json_object_serialize():
@@ -26,6 +56,18 @@ def test_json_object_not_serializable():
         obj.serialize(None, appstruct)
 
 
+def test_json_object_deserialize_falls_back_to_json():
+    obj = JSONObject()
+    result = obj.deserialize(None, '{"big": 18446744073709551616, "nan": NaN}')
+    assert result["big"] == 2**64
+    assert math.isnan(result["nan"])
+
+
+def test_json_object_serialize_non_str_keys():
+    obj = JSONObject()
+    assert obj.serialize(None, {1: "a"}) == '{"1": "a"}'
+
+
 def test_json_object_not_deserializable():
     obj = JSONObject()
     cstruct = '"a 6}'
@@ -37,3 +79,155 @@ def test_json_object_not_deserializable():
 
     with raises(colander.Invalid):
         obj.deserialize(None, cstruct)
+
+
+def test_json_object_max_bytes():
+    obj = JSONObject(max_bytes=10)
+    assert obj.deserialize(None, '{"a": "x"}') == {"a": "x"}
+
+    with raises(colander.Invalid):
+        # 11 bytes in UTF-8, but only 10 characters
+        obj.deserialize(None, '{"a": "ä"}')
+
+
+def test_json_object_max_depth():
+    obj = JSONObject(max_depth=2)
+    assert obj.deserialize(None, '{"a": [1, "[[{{"], "b": {}}') == {
+        "a": [1, "[[{{"],
+        "b": {},
+    }
+
+    with raises(colander.Invalid):
+        obj.deserialize(None, '{"a": [{"b": 1}]}')
+
+
+def test_json_object_schema():
+    class ContentSchema(colander.MappingSchema):
+        name = colander.SchemaNode(colander.String())
+        size = colander.SchemaNode(colander.Int(), missing=0)
+
+    obj = JSONObject(schema=ContentSchema())
+    assert obj.deserialize(None, '{"name": "a", "size": 3, "other": 1}') == {
+        "name": "a",
+        "size": 3,
+    }
+
+    with raises(colander.Invalid):
+        obj.deserialize(None, '{"size": 3}')
+
+
+def test_form_translates_for_request_locale(form_request):
+    form = Form(FormTestSchema(), form_request)
+
+    with raises(deform.ValidationFailure) as e:
+        form.validate([("title", "")])
+
+    assert "Pflichtangabe" in e.value.render()
+
+
+def test_forms_share_renderer_factory(form_request):
+    first = Form(FormTestSchema(), form_request)
+    second = Form(FormTestSchema(), form_request)
+    assert first.renderer.factory is second.renderer.factory
+    assert first.renderer.factory is shared_renderer_factory(Form.deform_template_dirs)
+
+
+def test_request_translator_created_once(form_request):
+    assert request_translator(form_request) is request_translator(form_request)
+
+
+class Color(enum.Enum):
+    RED = "red"
+    GREEN = "green"
+
+
+class ConformanceSchema(Schema):
+    title = string_property(validator=colander.Length(min=3, max=10))
+    abstract = string_property(missing="", widget=TextAreaWidget())
+    secret = string_property(missing=None, widget=HiddenWidget())
+    count = int_property(missing=0, validator=colander.Range(min=0))
+    color = enum_property(
+        Color,
+        missing=Color.RED,
+        widget=SelectWidget(values=[("", "-"), ("RED", "red"), ("GREEN", "green")]),
+    )
+    data = json_property(missing=None)
+    dropped = int_property(missing=colander.drop)
+
+
+CONFORMANCE_CASES = [
+    [("title", "abc")],
+    [("title", "  abc  "), ("count", " 5 ")],
+    [("title", "ab")],
+    [("title", "abcdefghijkl")],
+    [],
+    [("title", "abc"), ("count", "-1")],
+    [("title", "abc"), ("count", "x")],
+    [("title", "abc"), ("count", "")],
+    [("title", "abc"), ("color", "GREEN")],
+    [("title", "abc"), ("color", "")],
+    [("title", "abc"), ("color", "BLUE")],
+    [("title", "abc"), ("data", '{"a": [1, 2]}')],
+    [("title", "abc"), ("data", "[1]")],
+    [("title", "abc"), ("data", "{invalid")],
+    [("title", "abc"), ("secret", " s "), ("abstract", " text\n")],
+    [("title", "abc"), ("dropped", "3")],
+    [("title", "first"), ("title", "second")],
+    [("title", "abc"), ("unknown", "x"), ("_charset_", "UTF-8")],
+    [("__start__", "title:mapping"), ("title", "abc"), ("__end__", "title:mapping")],
+]
+
+
+@mark.parametrize("controls", CONFORMANCE_CASES)
+def test_compiled_validator_conforms_to_deform(controls):
+    validator = CompiledValidator.for_form(deform.Form(ConformanceSchema()))
+    assert validator is not None
+
+    try:
+        expected = deform.Form(ConformanceSchema()).validate(controls)
+    except deform.ValidationFailure:
+        expected = None
+
+    assert validator.validate(MultiDict(controls)) == expected
+
+
+def test_compiled_validator_unsupported_schemas():
+    class WithBool(Schema):
+        flag = bool_property()
+
+    class WithDeferred(Schema):
+        title = string_property(missing=colander.deferred(lambda node, kw: ""))
+
+    class WithNested(Schema):
+        nested = FormTestSchema()
+
+    class WithMultiSelect(Schema):
+        title = string_property(widget=SelectWidget(values=[], multiple=True))
+
+    for schema_class in (WithBool, WithDeferred, WithNested, WithMultiSelect):
+        form = deform.Form(schema_class())
+        assert CompiledValidator.for_form(form) is None
+
+
+class BoundSchema(Schema):
+    title = string_property(
+        validator=colander.deferred(lambda node, kw: colander.OneOf(kw["titles"]))
+    )
+
+
+class BoundForm(Form):
+    use_compiled_validator = True
+
+    def __init__(self, request, action):
+        schema = BoundSchema().bind(titles=["allowed"])
+        super().__init__(schema, request, action)
+        self.set_widgets({"title": TextAreaWidget()})
+
+
+def test_compiled_validator_uses_bound_form(form_request):
+    form = BoundForm(form_request, "/")
+    validator = CompiledValidator.for_form(form)
+    assert validator is not None
+    assert validator.fields[0][1] is form["title"].widget
+    assert validator.validate(MultiDict(title="allowed")) == {"title": "allowed"}
+    assert validator.validate(MultiDict(title="other")) is None
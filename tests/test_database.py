@@ -0,0 +1,281 @@
+import enum
+import json
+from datetime import datetime
+from decimal import Decimal
+from types import SimpleNamespace as N
+from unittest.mock import MagicMock, Mock
+
+from pytest import fixture, raises
+from sqlalchemy import (
+    DateTime,
+    Enum,
+    Numeric,
+    Text,
+    create_engine,
+    exc,
+    select,
+    type_coerce,
+)
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import NullPool
+
+from ekklesia_common import md
+from ekklesia_common.database import (
+    Base,
+    C,
+    InstrumentedQueuePool,
+    LIDIntType,
+    LIDType,
+    MarkdownHTMLMixin,
+    _pool_args,
+    copy_buffer,
+    copy_insert,
+    integer_pk,
+    lid_pk,
+    pool_metrics,
+    rerender_markdown,
+    to_dicts,
+)
+from ekklesia_common.lid import LID
+from ekklesia_common.metrics import MetricsRegistry
+from ekklesia_common.templating import markdown
+
+
+class MarkdownTestModel(Base, MarkdownHTMLMixin):
+    __tablename__ = "test_markdown_model"
+    markdown_columns = ["content"]
+    id = integer_pk()
+    content = C(Text)
+
+
+@fixture
+def db_session():
+    engine = create_engine("sqlite://")
+    MarkdownTestModel.__table__.create(engine)
+    with Session(engine) as session:
+        yield session
+
+
+def test_markdown_html_mixin_adds_columns():
+    columns = MarkdownTestModel.__table__.columns
+    assert "content_html" in columns
+    assert "content_source_hash" in columns
+
+
+def test_markdown_html_rendered_on_flush(db_session):
+    obj = MarkdownTestModel(content="# Heading")
+    db_session.add(obj)
+    db_session.flush()
+    assert obj.content_html == md.convert("# Heading")
+
+    obj.content = "*changed*"
+    db_session.flush()
+    assert obj.content_html == md.convert("*changed*")
+
+
+def test_markdown_html_used_by_filter(db_session, monkeypatch):
+    db_session.add(MarkdownTestModel(id=1, content="# Heading"))
+    db_session.commit()
+    db_session.expunge_all()
+
+    obj = db_session.get(MarkdownTestModel, 1)
+    assert isinstance(obj.content, md.RenderedMarkdown)
+    monkeypatch.setattr(md, "convert", None)
+    assert markdown(obj.content) == "<h1>Heading</h1>"
+
+
+def test_rerender_markdown(db_session):
+    obj = MarkdownTestModel(content="# Heading")
+    db_session.add(obj)
+    db_session.flush()
+    db_session.query(MarkdownTestModel).update({"content_html": "outdated"})
+
+    assert rerender_markdown(db_session, [MarkdownTestModel]) == 1
+    db_session.expire_all()
+    assert obj.content_html == md.convert("# Heading")
+
+
+def test_pool_args():
+    settings = N(
+        uri="postgresql+psycopg2:///test",
+        pool_mode="queue",
+        pool_size=3,
+        max_overflow=None,
+        pool_pre_ping=True,
+    )
+    assert _pool_args(settings) == {
+        "poolclass": InstrumentedQueuePool,
+        "pool_size": 3,
+        "pool_pre_ping": True,
+    }
+    assert _pool_args(N(pool_mode="null")) == {"poolclass": NullPool}
+
+
+def test_pool_args_keep_pool_of_sqlite(tmp_path):
+    assert _pool_args(N(uri="sqlite://", pool_size=3)) == {}
+    assert _pool_args(N(uri=f"sqlite:///{tmp_path}/db.sqlite", pool_size=3)) == {}
+
+
+def test_pool_metrics(tmp_path):
+    engine = create_engine(
+        f"sqlite:///{tmp_path}/db.sqlite",
+        poolclass=InstrumentedQueuePool,
+        pool_size=1,
+        max_overflow=0,
+        pool_timeout=0.01,
+    )
+    pool_metrics.reset()
+    pool_metrics.install(engine)
+
+    conn = engine.connect()
+    assert pool_metrics.in_use == 1
+
+    with raises(exc.TimeoutError):
+        engine.connect()
+
+    conn.close()
+    metrics = pool_metrics.as_dict()
+    assert metrics["checkouts"] == 1
+    assert metrics["waits"] == 1
+    assert metrics["timeouts"] == 1
+    assert metrics["in_use"] == 0
+    assert metrics["max_in_use"] == 1
+
+
+def test_pool_metrics_exported():
+    registry = MetricsRegistry()
+    pool_metrics.reset()
+    pool_metrics.register_metrics(registry)
+    pool_metrics.on_checkout()
+    pool_metrics.record_checkout_latency(0.5, waited=True)
+
+    text = registry.render_prometheus()
+    assert "# TYPE ekklesia_db_pool_waits_total counter\n" in text
+    assert "ekklesia_db_pool_waits_total 1\n" in text
+    assert "ekklesia_db_pool_checkout_seconds_total 0.5\n" in text
+    assert "# TYPE ekklesia_db_pool_connections_in_use gauge\n" in text
+    assert "ekklesia_db_pool_connections_in_use 1\n" in text
+    pool_metrics.reset()
+
+
+class CopyTestEnum(enum.Enum):
+    A = 1
+
+
+def test_copy_buffer():
+    lid = LID()
+    rows = [
+        (lid, "tab\tnew\nline\\", None),
+        (True, CopyTestEnum.A, datetime(2020, 1, 2, 3, 4, 5)),
+        (1, {"a": 1}, ["b"]),
+    ]
+    buf = copy_buffer(rows, 3)
+    assert buf.read().splitlines() == [
+        f"{lid.lid}\ttab\\tnew\\nline\\\\\t\\N",
+        "t\tA\t2020-01-02T03:04:05",
+        '1\t{"a": 1}\t["b"]',
+    ]
+
+
+def test_copy_buffer_wrong_number_of_values():
+    with raises(ValueError):
+        copy_buffer([(1, 2)], 3)
+
+
+def test_copy_buffer_bytes():
+    buf = copy_buffer([(b"\x00\xffa",)], 1)
+    assert buf.read() == "\\\\x00ff61\n"
+
+
+def test_copy_insert():
+    connection = MagicMock()
+    connection.dialect = postgresql.dialect()
+    cursor = connection.connection.cursor.return_value.__enter__.return_value
+    session = Mock(connection=Mock(return_value=connection))
+    lid = LID()
+
+    copy_insert(session, LIDPKTestModel.__table__, ["id", "title"], [(lid, "a")])
+
+    statement, buf = cursor.copy_expert.call_args[0]
+    assert statement == "COPY test_lid_pk_model (id, title) FROM STDIN"
+    assert buf.read() == f"{lid.lid}\ta\n"
+
+
+def test_lid_pk_server_default():
+    column = lid_pk()
+    assert column.primary_key
+    assert column.server_default.arg.text == "generate_lid()"
+
+
+class LIDPKTestModel(Base):
+    __tablename__ = "test_lid_pk_model"
+    id = lid_pk()
+    title = C(Text)
+
+
+def test_lid_pk_uses_lid_generator():
+    engine = create_engine("sqlite://")
+    # SQLite doesn't know generate_lid(), create the table without server default.
+    with engine.begin() as conn:
+        conn.exec_driver_sql(
+            "CREATE TABLE test_lid_pk_model (id BIGINT PRIMARY KEY, title TEXT)"
+        )
+
+    with Session(engine) as session:
+        objs = [LIDPKTestModel(title=str(ii)) for ii in range(10)]
+        session.add_all(objs)
+        session.flush()
+        ids = [obj.id for obj in objs]
+
+    assert all(isinstance(id, LID) for id in ids)
+    assert ids == sorted(ids)
+    assert len(set(ids)) == 10
+
+
+def test_lid_int_type_returns_ints(db_session):
+    lid = LID()
+    value = db_session.execute(
+        select(type_coerce(lid, LIDIntType)).add_columns(type_coerce(None, LIDIntType))
+    ).one()
+    assert value == (lid.lid, None)
+    assert type(value[0]) is int
+
+
+class SerializationTestModel(Base):
+    __tablename__ = "test_serialization_model"
+    id = C(LIDType, primary_key=True)
+    amount = C("amount_value", Numeric)
+    kind = C(Enum(CopyTestEnum))
+    created_at = C(DateTime)
+
+
+def test_to_dict_uses_column_names():
+    obj = SerializationTestModel(id=LID(1), amount=Decimal("1.50"))
+    assert obj.to_dict() == {
+        "id": LID(1),
+        "amount_value": Decimal("1.50"),
+        "kind": None,
+        "created_at": None,
+    }
+
+
+def test_to_dicts():
+    objs = [SerializationTestModel(id=LID(1)), MarkdownTestModel(id=2, content="a")]
+    assert to_dicts(objs) == [objs[0].to_dict(), objs[1].to_dict()]
+
+
+def test_to_json():
+    lid = LID()
+    obj = SerializationTestModel(
+        id=lid,
+        amount=Decimal("1.50"),
+        kind=CopyTestEnum.A,
+        created_at=datetime(2020, 1, 2, 3, 4, 5),
+    )
+    assert json.loads(obj.to_json()) == {
+        "id": str(lid),
+        "amount_value": "1.50",
+        "kind": 1,
+        "created_at": "2020-01-02T03:04:05",
+    }
@@ -1,5 +1,8 @@
+import base64
 import json
+import threading
 import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
 import morepath
 import responses
@@ -11,7 +14,10 @@ from ekklesia_common.ekklesia_auth import (
     EkklesiaAuth,
     EkklesiaAuthApp,
     EkklesiaAuthPathApp,
+    EkklesiaAuthRequest,
     EkklesiaNotAuthorized,
+    token_sub,
+    userinfo_cache,
 )
 
 #morepath.autoscan()
@@ -30,6 +36,11 @@ EKKLESIAAUTH_SETTINGS = {
 }
 
 
+@fixture(autouse=True)
+def clear_userinfo_cache():
+    userinfo_cache.clear()
+
+
 @fixture
 def browser_session():
     return Munch()
@@ -53,7 +64,7 @@ def token():
 
 @fixture
 def test_request_class(browser_session):
-    class TestRequest(morepath.Request):
+    class TestRequest(EkklesiaAuthRequest):
         @property
         def browser_session(self):
             return browser_session
@@ -248,3 +259,112 @@ def test_oauth_dance(app, client, browser_session, token):
         client.get(f"/ekklesia_auth/callback?code=deadbeef&state={state}", status=302)
         res = client.get("/ekklesia_auth/info")
         assert res.json == userinfo
+
+
+class StubIDServerHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.server.userinfo_requests.append(self.headers["Authorization"])
+        body = json.dumps({"sub": "sub_egon", "roles": ["BV"]}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@fixture
+def stub_id_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubIDServerHandler)
+    server.userinfo_requests = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@fixture
+def stub_settings(app, stub_id_server):
+    host, port = stub_id_server.server_address
+    return Munch(
+        app.settings.ekklesia_auth.__dict__,
+        userinfo_url=f"http://{host}:{port}/userinfo",
+    )
+
+
+def make_id_token(sub):
+    payload = base64.urlsafe_b64encode(json.dumps({"sub": sub}).encode())
+    return "header." + payload.decode().rstrip("=") + ".signature"
+
+
+def test_token_sub(token):
+    assert token_sub(token) is None
+    assert token_sub(dict(token, id_token=make_id_token("sub_egon"))) == "sub_egon"
+    assert token_sub(dict(token, id_token="invalid")) is None
+
+
+def test_userinfo_cached_per_sub(
+    allow_insecure_transport, stub_id_server, stub_settings, token
+):
+    id_token = make_id_token("sub_egon")
+    first = EkklesiaAuth(stub_settings, dict(token, id_token=id_token))
+    second = EkklesiaAuth(
+        stub_settings, dict(token, id_token=id_token, access_token="other")
+    )
+
+    assert first.userinfo["sub"] == "sub_egon"
+    assert second.data.roles == ["BV"]
+    assert stub_id_server.userinfo_requests == ["Bearer access"]
+
+
+def test_userinfo_cache_expires_with_token(
+    allow_insecure_transport, stub_id_server, stub_settings, token
+):
+    expiring_token = dict(token, expires_at=time.time() + 30)
+    EkklesiaAuth(stub_settings, expiring_token).userinfo
+    [(expires_at, _)] = userinfo_cache._entries.values()
+    assert expires_at == expiring_token["expires_at"]
+
+    stub_settings.userinfo_cache_ttl = 0.01
+    userinfo_cache.clear()
+    EkklesiaAuth(stub_settings, expiring_token).userinfo
+    time.sleep(0.02)
+    EkklesiaAuth(stub_settings, expiring_token).userinfo
+    assert len(stub_id_server.userinfo_requests) == 3
+
+
+def test_userinfo_cache_disabled(
+    allow_insecure_transport, stub_id_server, stub_settings, token
+):
+    stub_settings.userinfo_cache_ttl = 0
+    EkklesiaAuth(stub_settings, token).userinfo
+    EkklesiaAuth(stub_settings, token).userinfo
+    assert len(stub_id_server.userinfo_requests) == 2
+
+
+def test_ekklesia_auth_created_lazily(app, client, monkeypatch):
+    created = []
+    monkeypatch.setattr(EkklesiaAuth, "__init__", lambda *a, **k: created.append(a))
+    client.get("/ekklesia_auth/login")
+    assert created == []
+
+
+def test_userinfo_returns_copy_of_cached_data(
+    allow_insecure_transport, stub_id_server, stub_settings, token
+):
+    EkklesiaAuth(stub_settings, token).userinfo["roles"].append("changed")
+    EkklesiaAuth(stub_settings, token).userinfo["roles"].append("changed")
+    assert EkklesiaAuth(stub_settings, token).userinfo["roles"] == ["BV"]
+    assert len(stub_id_server.userinfo_requests) == 1
+
+
+def test_userinfo_refresh_skips_cache(
+    allow_insecure_transport, stub_id_server, stub_settings, token
+):
+    EkklesiaAuth(stub_settings, token).userinfo
+    EkklesiaAuth(stub_settings, token, refresh_userinfo=True).userinfo
+    EkklesiaAuth(stub_settings, token).userinfo
+    assert len(stub_id_server.userinfo_requests) == 2
@@ -0,0 +1,144 @@
+from types import SimpleNamespace as N
+
+from pytest import fixture
+from sqlalchemy import Text, create_engine, event
+from sqlalchemy.orm import Session
+
+from ekklesia_common.database import Base, C, integer_pk
+from ekklesia_common.identity_policy import (
+    EkklesiaIdentityPolicy,
+    IdentityCache,
+    NoIdentity,
+)
+
+
+class IdentityTestUser(Base):
+    __tablename__ = "test_identity_user"
+    id = integer_pk()
+    name = C(Text)
+
+
+class IdentityTestPolicy(EkklesiaIdentityPolicy):
+    user_class = IdentityTestUser
+    identity_cache = IdentityCache(ttl=30)
+
+
+@fixture
+def engine():
+    engine = create_engine("sqlite://")
+    IdentityTestUser.__table__.create(engine)
+    with Session(engine) as session:
+        session.add(IdentityTestUser(id=1, name="test"))
+        session.commit()
+    return engine
+
+
+@fixture
+def statements(engine):
+    statements = []
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def record(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    return statements
+
+
+def make_request(engine, user_id):
+    return N(browser_session={"user_id": user_id}, db_session=Session(engine))
+
+
+def test_identify_anonymous_doesnt_use_db():
+    request = N(browser_session={})
+    assert IdentityTestPolicy().identify(request) is NoIdentity
+
+
+def test_identify_uses_cache(engine, statements):
+    policy = IdentityTestPolicy()
+    policy.identity_cache.clear()
+
+    first = make_request(engine, 1)
+    assert policy.identify(first).user.name == "test"
+    first.db_session.commit()
+    first.db_session.close()
+    num_statements = len(statements)
+
+    second = make_request(engine, 1)
+    user = policy.identify(second).user
+    assert user in second.db_session
+    assert user.name == "test"
+    assert len(statements) == num_statements
+
+
+def test_identity_cache_invalidated_by_update(engine):
+    policy = IdentityTestPolicy()
+    policy.identity_cache.clear()
+
+    request = make_request(engine, 1)
+    user = policy.identify(request).user
+    assert policy.identity_cache.get(IdentityTestUser, 1) is not None
+
+    user.update(name="changed")
+    # Other requests still see the old state until the change is committed.
+    assert policy.identity_cache.get(IdentityTestUser, 1) is not None
+    request.db_session.commit()
+    assert policy.identity_cache.get(IdentityTestUser, 1) is None
+
+
+def test_identity_cache_kept_on_rollback(engine):
+    policy = IdentityTestPolicy()
+    policy.identity_cache.clear()
+
+    request = make_request(engine, 1)
+    user = policy.identify(request).user
+    user.update(name="changed")
+    request.db_session.rollback()
+    request.db_session.commit()
+    assert policy.identity_cache.get(IdentityTestUser, 1) is not None
+
+
+def test_identity_cache_ttl(engine):
+    cache = IdentityCache(ttl=-1)
+    with Session(engine) as session:
+        cache.set(IdentityTestUser, session.get(IdentityTestUser, 1))
+    assert cache.get(IdentityTestUser, 1) is None
+
+
+def test_identity_cache_disabled_by_default(engine):
+    cache = IdentityCache()
+    with Session(engine) as session:
+        cache.set(IdentityTestUser, session.get(IdentityTestUser, 1))
+    assert cache.get(IdentityTestUser, 1) is None
+
+
+def test_identity_cache_max_entries(engine):
+    cache = IdentityCache(ttl=30, max_entries=2)
+    with Session(engine) as session:
+        session.add_all(IdentityTestUser(id=id) for id in (2, 3))
+        session.flush()
+        cache.set(IdentityTestUser, session.get(IdentityTestUser, 1))
+        cache.set(IdentityTestUser, session.get(IdentityTestUser, 2))
+        cache.get(IdentityTestUser, 1)
+        cache.set(IdentityTestUser, session.get(IdentityTestUser, 3))
+
+    assert cache.get(IdentityTestUser, 1) is not None
+    assert cache.get(IdentityTestUser, 2) is None
+    assert cache.get(IdentityTestUser, 3) is not None
+
+
+class IdentityTestSubUser(IdentityTestUser):
+    pass
+
+
+def test_identity_cache_uses_policy_user_class(engine):
+    cache = IdentityCache(ttl=30)
+    with Session(engine) as session:
+        user = IdentityTestSubUser(id=4)
+        session.add(user)
+        session.flush()
+        cache.set(IdentityTestUser, user)
+        assert cache.get(IdentityTestUser, 4) is not None
+
+        user.update(name="changed")
+        session.commit()
+        assert cache.get(IdentityTestUser, 4) is None
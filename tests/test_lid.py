@@ -1,6 +1,7 @@
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 
 from freezegun import freeze_time
+from pytest import raises
 
 from ekklesia_common.lid import LID
 
@@ -45,3 +46,121 @@ def test_lid_from_str():
     lid = LID.from_str(lid_str)
     assert lid.repr == lid_str
     assert lid == lid_str
+
+
+def test_lid_has_no_instance_dict():
+    lid = LID(6705847306369952472)
+    assert not hasattr(lid, "__dict__")
+
+
+def test_lid_pickle():
+    import pickle
+
+    lid = LID(6705847306369952472)
+    assert pickle.loads(pickle.dumps(lid)) == lid
+
+
+def test_lid_from_str_accepts_lower_case_and_aliases():
+    assert LID.from_str("1egzx4rjr-31tpr") == "1EGZX4RJR-31TPR"
+    assert LID.from_str("1EGZX4RJR-3ITPR") == "1EGZX4RJR-31TPR"
+
+
+def test_lid_encode_many_decode_many():
+    from array import array
+
+    lid_ints = array("q", [6705847306369952472, 6705847306369952473])
+    lid_strs = LID.encode_many(lid_ints)
+    assert lid_strs == [str(LID(lid_int)) for lid_int in lid_ints]
+    assert LID.decode_many(lid_strs) == lid_ints
+    assert LID.encode_many([LID(lid_ints[0])]) == lid_strs[:1]
+
+
+def test_lid_generator_monotonic_within_millisecond():
+    from ekklesia_common.lid import LIDGenerator
+
+    generator = LIDGenerator()
+
+    with freeze_time("2020-08-31 12:00:01") as frozen_time:
+        lids = generator.generate(1000)
+        frozen_time.tick(timedelta(milliseconds=1))
+        next_lid = generator()
+
+    assert lids == sorted(lids)
+    assert len(set(lids)) == 1000
+    assert next_lid > lids[-1]
+    assert next_lid.milliseconds == lids[-1].milliseconds + 1
+
+
+def test_lid_generator_sequence_overflow_advances_timestamp():
+    from ekklesia_common.lid import LIDGenerator
+
+    generator = LIDGenerator(node_bits=20)
+
+    with freeze_time("2020-08-31 12:00:01") as frozen_time:
+        lids = generator.generate(10)
+        # The clock is now behind the last timestamp, LIDs must still increase.
+        frozen_time.tick(timedelta(milliseconds=1))
+        lids += generator.generate(10)
+
+    assert lids == sorted(lids)
+    assert len(set(lids)) == 20
+    assert lids[-1].milliseconds > lids[0].milliseconds + 1
+
+
+def test_lid_generator_clock_regression():
+    from ekklesia_common.lid import LIDGenerator
+
+    generator = LIDGenerator()
+
+    with freeze_time("2020-08-31 12:00:01.005"):
+        lid1 = generator()
+
+    with freeze_time("2020-08-31 12:00:01.000") as frozen_time:
+        lid2 = generator()
+        assert lid2 > lid1
+        assert lid2.milliseconds == lid1.milliseconds
+
+        # The clock catches up again.
+        frozen_time.tick(timedelta(milliseconds=10))
+        lid3 = generator()
+
+    assert lid3 > lid2
+    assert lid3.datetime == datetime(2020, 8, 31, 12, 0, 1, 10_000, tzinfo=timezone.utc)
+
+    # Large regressions don't reset the generator either.
+    with freeze_time("2020-08-31 11:00:00"):
+        lid4 = generator()
+
+    assert lid4 > lid3
+    assert lid4.milliseconds == lid3.milliseconds
+
+
+def test_lid_generator_reinit_after_fork():
+    from ekklesia_common.lid import LIDGenerator
+
+    generator = LIDGenerator()
+    generator()
+    lock = generator._lock
+    lock.acquire()
+    generator._reinit_after_fork()
+
+    assert generator._lock is not lock
+    assert generator._last_milliseconds == -1
+    generator()
+
+
+def test_lid_generator_node_id():
+    from ekklesia_common.lid import RANDOM_BITS, LIDGenerator
+
+    generator = LIDGenerator(node_id=5, node_bits=3)
+    lid = generator()
+    assert (lid.lid & (2**RANDOM_BITS - 1)) >> (RANDOM_BITS - 3) == 5
+
+    with raises(ValueError):
+        LIDGenerator(node_id=8, node_bits=3)
+
+
+def test_lid_generate():
+    lids = LID.generate(5)
+    assert len(lids) == 5
+    assert lids == sorted(lids)
@@ -0,0 +1,102 @@
+import json
+import threading
+from io import BytesIO, StringIO
+
+from ekklesia_common.lid import LID
+from ekklesia_common.logging import AsyncLogDestination, serialize_message
+
+
+def test_serialize_message():
+    lid = LID()
+    line = serialize_message({"id": lid, 1: "a", "big": 2**70})
+    assert line.endswith(b"\n")
+    assert json.loads(line) == {"id": repr(lid), "1": "a", "big": 2**70}
+
+
+def test_async_log_destination_writes_messages():
+    out = StringIO()
+    destination = AsyncLogDestination(out, batch_size=2)
+    for ii in range(5):
+        destination({"message_type": "test", "n": ii})
+    destination.shutdown()
+    lines = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert [line["n"] for line in lines] == list(range(5))
+
+
+def test_async_log_destination_writes_bytes():
+    out = BytesIO()
+    destination = AsyncLogDestination(out)
+    destination({"message_type": "test"})
+    destination.flush()
+    assert json.loads(out.getvalue()) == {"message_type": "test"}
+    destination.shutdown()
+
+
+class BlockedStream(StringIO):
+    def __init__(self):
+        super().__init__()
+        self.unblock = threading.Event()
+
+    def write(self, data):
+        self.unblock.wait(5)
+        return super().write(data)
+
+
+def test_async_log_destination_drops_messages_when_full():
+    out = BlockedStream()
+    destination = AsyncLogDestination(out, max_queue_size=2, batch_size=1)
+    for ii in range(10):
+        destination({"n": ii})
+    assert destination.dropped > 0
+    out.unblock.set()
+    destination.shutdown()
+    lines = [json.loads(line) for line in out.getvalue().splitlines()]
+    dropped_messages = [
+        line for line in lines if line.get("message_type") == "eliot:dropped_messages"
+    ]
+    assert sum(line["dropped"] for line in dropped_messages) == destination.dropped
+    assert len(lines) - len(dropped_messages) == 10 - destination.dropped
+
+
+def test_async_log_destination_counts_unserializable_messages():
+    out = StringIO()
+    destination = AsyncLogDestination(out)
+    circular = {}
+    circular["self"] = circular
+    destination({"n": 1})
+    destination({"n": circular})
+    destination({"n": 3})
+    destination.flush()
+    assert destination.dropped == 1
+    assert destination._thread.is_alive()
+    destination.shutdown()
+    lines = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert lines == [
+        {"n": 1},
+        {"n": 3},
+        {"message_type": "eliot:dropped_messages", "dropped": 1},
+    ]
+
+
+class FailingStream(StringIO):
+    def write(self, data):
+        raise OSError("disk full")
+
+
+def test_async_log_destination_survives_write_errors():
+    destination = AsyncLogDestination(FailingStream(), batch_size=1)
+    destination({"n": 1})
+    destination({"n": 2})
+    destination.flush()
+    assert destination.dropped == 2
+    assert destination._thread.is_alive()
+    destination.shutdown()
+
+
+def test_async_log_destination_shutdown_with_full_queue():
+    out = BlockedStream()
+    destination = AsyncLogDestination(out, max_queue_size=1, batch_size=1)
+    for ii in range(3):
+        destination({"n": ii})
+    destination.shutdown(timeout=0.1)
+    out.unblock.set()
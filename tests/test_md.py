@@ -1,7 +1,49 @@
-from ekklesia_common.md import convert
+import copy
+import pickle
+from concurrent.futures import ThreadPoolExecutor
+
+from ekklesia_common import md
+from ekklesia_common.md import convert, convert_many
 
 
 def test_convert():
     markdown = "# Heading"
     html = convert(markdown)
     assert "<h1>Heading</h1>" in html
+
+
+def test_convert_reuses_cached_html(monkeypatch):
+    md.reset()
+    convert("*cached*")
+    monkeypatch.setattr(md, "_convert_with", None)
+    assert convert("*cached*") == "<p><em>cached</em></p>"
+
+
+def test_convert_many():
+    texts = ["# One", "*two*", "# One"]
+    assert convert_many(texts) == [convert(text) for text in texts]
+
+
+def test_convert_threads():
+    md.reset()
+    texts = [f"# Heading {i}\n\n* item" for i in range(50)]
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        results = list(executor.map(convert, texts))
+
+    for i, html in enumerate(results):
+        assert f"<h1>Heading {i}</h1>" in html
+    assert len(md._converters) <= md.CONVERTER_POOL_SIZE
+
+
+def test_rendered_markdown_pickle_and_copy():
+    text = md.RenderedMarkdown("# Heading", "<h1>Heading</h1>")
+    for copied in [
+        pickle.loads(pickle.dumps(text)),
+        pickle.loads(pickle.dumps(text, protocol=0)),
+        copy.copy(text),
+        copy.deepcopy(text),
+    ]:
+        assert isinstance(copied, md.RenderedMarkdown)
+        assert copied == "# Heading"
+        assert copied.html == "<h1>Heading</h1>"
@@ -0,0 +1,125 @@
+import os
+
+import morepath
+from pytest import fixture
+from webtest import TestApp as Client
+
+from ekklesia_common import metrics
+from ekklesia_common.metrics import Histogram, MetricsApp, MetricsRegistry
+
+
+@fixture
+def registry(monkeypatch):
+    test_registry = MetricsRegistry()
+    monkeypatch.setattr(metrics, "registry", test_registry)
+    return test_registry
+
+
+def test_histogram_observe():
+    histogram = Histogram("h", "test", buckets=(1, 2), label_names=("view",))
+    histogram.observe(0.5, view="a")
+    histogram.observe(1.5, view="a")
+    histogram.observe(3, view="a")
+    histogram.observe(1, view="b")
+
+    series = dict(
+        (tuple(labels), counts) for labels, counts in histogram.snapshot()["series"]
+    )
+    assert series[("a",)] == [1, 1, 1, 5.0]
+    assert series[("b",)] == [1, 0, 0, 1]
+
+
+def test_render_prometheus():
+    test_registry = MetricsRegistry()
+    histogram = test_registry.histogram(
+        "test_seconds", "Test.", buckets=(0.5, 1), label_names=("view",)
+    )
+    histogram.observe(0.25, view='a"b')
+    histogram.observe(2, view='a"b')
+
+    assert test_registry.render_prometheus() == (
+        "# HELP test_seconds Test.\n"
+        "# TYPE test_seconds histogram\n"
+        'test_seconds_bucket{view="a\\"b",le="0.5"} 1\n'
+        'test_seconds_bucket{view="a\\"b",le="1"} 1\n'
+        'test_seconds_bucket{view="a\\"b",le="+Inf"} 2\n'
+        'test_seconds_sum{view="a\\"b"} 2.25\n'
+        'test_seconds_count{view="a\\"b"} 2\n'
+    )
+
+
+def test_multiprocess_merges_files(tmp_path):
+    other_process = MetricsRegistry()
+    other_process.histogram("test_seconds", "Test.", buckets=(1,)).observe(0.5)
+    other_process.enable_multiprocess(tmp_path)
+    other_process.write_snapshot()
+    # Pretend that the file was written by another process that is still running.
+    os.rename(
+        tmp_path / f"metrics-{os.getpid()}.json",
+        tmp_path / f"metrics-{os.getppid()}.json",
+    )
+
+    this_process = MetricsRegistry()
+    this_process.histogram("test_seconds", "Test.", buckets=(1,)).observe(2)
+    this_process.enable_multiprocess(tmp_path)
+
+    merged = this_process.collect()
+    assert merged["test_seconds"]["series"] == {(): [1, 1, 2.5]}
+
+
+def test_multiprocess_removes_files_of_dead_processes(tmp_path, monkeypatch):
+    dead_path = tmp_path / "metrics-999999.json"
+    dead_path.write_bytes(b"{}")
+    monkeypatch.setattr(metrics, "_process_exists", lambda pid: pid != 999999)
+
+    test_registry = MetricsRegistry()
+    test_registry.enable_multiprocess(tmp_path)
+
+    assert not dead_path.exists()
+
+
+def test_multiprocess_keeps_values_of_dead_processes(tmp_path, monkeypatch):
+    running = {999998, 999999}
+    monkeypatch.setattr(metrics, "_process_exists", lambda pid: pid in running)
+    monkeypatch.setattr(metrics.os, "getpid", lambda: 999998)
+
+    worker = MetricsRegistry()
+    worker.histogram("test_seconds", "Test.", buckets=(1,)).observe(0.5)
+    worker.callback_metric("test_total", "Test.", "counter", lambda: 3)
+    worker.callback_metric("test_in_use", "Test.", "gauge", lambda: 2)
+    worker.enable_multiprocess(tmp_path)
+    worker.write_snapshot()
+    # Pretend that the file was written by another worker.
+    os.rename(tmp_path / "metrics-999998.json", tmp_path / "metrics-999999.json")
+
+    collector = MetricsRegistry()
+    collector.enable_multiprocess(tmp_path)
+    before = collector.collect()
+    assert before["test_seconds"]["series"] == {(): [1, 0, 0.5]}
+    assert before["test_in_use"]["value"] == 2
+
+    # The worker exits, its values must still be counted.
+    running.remove(999999)
+    after = collector.collect()
+    assert not (tmp_path / "metrics-999999.json").exists()
+    assert after["test_seconds"]["series"] == before["test_seconds"]["series"]
+    assert after["test_total"]["value"] == 3
+    assert "test_in_use" not in after
+    # Collecting again doesn't add the values twice.
+    assert collector.collect() == after
+
+
+def test_metrics_app(registry):
+    class App(morepath.App):
+        pass
+
+    @App.mount(app=MetricsApp, path="metrics")
+    def mount_metrics():
+        return MetricsApp()
+
+    App.commit()
+    registry.histogram("ekklesia_request_duration_seconds", "").observe(0.1)
+
+    response = Client(App()).get("/metrics")
+    assert response.content_type == "text/plain"
+    assert "ekklesia_request_duration_seconds_count" in response.text
@@ -0,0 +1,153 @@
+from types import SimpleNamespace as N
+
+from freezegun import freeze_time
+from pytest import fixture
+from sqlalchemy import Text, create_engine
+from sqlalchemy.orm import Session
+
+from ekklesia_common import database
+from ekklesia_common.render_cache import (
+    MemoryRenderCache,
+    SqliteRenderCache,
+    make_render_cache,
+)
+
+
+@fixture(params=["memory", "sqlite"])
+def render_cache(request, tmp_path):
+    if request.param == "memory":
+        return MemoryRenderCache(max_entries=2, ttl=10)
+    else:
+        return SqliteRenderCache(str(tmp_path / "cache.sqlite"), max_entries=2, ttl=10)
+
+
+class RenderCacheTestModel(database.Base):
+    __tablename__ = "test_render_cache_model"
+    id = database.integer_pk()
+    title = database.C(Text)
+
+
+@fixture
+def db_session():
+    engine = create_engine("sqlite://")
+    RenderCacheTestModel.__table__.create(engine)
+    with Session(engine) as session:
+        yield session
+
+
+def test_get_set(render_cache):
+    assert render_cache.get("a") is None
+    render_cache.set("a", "<p>a</p>")
+    assert render_cache.get("a") == "<p>a</p>"
+    assert render_cache.stats == {"hits": 1, "misses": 1, "entries": 1}
+
+
+def test_memory_render_cache_evicts_least_recently_used():
+    render_cache = MemoryRenderCache(max_entries=2)
+    with freeze_time("2020-01-01 12:00:00") as frozen_time:
+        render_cache.set("a", "a")
+        frozen_time.tick()
+        render_cache.set("b", "b")
+        frozen_time.tick()
+        render_cache.get("a")
+        frozen_time.tick()
+        render_cache.set("c", "c")
+
+        assert render_cache.get("a") == "a"
+        assert render_cache.get("b") is None
+        assert render_cache.get("c") == "c"
+
+
+def test_sqlite_render_cache_evicts_oldest(tmp_path):
+    render_cache = SqliteRenderCache(str(tmp_path / "cache.sqlite"), max_entries=2)
+    with freeze_time("2020-01-01 12:00:00") as frozen_time:
+        render_cache.set("a", "a")
+        frozen_time.tick()
+        render_cache.set("b", "b")
+        frozen_time.tick()
+        # reading doesn't write to the database
+        render_cache.get("a")
+        frozen_time.tick()
+        render_cache.set("c", "c")
+
+        assert render_cache.get("a") is None
+        assert render_cache.get("b") == "b"
+        assert render_cache.get("c") == "c"
+
+
+def test_sqlite_render_cache_evicts_lazily(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    render_cache = SqliteRenderCache(path, max_entries=1000)
+    assert render_cache.evict_interval == 10
+    for i in range(1009):
+        render_cache.set(str(i), "x")
+    assert len(render_cache) == 1009
+    render_cache.set("last", "x")
+    assert len(render_cache) == 1000
+
+
+def test_expires_entries(render_cache):
+    with freeze_time("2020-01-01 12:00:00"):
+        render_cache.set("a", "a")
+
+    with freeze_time("2020-01-01 12:00:11"):
+        assert render_cache.get("a") is None
+
+
+def test_invalidate_model_changes_key(render_cache):
+    model = N(id=1)
+    key = render_cache.make_key("cell", model)
+    render_cache.invalidate_model(model)
+    assert render_cache.make_key("cell", model) != key
+    assert render_cache.make_key("cell", N(id=2)) == render_cache.make_key(
+        "cell", N(id=2)
+    )
+
+
+def test_model_update_invalidates(render_cache):
+    model = N(id=1, title="old")
+    key = render_cache.make_key("cell", model)
+    database.update_model(model, title="new")
+    assert render_cache.make_key("cell", model) != key
+
+
+def test_model_update_invalidates_after_commit(render_cache, db_session):
+    model = RenderCacheTestModel(id=1, title="old")
+    db_session.add(model)
+    db_session.commit()
+    key = render_cache.make_key("cell", model)
+
+    database.update_model(model, title="new")
+    assert render_cache.make_key("cell", model) == key
+    db_session.commit()
+    assert render_cache.make_key("cell", model) != key
+
+
+def test_model_update_rollback_does_not_invalidate(render_cache, db_session):
+    model = RenderCacheTestModel(id=1, title="old")
+    db_session.add(model)
+    db_session.commit()
+    key = render_cache.make_key("cell", model)
+
+    database.update_model(model, title="new")
+    db_session.rollback()
+    db_session.commit()
+    assert render_cache.make_key("cell", model) == key
+
+
+def test_sqlite_render_cache_is_shared(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    first = SqliteRenderCache(path)
+    second = SqliteRenderCache(path)
+    model = N(id=1)
+    first.set(first.make_key("cell", model), "a")
+    assert second.get(second.make_key("cell", model)) == "a"
+    first.invalidate_model(model)
+    assert second.get(second.make_key("cell", model)) is None
+
+
+def test_make_render_cache():
+    settings = N(backend=None, max_entries=10, ttl=None, path=None)
+    assert make_render_cache(settings) is None
+    settings.backend = "memory"
+    assert isinstance(make_render_cache(settings), MemoryRenderCache)
@@ -0,0 +1,53 @@
+import jinja2
+from pytest import fixture, raises
+
+from ekklesia_common.request import RenderTemplateError, streaming_html_response
+
+TEMPLATES = {
+    "list.html": "{% for i in items %}<li>{{ i }}</li>{% endfor %}",
+    "broken.html": "<p>start</p>{{ fail() }}",
+}
+
+
+@fixture
+def jinja_env(app, monkeypatch):
+    jinja_env = jinja2.Environment(loader=jinja2.DictLoader(TEMPLATES))
+    monkeypatch.setattr(app, "jinja_env", jinja_env, raising=False)
+    return jinja_env
+
+
+def test_get_template_loads_template_once(req, jinja_env):
+    assert req.get_template("list.html") is req.get_template("list.html")
+
+
+def test_stream_template(req, jinja_env):
+    chunks = list(req.stream_template("list.html", buffer_size=20, items=range(5)))
+    assert len(chunks) > 1
+    assert "".join(chunks) == req.render_template("list.html", items=range(5))
+
+
+def test_stream_template_wraps_exceptions(req, jinja_env):
+    def fail():
+        raise ValueError("failed")
+
+    chunks = req.stream_template("broken.html", buffer_size=1, fail=fail)
+    assert next(chunks) == "<p>start</p>"
+
+    with raises(RenderTemplateError) as exc_info:
+        next(chunks)
+
+    assert isinstance(exc_info.value.__cause__, ValueError)
+
+
+def test_streaming_html_response():
+    response = streaming_html_response(iter(["<p>ä</p>", "<p>b</p>"]))
+    assert response.content_type == "text/html"
+    assert response.body == "<p>ä</p><p>b</p>".encode("utf8")
+
+
+def test_htmx_target(req):
+    assert req.htmx_target is None
+    req.headers["HX-Target"] = "item-list"
+    assert req.htmx_target is None
+    req.headers["HX-Request"] = "true"
+    assert req.htmx_target == "item-list"
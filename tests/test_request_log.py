@@ -0,0 +1,99 @@
+from pytest import raises
+
+from ekklesia_common.request_log import (
+    RequestLogGate,
+    RequestLogProfile,
+    buffered_request_log,
+)
+
+
+def test_gate_passes_messages_outside_of_requests():
+    written = []
+    gate = RequestLogGate(written.append)
+    gate({"a": 1})
+    assert written == [{"a": 1}]
+
+
+def test_buffered_messages_discarded_for_successful_request():
+    written = []
+    gate = RequestLogGate(written.append)
+
+    with buffered_request_log() as buffer:
+        gate({"a": 1})
+        buffer.set_status(200)
+
+    assert written == []
+
+
+def test_buffered_messages_written_for_failed_request():
+    written = []
+    gate = RequestLogGate(written.append)
+
+    with buffered_request_log() as buffer:
+        gate({"a": 1})
+        buffer.set_status(500)
+        assert written == []
+
+    assert written == [{"a": 1}]
+
+
+def test_buffered_messages_written_on_exception():
+    written = []
+    gate = RequestLogGate(written.append)
+
+    with raises(ValueError):
+        with buffered_request_log():
+            gate({"a": 1})
+            raise ValueError()
+
+    assert written == [{"a": 1}]
+
+
+def test_buffered_messages_written_for_slow_request():
+    written = []
+    gate = RequestLogGate(written.append)
+
+    with buffered_request_log(latency_threshold_ms=-1) as buffer:
+        gate({"a": 1})
+        buffer.set_status(200)
+
+    assert written == [{"a": 1}]
+
+
+def test_buffered_messages_written_after_warning():
+    written = []
+    gate = RequestLogGate(written.append)
+    # Like the messages that eliot.stdlib.EliotHandler creates for slow queries.
+    warning = {"message_type": "eliot:stdlib", "log_level": "WARNING"}
+
+    with buffered_request_log() as buffer:
+        gate({"a": 1})
+        gate(warning)
+        buffer.set_status(200)
+
+    assert written == [{"a": 1}, warning]
+
+
+def test_buffer_limit():
+    written = []
+    gate = RequestLogGate(written.append)
+
+    with buffered_request_log(max_messages=2) as buffer:
+        for ii in range(3):
+            gate({"n": ii})
+
+    assert buffer.dropped == 1
+    assert written[:2] == [{"n": 0}, {"n": 1}]
+
+
+def test_log_profiles():
+    assert not RequestLogProfile("full").buffer_request()
+    assert RequestLogProfile("errors_only").buffer_request()
+    assert not RequestLogProfile("sampled", sample_percent=100).buffer_request()
+    assert RequestLogProfile("sampled", sample_percent=0).buffer_request()
+
+    with RequestLogProfile("full").request_log() as buffer:
+        assert buffer is None
+
+    with raises(ValueError):
+        RequestLogProfile("verbose")
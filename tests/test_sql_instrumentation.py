@@ -0,0 +1,114 @@
+import logging
+from types import SimpleNamespace as N
+
+from pytest import fixture
+from sqlalchemy import create_engine, text
+
+from ekklesia_common.sql_instrumentation import (
+    SQLInstrumentation,
+    StatementBudget,
+    fingerprint,
+    track_statements,
+)
+
+
+@fixture
+def engine():
+    return create_engine("sqlite://")
+
+
+def test_fingerprint():
+    assert fingerprint("SELECT * FROM t WHERE id = 5") == fingerprint(
+        "SELECT *\n  FROM t WHERE id = 42"
+    )
+    assert fingerprint("SELECT * FROM t WHERE id IN (%(id_1)s, %(id_2)s)") == (
+        "SELECT * FROM t WHERE id IN (?...)"
+    )
+    assert fingerprint("SELECT 'a''b'") == "SELECT ?"
+
+
+def test_install_and_uninstall(engine):
+    instrumentation = SQLInstrumentation()
+    instrumentation.install(engine)
+
+    with engine.connect() as conn:
+        conn.execute(text("SELECT 1"))
+        conn.execute(text("SELECT 2"))
+        assert "statement_start_ns" not in conn.info
+
+    assert len(instrumentation.recent_statements) == 2
+    stats = instrumentation.stats_as_dict()
+    assert stats["SELECT ?"]["count"] == 2
+
+    instrumentation.uninstall(engine)
+
+    with engine.connect() as conn:
+        conn.execute(text("SELECT 3"))
+
+    assert len(instrumentation.recent_statements) == 2
+
+
+def test_ring_buffer_size(engine):
+    instrumentation = SQLInstrumentation(ring_size=3)
+    instrumentation.install(engine)
+
+    with engine.connect() as conn:
+        for i in range(5):
+            conn.execute(text(f"SELECT {i}"))
+
+    assert [s.statement for s in instrumentation.recent_statements] == [
+        "SELECT 2",
+        "SELECT 3",
+        "SELECT 4",
+    ]
+
+
+def test_slow_query_logged(caplog):
+    instrumentation = SQLInstrumentation(slow_query_ms=10)
+
+    with caplog.at_level(logging.WARNING, logger="sqllog"):
+        instrumentation.record("SELECT fast", 1_000_000)
+        instrumentation.record("SELECT slow", 20_000_000)
+
+    assert "SELECT slow" in caplog.text
+    assert "SELECT fast" not in caplog.text
+
+
+def test_slow_query_logged_from_statement_history(caplog):
+    instrumentation = SQLInstrumentation(slow_query_ms=10)
+    dbapi_connection = N(history=N(last_statement="SELECT * FROM t WHERE id = 5"))
+
+    with caplog.at_level(logging.WARNING, logger="sqllog"):
+        instrumentation.record(
+            "SELECT * FROM t WHERE id = %(id)s", 20_000_000, dbapi_connection
+        )
+
+    assert "WHERE id = 5" in caplog.text
+
+
+def test_track_statements(engine):
+    instrumentation = SQLInstrumentation()
+    instrumentation.install(engine)
+    budget = StatementBudget(repeated_statement_threshold=2)
+
+    with engine.connect() as conn:
+        conn.execute(text("SELECT 0"))
+
+        with track_statements(budget):
+            for i in range(2):
+                conn.execute(text(f"SELECT {i} AS item"))
+
+            # reaching the threshold is fine, exceeding it is a violation
+            assert budget.violations() == {}
+            conn.execute(text("SELECT 2 AS item"))
+
+    assert budget.count == 3
+    assert budget.violations() == {"repeated_statements": {"SELECT ? AS item": 3}}
+
+
+def test_statement_budget_violations():
+    budget = StatementBudget(max_statements=1, max_duration_ms=2)
+    assert budget.violations() == {}
+    budget.add("SELECT ?", 1_000_000)
+    budget.add("SELECT ?", 2_000_000)
+    assert budget.violations() == {"statements": 2, "duration_ms": 3.0}
@@ -5,7 +5,13 @@ import jinja2.runtime
 from more.babel_i18n.request_utils import BabelRequestUtils
 from pytest import fixture
 
-from ekklesia_common.templating import make_jinja_env
+from ekklesia_common.templating import (
+    PugExtension,
+    compile_templates,
+    make_bytecode_cache,
+    make_jinja_env,
+    versioned_template_cache_dir,
+)
 
 TEST_DATETIME = datetime(2017, 1, 1, 11, 23, 42)
 TEST_DATETIME_FORMATTED = "Jan 1, 2017, 11:23:42\u202fAM"
@@ -79,3 +85,24 @@ def test_translation_with_args(app, render_string):
     app.settings.babel_i18n.default_locale = "en_US"
     res = render_string("{{ _('hello_date', date='2019-01-01', time='11:11') }}")
     assert res == "hello, today is 2019-01-01 and the time is 11:11."
+
+
+def test_compile_templates_uses_bytecode_cache(app, tmp_path, monkeypatch):
+    def make_env():
+        return make_jinja_env(
+            jinja_environment_class=JinjaTestEnvironment,
+            jinja_options=dict(
+                loader=jinja2.PackageLoader("tests"),
+                bytecode_cache=make_bytecode_cache(str(tmp_path)),
+            ),
+            app=app,
+        )
+
+    assert compile_templates(make_env()) == ["test.j2.jade"]
+    assert list((tmp_path / versioned_template_cache_dir("")).iterdir())
+
+    def fail_preprocess(*args, **kwargs):
+        raise AssertionError("template should be loaded from the cache")
+
+    monkeypatch.setattr(PugExtension, "preprocess", fail_preprocess)
+    assert make_env().get_template("test.j2.jade")